@@ -4,7 +4,7 @@
 _ldadm() {
 	local CUR="${COMP_WORDS[COMP_CWORD]}"
 	local COMMAND='LOG_LEVEL=CRITICAL ldadm'
-	local KWD_OBJECTS="user list project server"
+	local KWD_OBJECTS="user list project server access key authorized-keys nss-export replica batch daemon"
 	local KWD_SUSPENDED="--suspended"
 	local KWD_DEFAULTS="--defaults"
 	local KWD_FILE="--file"
@@ -24,29 +24,40 @@ _ldadm() {
 		unit) __ldadm_complete_unit ;;
 		server) __ldadm_complete_server ;;
 		project) __ldadm_complete_project ;;
+		access) __ldadm_complete_access ;;
+		key) __ldadm_complete_key ;;
+		authorized-keys) __ldadm_complete_authorized_keys ;;
+		nss-export) __ldadm_complete_nss_export ;;
+		replica) __ldadm_complete_replica ;;
 		*) COMPREPLY=($(compgen -W "$KWD_OBJECTS" -- $CUR)) ;;
 	esac
 }
 
-# list active or suspended users
+# list active or suspended users starting with the current word
 __ldadm_list_users() {
-	local CMDLINE="$COMMAND user list"
 	if [[ $1 = "suspended" ]]; then
-		CMDLINE="$CMDLINE $KWD_SUSPENDED"
+		__ldadm_complete_ids suspended
+	else
+		__ldadm_complete_ids user
 	fi
-	eval "$CMDLINE"
 }
 
 __ldadm_list_projects() {
-	eval "$COMMAND project list"
+	__ldadm_complete_ids project
 }
 
 __ldadm_list_servers() {
-	eval "$COMMAND server list"
+	__ldadm_complete_ids server
 }
 
 __ldadm_list_units() {
-	eval "$COMMAND $1 unit list"
+	__ldadm_complete_ids "$1-unit"
+}
+
+# IDs of the kind starting with the current word, by prefix search or from cache;
+# input is redirected from the terminal, so that the daemon can answer
+__ldadm_complete_ids() {
+	eval "$COMMAND complete $1 -- $(printf '%q' "$CUR") </dev/null"
 }
 
 # complete user commands
@@ -54,7 +65,7 @@ __ldadm_complete_user() {
 	local USERS
 
 	case "${COMP_WORDS[2]}" in
-		list|search|find)
+		list|count|search|find)
 			if [[ $COMP_CWORD -eq 3 ]]; then
 				REPLY="$KWD_SUSPENDED"
 				compopt -o nospace
@@ -87,6 +98,14 @@ __ldadm_complete_user() {
 				4) REPLY="$(__ldadm_list_users suspended) $(__ldadm_list_users)" ;;
 			esac
 			;;
+		import|export)
+			if [[ -n "$COMPLETION_LIB" ]]; then
+				_filedir
+			else
+				compopt -o default
+			fi
+			return 0
+			;;
 		rename|passwd)
 			if [[ $COMP_CWORD -eq 3 ]]; then
 				REPLY="$(__ldadm_list_users)"
@@ -124,13 +143,77 @@ __ldadm_complete_user() {
 			return
 			;;
 		*)
-			REPLY="list search find show info suspend ban lock disable restore
-			unban enable delete remove add create rename key passwd unit"
+			REPLY="list count search find show info suspend ban lock disable restore
+			unban enable delete remove add create import export rename key passwd unit"
+			;;
+	esac
+	COMPREPLY=($(compgen -W "$REPLY" -- $CUR))
+}
+
+# complete access commands
+__ldadm_complete_access() {
+	case "${COMP_WORDS[2]}" in
+		report)
+			case "${COMP_WORDS[COMP_CWORD-1]}" in
+				--user) REPLY="$(__ldadm_list_users)" ;;
+				--server) REPLY="$(__ldadm_list_servers)" ;;
+				*) REPLY="--user --server --format --max-staleness" ;;
+			esac
+			;;
+		*) REPLY="report" ;;
+	esac
+	COMPREPLY=($(compgen -W "$REPLY" -- $CUR))
+}
+
+# complete key commands
+__ldadm_complete_key() {
+	case "${COMP_WORDS[2]}" in
+		find) REPLY="--format --max-staleness" ;;
+		audit) REPLY="--format --max-staleness --min-rsa-bits" ;;
+		*) REPLY="find audit" ;;
+	esac
+	COMPREPLY=($(compgen -W "$REPLY" -- $CUR))
+}
+
+# complete authorized-keys arguments
+__ldadm_complete_authorized_keys() {
+	case "${COMP_WORDS[COMP_CWORD-1]}" in
+		--server) REPLY="$(__ldadm_list_servers)" ;;
+		*)
+			case "$CUR" in
+				-*) REPLY="--server --refresh" ;;
+				*) REPLY="$(__ldadm_list_users)" ;;
+			esac
 			;;
 	esac
 	COMPREPLY=($(compgen -W "$REPLY" -- $CUR))
 }
 
+# complete nss-export arguments
+__ldadm_complete_nss_export() {
+	case "${COMP_WORDS[COMP_CWORD-1]}" in
+		--directory)
+			if [[ -n "$COMPLETION_LIB" ]]; then
+				_filedir -d
+			else
+				compopt -o dirnames
+			fi
+			return 0
+			;;
+	esac
+	COMPREPLY=($(compgen -W "--directory --incremental" -- $CUR))
+}
+
+# complete replica commands
+__ldadm_complete_replica() {
+	case "${COMP_WORDS[2]}" in
+		sync) REPLY="$KWD_FULL" ;;
+		status) ;;
+		*) REPLY="sync status" ;;
+	esac
+	COMPREPLY=($(compgen -W "$REPLY" -- $CUR))
+}
+
 # complete list commands
 __ldadm_complete_list() {
 	return 1
@@ -139,7 +222,15 @@ __ldadm_complete_list() {
 # complete server commands
 __ldadm_complete_server() {
 	case "${COMP_WORDS[2]}" in
-		list|add|create) ;;
+		list|count|add|create) ;;
+		import|export)
+			if [[ -n "$COMPLETION_LIB" ]]; then
+				_filedir
+			else
+				compopt -o default
+			fi
+			return 0
+			;;
 		show|info)
 				REPLY="$(__ldadm_list_servers)" ;;
 		delete|remove) REPLY="$(__ldadm_list_servers)" ;;
@@ -148,7 +239,7 @@ __ldadm_complete_server() {
 			return
 			;;
 		*)
-			REPLY="list show info add create delete remove unit"
+			REPLY="list count show info add create import export delete remove unit"
 			;;
 	esac
 	COMPREPLY=($(compgen -W "$REPLY" -- $CUR))
@@ -158,7 +249,15 @@ __ldadm_complete_server() {
 # complete project commands
 __ldadm_complete_project() {
 	case "${COMP_WORDS[2]}" in
-		list|add|create) ;;
+		list|count|add|create) ;;
+		import|export)
+			if [[ -n "$COMPLETION_LIB" ]]; then
+				_filedir
+			else
+				compopt -o default
+			fi
+			return 0
+			;;
 		show|info)
 				REPLY="$(__ldadm_list_projects)" ;;
 		delete|remove) REPLY="$(__ldadm_list_projects)" ;;
@@ -185,7 +284,7 @@ __ldadm_complete_project() {
 			return
 			;;
 		*)
-			REPLY="list show info addmember addserver add create delete remove manage unit"
+			REPLY="list count show info addmember addserver add create import export delete remove manage unit"
 			;;
 	esac
 	COMPREPLY=($(compgen -W "$REPLY" -- $CUR))
@@ -194,7 +293,7 @@ __ldadm_complete_project() {
 # complete unit subcommands
 __ldadm_complete_unit() {
 	# $1 is a function to list leaves in unit tree, e.g. users, or projects
-	list_units="$COMMAND $2 unit list" # $2: top level subcommand of ldadm
+	list_units="$COMMAND $2 unit list </dev/null" # $2: top level subcommand of ldadm
 
 	case "${COMP_WORDS[3]}" in
 		list) ;;
@@ -11,17 +11,26 @@ try:
 except ImportError:
     from collections import MutableMapping
 
-from ldap3 import ALL_ATTRIBUTES, Reader, Writer
+from ldap3 import ALL_ATTRIBUTES, ALL_OPERATIONAL_ATTRIBUTES, NO_ATTRIBUTES, SUBTREE, LEVEL, Reader, Writer, ObjectDef
 from ldap3.utils.ciDict import CaseInsensitiveWithAliasDict
-from ldap3.utils.dn import safe_dn, safe_rdn
+from ldap3.utils.dn import safe_dn, safe_rdn, to_dn
+from ldap3.utils.conv import escape_filter_chars
 from ldap3.core.exceptions import LDAPKeyError
+from ldap3.core.results import RESULT_SIZE_LIMIT_EXCEEDED
 
 from .config import cfg, ConfigAttrError
 from .console import input_stderr
-from .connection import ldap
+from .connection import get_connection, cached_schema
+from .bulk import BulkWriter
+from .template import template_plan
+from .replica import local_replica
+from . import schema
 
 log = logging.getLogger(__name__)
 
+# paged results control
+_paged_results_oid = "1.2.840.113556.1.4.319"
+
 # these constants and escape_attribute_value() taken from ldap3 library:
 # https://github.com/cannatag/ldap3
 # Copyright 2014 - 2018 Giovanni Cannata
@@ -122,6 +131,40 @@ def entry_name(entry, name_attr):
 
     return name
 
+def normalize_dn(dn):
+    """Return DN in a form comparable with other normalized DNs"""
+
+    return ",".join( part.strip().lower() for part in to_dn(dn) )
+
+def object_class_key(object_class):
+    """Make a hashable key from one or more object class names"""
+
+    if type(object_class) is list:
+        return tuple(object_class)
+    else:
+        return (object_class,)
+
+class LazyObjectDef:
+    """Descriptor that loads attribute definitions from schema on first access"""
+
+    # shared between classes with the same object classes, e.g. User and UserMapping
+    _cache = {}
+
+    def __init__(self, object_class):
+        self._object_class = object_class
+
+    def __get__(self, instance, owner):
+        object_class = self._object_class
+        key = object_class_key(object_class)
+
+        try:
+            return __class__._cache[key]
+        except KeyError:
+            log.debug("Loading definition for %s" % ", ".join(key))
+            object_def = ObjectDef(object_class = object_class, schema = get_connection())
+            __class__._cache[key] = object_def
+            return object_def
+
 class MissingObjects(Exception):
     def __init__(self, name, items):
         self.name = name
@@ -168,8 +211,16 @@ class NothingSelected(ValueError):
 # if mapping:
 #     yada
 
+### Check if exists:
+# if 'foo' in mapping:
+#     yada
+
+### Count items:
+# count = len(mapping)
+
 class LdapObjectMapping(MutableMapping):
     _attribute = None
+    _object_class = None
     _name = "Objects"
 
     def __init__(self, base = None, sub_tree = True, attrs = None):
@@ -184,12 +235,43 @@ class LdapObjectMapping(MutableMapping):
         self._attrs = attrs
         self._sub_tree = sub_tree
         self._select = None
+        self._ids = None
+        self._replica = None
+
+    def from_replica(self, max_staleness = None):
+        """Read from the local replica, if enabled, synchronizing it first if
+        it is older than max_staleness seconds. Writes still go to LDAP."""
+
+        self._replica = local_replica(max_staleness)
+        return self
+
+    def _local(self, ids = None, attributes = None):
+        """Return the replica, if it can serve this read; else None"""
+
+        if not self._replica:
+            return None
+        # filters are only evaluated by the server; operational attributes aren't replicated
+        if ids is None and self._select is not None:
+            return None
+        if type(attributes) is list and ALL_OPERATIONAL_ATTRIBUTES in attributes:
+            return None
+
+        return self._replica
+
+    def _local_args(self):
+        cls = self.__class__
+        return (self._base, self._sub_tree, object_class_key(cls._object_class), cls._attribute)
 
     def select(self, criteria):
+        """Select objects by a filter, or simplified query, or an iterable of IDs.
+        IDs are consumed lazily; an iterator can only be used once."""
+
         if type(criteria) is str or criteria is None:
             self._select = criteria
+            self._ids = None
         else:
-            self._select = set(criteria)
+            self._select = None
+            self._ids = criteria
 
         return self
 
@@ -223,39 +305,168 @@ class LdapObjectMapping(MutableMapping):
 
         return "+".join( map(lambda key_val: "%s=%s" % key_val, new_rdn) )
 
-    def _get_reader(self, ids = None):
-        if ids:
+    def _windows(self, skip = ()):
+        """Yield lists of selected IDs, each small enough for a single search
+        filter; or just None, if objects are selected by filter. IDs in skip
+        are left out, e.g. those already processed according to a journal."""
+
+        if self._ids is None:
+            yield None
+            return
+
+        size = cfg.ldap.paged_search_size
+        # only IDs are remembered, to skip duplicates that would be missing once processed
+        seen = set()
+        window = []
+        for value in self._ids:
+            if value is None or value == "" or value in seen:
+                continue
+            if value in skip:
+                log.debug("Skipping %s, already processed" % value)
+                continue
+
+            seen.add(value)
+            window.append(value)
+            if len(window) >= size:
+                yield window
+                window = []
+
+        if window:
+            yield window
+        elif not seen:
+            log.info("No objects selected")
+
+    def _get_reader(self, ids = None, write = False):
+        """Make a Reader for selected objects; use the write master if the
+        entries will be modified, read replicas otherwise"""
+
+        if ids is not None:
+            if not ids:
+                raise NothingSelected("No items selected")
+
             # simplified query language can't search by multi-value attrs;
             # take just the first value then
             criteria = map(lambda x: x[0] if type(x) is list else x, ids)
             query = self.__class__._attribute + ": " + ";".join(criteria)
-        elif type(self._select) is set:
-            criteria = []
-            for value in self._select:
-                try:
-                    if value != "":
-                        criteria.append(value)
-                except TypeError:
-                    pass
-
-            if criteria:
-                query = self.__class__._attribute + ": " + ";".join(criteria)
-            else:
-                raise NothingSelected("No items selected")
         else:
             query = self._select
 
         return Reader(
-                connection = ldap,
+                connection = get_connection(write = write),
                 base = self._base,
                 query = query,
                 object_def = self.__class__._object_def,
                 sub_tree = self._sub_tree)
 
-    def _get_writer(self, ids = None):
-        attrs = self.__class__._attribute
+    def _search_filter(self, ids = None):
+        """Return the filter that the Reader would search with"""
+
         reader = self._get_reader(ids)
-        reader.search(attrs)
+        reader._create_query_filter()
+        return reader.query_filter
+
+    def _search_scope(self):
+        return SUBTREE if self._sub_tree else LEVEL
+
+    def _exists(self, ids = None):
+        """Check if any of the objects exists, transferring at most one DN"""
+
+        replica = self._local(ids)
+        if replica:
+            return replica.count(*self._local_args(), ids = ids) > 0
+
+        conn = get_connection()
+        conn.search(self._base, self._search_filter(ids),
+                search_scope = self._search_scope(),
+                attributes = NO_ATTRIBUTES,
+                size_limit = 1)
+
+        # more than one match; some servers don't return the entry then
+        if conn.result["result"] == RESULT_SIZE_LIMIT_EXCEEDED:
+            return True
+
+        for response in conn.response:
+            if response["type"] == "searchResEntry":
+                return True
+
+        return False
+
+    def starting_with(self, prefix, limit):
+        """Return up to limit IDs starting with prefix, searching by a prefix
+        filter, transferring only IDs; and whether those are all of them"""
+
+        id_attr = self.__class__._attribute
+        search_filter = "(&%s(%s=%s*))" % (self._search_filter(), id_attr,
+                escape_filter_chars(prefix))
+
+        conn = get_connection()
+        conn.search(self._base, search_filter,
+                search_scope = self._search_scope(),
+                attributes = [id_attr],
+                size_limit = limit)
+
+        ids = []
+        for response in conn.response:
+            if response["type"] != "searchResEntry":
+                continue
+            # only the ID was requested, under whichever alias the server uses;
+            # other values of multi-valued IDs needn't match
+            for values in response["attributes"].values():
+                for value in values:
+                    if str(value).lower().startswith( prefix.lower() ):
+                        ids.append( str(value) )
+
+        return ids, conn.result["result"] != RESULT_SIZE_LIMIT_EXCEEDED
+
+    def _count(self, ids = None):
+        """Count the objects with a paged search, transferring only DNs"""
+
+        replica = self._local(ids)
+        if replica:
+            return replica.count(*self._local_args(), ids = ids)
+
+        results = get_connection().extend.standard.paged_search(
+                search_base = self._base,
+                search_filter = self._search_filter(ids),
+                search_scope = self._search_scope(),
+                attributes = NO_ATTRIBUTES,
+                paged_size = cfg.ldap.paged_search_size,
+                generator = True)
+
+        count = 0
+        for response in results:
+            if response["type"] == "searchResEntry":
+                count += 1
+
+        return count
+
+    def pages(self, attributes, cookie = None):
+        """Yield entries of each page of selected objects, and the paged search
+        cookie to continue after that page; the cookie is empty after the last
+        page. Entries are raw search responses."""
+
+        conn = get_connection()
+        search_filter = self._search_filter()
+        while True:
+            conn.search(self._base, search_filter,
+                    search_scope = self._search_scope(),
+                    attributes = attributes,
+                    paged_size = cfg.ldap.paged_search_size,
+                    paged_cookie = cookie)
+
+            entries = [r for r in conn.response if r["type"] == "searchResEntry"]
+            try:
+                cookie = conn.result["controls"][_paged_results_oid]["value"]["cookie"]
+            except KeyError:
+                cookie = None # paging not supported, all entries returned
+
+            yield entries, cookie
+            if not cookie:
+                break
+
+    def _get_writer(self, ids = None):
+        reader = self._get_reader(ids, write = True)
+        reader.search(self._requested_attrs())
         return Writer.from_cursor(reader)
 
     def _make_dn(self, attrs):
@@ -269,62 +480,88 @@ class LdapObjectMapping(MutableMapping):
     def __iter__(self):
         return self.keys()
 
-    def _find_items(self, ids = None):
+    @classmethod
+    def projection(cls, names = None, binary = False, operational = False):
+        """Return attributes to request: the given names, or else attributes
+        of the object classes, except binary ones unless asked for"""
+
+        if names:
+            attributes = list(names)
+        else:
+            # the cached schema is enough, so that local reads don't connect
+            if cached_schema():
+                all_names = schema.class_attributes(cls._object_class)
+            else:
+                all_names = [ attr_def.key for attr_def in cls._object_def ]
+            attributes = [ name for name in all_names
+                    if binary or schema.value_kind(name) != schema.BINARY ]
+
+        if operational:
+            attributes.append(ALL_OPERATIONAL_ATTRIBUTES)
+
+        return attributes
+
+    def _requested_attrs(self):
         id_attr = self.__class__._attribute
         if self._attrs == ALL_ATTRIBUTES:
-            requested_attrs = self._attrs
+            return self._attrs
         elif self._attrs is None:
             requested_attrs = []
-        elif type(self._attrs) is not list:
+        elif type(self._attrs) is list:
+            requested_attrs = list(self._attrs)
+        else:
             requested_attrs = [self._attrs]
 
-        if type(requested_attrs) is list:
-            if id_attr not in requested_attrs:
-                requested_attrs.append(id_attr)
+        if id_attr not in requested_attrs:
+            requested_attrs.append(id_attr)
 
-        try:
-            reader = self._get_reader(ids)
-        except NothingSelected as nothing:
-            log.info("No objects selected")
-            raise StopIteration from nothing
+        return requested_attrs
 
-        results = reader.search_paged(
-                paged_size = cfg.ldap.paged_search_size,
-                attributes = requested_attrs)
-        found = set()
-        for entry in results:
-            id = entry[id_attr].value
-            if type(id) is list:
-                for value in id:
-                    found.add(value)
+    def _find_items(self, attributes, ids = None, write = False, skip = ()):
+        """Yield entries, searching for one window of IDs at a time;
+        when done, raise MissingObjects if any IDs were not found"""
+
+        id_attr = self.__class__._attribute
+        if ids is None:
+            windows = self._windows(skip)
+        else:
+            windows = [ids]
+
+        replica = None if write else self._local(ids, attributes)
+
+        missing = set()
+        for window in windows:
+            if replica:
+                results = replica.entries(*self._local_args(), ids = window, attributes = attributes)
             else:
-                found.add(id)
+                reader = self._get_reader(window, write = write)
+                results = reader.search_paged(
+                        paged_size = cfg.ldap.paged_search_size,
+                        attributes = attributes)
+            # IDs match case-insensitively, like in LDAP searches
+            found = set()
+            for entry in results:
+                for value in entry[id_attr].values:
+                    found.add( str(value).lower() )
 
-            yield entry
+                yield entry
 
-        self.__assert_found_all(found)
+            if window:
+                missing.update( id for id in window if id.lower() not in found )
+
+        self.__assert_found_all(missing)
 
     def values(self):
-        return self._find_items()
+        return self._find_items(self._requested_attrs())
 
     def _iter_entries(self, dns):
         id_attr = self.__class__._attribute
-        reader = self._get_reader()
-        results = reader.search_paged(
-                paged_size = cfg.ldap.paged_search_size,
-                attributes = self.__class__._attribute)
-        found = set()
-        for entry in results:
-            for value in entry[id_attr].values:
-                found.add(value)
-
+        for entry in self._find_items(id_attr):
             if dns:
                 yield entry.entry_dn
             else:
                 yield entry_name(entry, id_attr)
 
-        self.__assert_found_all(found)
-
     def dns(self):
         return self._iter_entries(dns = True)
 
@@ -332,12 +569,21 @@ class LdapObjectMapping(MutableMapping):
         return self._iter_entries(dns = False)
 
     def __contains__(self, id):
-        raise NotImplementedError
+        return self._exists([id])
 
     def __getitem__(self, id):
-        entries = self._find_items([id])
+        entries = self._find_items(self._requested_attrs(), [id])
         return [e for e in entries][0]
 
+    def writable(self, id):
+        """Read the entry from the write master, and return it ready for modification"""
+
+        writer = self._get_writer([id])
+        try:
+            return writer.entries[0]
+        except IndexError as err:
+            raise MissingObjects(self.__class__._name, [id]) from err
+
     def __setitem__(self, id, attrs):
         # Create a new virtual object
         writer = self._get_writer([id])
@@ -351,77 +597,122 @@ class LdapObjectMapping(MutableMapping):
         # Write the object to LDAP
         entry.entry_commit_changes(refresh = False)
 
+    def add_many(self, objects, on_success = None, on_failure = None):
+        """Add objects from an iterable of (key, attrs) pairs, pipelining
+        requests; results are passed to the callbacks by key"""
+
+        with BulkWriter(on_success = on_success, on_failure = on_failure) as bulk:
+            for key, attrs in objects:
+                attributes = dict( (name, attrs[name]) for name in attrs )
+                bulk.add(key, self._make_dn(attrs), None, attributes)
+
     def __delitem__(self, id):
         raise NotImplementedError
 
-    def delete(self):
-        id_attr = self.__class__._attribute
-        writer = self._get_writer()
-
-        found = set()
-        for entry in writer:
-            id = entry[id_attr].value
-            if type(id) is list:
-                for value in id:
-                    found.add(value)
-            else:
-                found.add(id)
+    @staticmethod
+    def _bulk_writer(journal, references = None, changes = None):
+        """Start bulk modification; changes dictionary gives (IDs, old DN,
+        new DN) by key. Record successes in the journal, if any, and DN
+        changes in references, including those journaled by a failed run."""
 
-            entry.entry_delete()
+        if journal is None and references is None:
+            return BulkWriter()
 
-        writer.commit(refresh = False)
+        if journal is not None and references is not None:
+            for old_dn, new_dn in journal.changes:
+                references.changed(old_dn, new_dn)
+
+        def on_success(key):
+            ids, old_dn, new_dn = changes.pop(key)
+            if journal is not None:
+                journal.record(ids, old_dn, new_dn)
+            if references is not None:
+                references.changed(old_dn, new_dn)
 
-        self.__assert_found_all(found)
+        return BulkWriter(on_success = on_success)
 
-    def move(self, dest):
+    def delete(self, journal = None, references = None):
         id_attr = self.__class__._attribute
+        skip = () if journal is None else journal
+        changes = {}
+        with self._bulk_writer(journal, references, changes) as bulk:
+            for entry in self._find_items(id_attr, write = True, skip = skip):
+                key = entry_name(entry, id_attr)
+                changes[key] = (entry[id_attr].values, entry.entry_dn, None)
+                bulk.delete(key, entry.entry_dn)
+
+    def move(self, dest, journal = None, references = None):
         try:
             new_base = dest._base
         except AttributeError:
             new_base = dest
 
-        writer = self._get_writer()
-
-        found = set()
-        for entry in writer:
-            id = entry[id_attr].value
-            if type(id) is list:
-                for value in id:
-                    found.add(value)
-            else:
-                found.add(id)
-
-            entry.entry_move(new_base)
-
-        writer.commit(refresh = False)
-
-        self.__assert_found_all(found)
-
-    def __assert_found_all(self, found):
+        id_attr = self.__class__._attribute
+        skip = () if journal is None else journal
+        changes = {}
+        with self._bulk_writer(journal, references, changes) as bulk:
+            for entry in self._find_items(id_attr, write = True, skip = skip):
+                key = entry_name(entry, id_attr)
+                rdn = "+".join( safe_rdn(entry.entry_dn) )
+                changes[key] = (entry[id_attr].values, entry.entry_dn, rdn + "," + new_base)
+                bulk.modify_dn(key, entry.entry_dn, rdn, new_superior = new_base)
+
+    def __assert_found_all(self, missing):
         """Raise an exception if not all selected items have been found."""
-        try:
-            not_found = self._select - found
-        except TypeError: # did not select by list
-            return
 
-        if not_found:
-            raise MissingObjects(self.__class__._name, not_found)
+        if missing:
+            raise MissingObjects(self.__class__._name, missing)
 
-    def rename(self, id, new_id):
+    @staticmethod
+    def _renamed_dn(dn, rdn):
+        return ",".join( [rdn] + to_dn(dn)[1:] )
+
+    def rename(self, id, new_id, references = None):
         writer = self._get_writer([id])
         entry = writer.entries[0]
+        dn = entry.entry_dn
         rdn = self._make_rdn(entry, new_id)
         entry.entry_rename(rdn)
         writer.commit(refresh = False)
 
+        if references is not None:
+            references.changed(dn, self._renamed_dn(dn, rdn))
+
+    def rename_many(self, pairs, journal = None, references = None):
+        """Rename objects from an iterable of (old ID, new ID) pairs"""
+
+        # IDs match case-insensitively, like in LDAP searches
+        new_ids = {}
+        def old_ids():
+            for old_id, new_id in pairs:
+                new_ids[old_id.lower()] = (old_id, new_id)
+                yield old_id
+
+        id_attr = self.__class__._attribute
+        self.select( old_ids() )
+        skip = () if journal is None else journal
+        changes = {}
+        with self._bulk_writer(journal, references, changes) as bulk:
+            for entry in self._find_items(id_attr, write = True, skip = skip):
+                # the entry may be found by any of its IDs
+                for value in entry[id_attr].values:
+                    if value.lower() in new_ids:
+                        old_id, new_id = new_ids.pop( value.lower() )
+                        break
+                else:
+                    bulk.fail(entry.entry_dn, "rename", "no new ID given for %s"
+                            % ", ".join(entry[id_attr].values))
+                    continue
+
+                rdn = self._make_rdn(entry, new_id)
+                changes[old_id] = ([old_id], entry.entry_dn, self._renamed_dn(entry.entry_dn, rdn))
+                bulk.modify_dn(old_id, entry.entry_dn, rdn)
+
     def __len__(self):
-        raise NotImplementedError
+        return sum( self._count(window) for window in self._windows() )
 
     def __bool__(self):
-        for item in self.keys():
-            return True
-
-        return False
+        return any( self._exists(window) for window in self._windows() )
 
 class LdapObject:
     _object_def = None
@@ -429,66 +720,93 @@ class LdapObject:
     _object_class = None
     _required_attrs = []
 
-    def __init__(self, reference_object = None, pre = {}, post = {}):
+    def __init__(self, reference_object = None, pre = {}, post = {}, record = None, checks = {}):
+        """Resolve attributes, prompting for each of them; or, if a record
+        (dictionary of attribute values) is given, take them from the record
+        without prompting, and raise an exception where input is required.
+        Values given in the record skip pre callbacks, but must pass checks."""
+
+        # templates are parsed, and attributes ordered once per class
+        self._plan = template_plan(self.__class__)
         self._callbacks_pre = pre
         self._callbacks_post = post
-        self._templates = self._read_templates()
-        self._modifiers = self._read_modifiers()
+        self._checks = checks
+        self._templates = self._plan.templates
+        self._modifiers = self._plan.modifiers
         self.attrs = CaseInsensitiveWithAliasDict()
         self.message = ""
         self._reference = reference_object
+        self._record = self._read_record(record)
+
+        # Resolve each attribute after the ones its template refers to
+        for key in self._plan.order:
+            if key.lower() == "objectclass":
+                self.attrs[key] = self.__class__._object_class
+            else:
+                self._resolve_attribute(key)
+
+        # record may contain attributes that are not resolved otherwise
+        if self._record is not None:
+            for key in self._record:
+                self._resolve_attribute(key)
 
         # resolve a message that will be output
-        try:
-            node = self.__class__._config_node
-            if not node:
-                raise ConfigAttrError()
+        if self._plan.message:
             log.debug("Attempting to format creation message")
-            message_template = node.message_on_create
-            while True: # failure is not an option
-                try:
-                    self.message = message_template.format_map(self.attrs)
-                    break
-                except KeyError as err:
-                    # key missing yet, try to resolve recursively
-                    missing_key = err.args[0]
-                    log.debug("%s missing yet, resolving recursively" % missing_key)
-                    self._resolve_attribute(missing_key)
-
-        except ConfigAttrError:
+            self.message = self._format(self._plan.message)
+        else:
             log.debug("Template not set for creation message, skipping")
-            pass # if this dict is missing, ignore
 
-        # Resolve each attribute recursively
-        for attr_def in self.__class__._object_def:
-            key = attr_def.key
-            if key in self._templates \
-                    or key in self.__class__._required_attrs \
-                    or attr_def.mandatory \
-                    or key.lower() == self.__class__.attribute.lower():
-                if key.lower() == "objectclass":
-                    self.attrs[key] = self.__class__._object_class
-                else:
-                    self._resolve_attribute(key)
+    def _read_record(self, record):
+        """Index record values by canonical attribute names"""
 
-    def _read_modifiers(self):
+        if record is None:
+            return None
+
+        result = CaseInsensitiveWithAliasDict()
+        for raw_name, value in record.items():
+            if value is None or value == "" or value == []:
+                continue # accept default
+            if type(value) is list:
+                value = [str(item) for item in value]
+            else:
+                value = str(value)
+            result[self._plan.names(raw_name)] = value
+
+        return result
+
+    def _format(self, template):
+        """Format template with resolved attributes; attributes would only be
+        missing here, if the user has deleted them, so ask again"""
+
+        while True: # failure is not an option
+            try:
+                return template.format_map(self.attrs)
+            except KeyError as err:
+                missing_key = err.args[0]
+                log.debug("%s missing yet, resolving recursively" % missing_key)
+                self._resolve_attribute(missing_key)
+
+    @classmethod
+    def _read_modifiers(cls):
         """Read from config how to modify string(s) of the default value"""
 
         result = CaseInsensitiveWithAliasDict()
         safe_modifiers = ['capitalize', 'casefold', 'lower', 'swapcase', 'title', 'upper']
 
         try:
-            node = self.__class__._config_node
+            node = cls._config_node
             if not node:
                 raise ConfigAttrError()
-            modifiers = node.attr.modify.__dict__["_cfg"]
+            modifiers = node.attr.modify
             # read key, value from config; get aliases from schema
-            for raw_name, value in modifiers.items():
+            for raw_name in modifiers:
+                value = modifiers[raw_name]
                 if value not in safe_modifiers:
                     msg = "%s() is not a permitted modifier for %s" % (value, raw_name)
                     raise ValueError(msg)
 
-                attr_names = self._canonicalize_name(raw_name)
+                attr_names = cls._canonicalize_name(raw_name)
                 result[attr_names] = value
                 log.debug("Modifier for %s: %s" % (", ".join(attr_names), value))
         except ConfigAttrError:
@@ -496,19 +814,21 @@ class LdapObject:
 
         return result
 
-    def _read_templates(self):
+    @classmethod
+    def _read_templates(cls):
         """Read format strings from config to use as default values for attributes"""
 
         result = CaseInsensitiveWithAliasDict()
 
         try:
-            node = self.__class__._config_node
+            node = cls._config_node
             if not node:
                 raise ConfigAttrError()
-            templates = node.attr.templates.__dict__["_cfg"]
+            templates = node.attr.templates
             # read key, value from config; get aliases from schema
-            for raw_name, value in templates.items():
-                attr_names = self._canonicalize_name(raw_name)
+            for raw_name in templates:
+                value = templates[raw_name]
+                attr_names = cls._canonicalize_name(raw_name)
                 log.debug("Reading template for " + ", ".join(attr_names))
                 result[attr_names] = value if type(value) is list else str(value)
         except ConfigAttrError:
@@ -519,9 +839,16 @@ class LdapObject:
     @classmethod
     def _canonicalize_name(cls, raw_name):
         """Normalize attribute name to use as CaseInsensitiveWithAliasDict index"""
+        object_def = cls._object_def
+        aliases = schema.aliases(object_class_key(cls._object_class), object_def)
+        try:
+            return list(aliases[raw_name.lower()])
+        except KeyError:
+            pass # not a name in schema, perhaps an OID
+
         # rewritten from ldap3 library:
         # take properly cased attribute name, add other names as aliases
-        definition = cls._object_def[raw_name]
+        definition = object_def[raw_name]
         all_names = [definition.key]
         if definition.oid_info:
             for name in definition.oid_info.name:
@@ -547,7 +874,7 @@ class LdapObject:
             return result
 
         # use unambiguous name as the dictionary key
-        names = self._canonicalize_name(raw_name)
+        names = self._plan.names(raw_name)
         key = names[0]
 
         if key in self.attrs: # already resolved
@@ -555,43 +882,32 @@ class LdapObject:
             return
 
         if key in self._templates:
-            # try to interpolate default value recursively
+            # interpolate default value; referred attributes are resolved by now
             log.debug("Trying to resolve template %s" % key)
-            while True: # failure is not an option
-                try:
-                    if type(self._templates[key]) is list:
-                        log.debug("%s is a list:" % key)
-                        default = []
-                        # resolve each member of the list
-                        for template in self._templates[key]:
-                            log.debug("\tAttempting to format '%s'" % template)
-                            # try to format string from a dictionary
-                            value = template.format_map(self.attrs)
-                            # apply the string modifier to each member
-                            if key in self._modifiers:
-                                modifier = self._modifiers[key]
-                                modify = getattr(value, modifier)
-                                log.debug("Applying %s() to '%s'" % (modifier, value))
-                                value = modify()
-
-                            default.append(value)
-                    else:
-                        # try to format string from a dictionary
-                        log.debug("Attempting to format '%s'" % self._templates[key])
-                        default = self._templates[key].format_map(self.attrs)
-                        # apply the string modifier
-                        if key in self._modifiers:
-                            modifier = self._modifiers[key]
-                            modify = getattr(default, modifier)
-                            log.debug("Applying %s() to '%s'" % (modifier, default))
-                            default = modify()
-
-                    break # resolving the formatter complete, go on
-                except KeyError as err:
-                    # key missing yet, try to resolve recursively
-                    missing_key = err.args[0]
-                    log.debug("%s missing yet, resolving recursively" % missing_key)
-                    self._resolve_attribute(missing_key)
+            if type(self._templates[key]) is list:
+                log.debug("%s is a list:" % key)
+                default = []
+                # resolve each member of the list
+                for template in self._templates[key]:
+                    log.debug("\tAttempting to format '%s'" % template)
+                    value = self._format(template)
+                    # apply the string modifier to each member
+                    if key in self._modifiers:
+                        modifier = self._modifiers[key]
+                        modify = getattr(value, modifier)
+                        log.debug("Applying %s() to '%s'" % (modifier, value))
+                        value = modify()
+
+                    default.append(value)
+            else:
+                log.debug("Attempting to format '%s'" % self._templates[key])
+                default = self._format(self._templates[key])
+                # apply the string modifier
+                if key in self._modifiers:
+                    modifier = self._modifiers[key]
+                    modify = getattr(default, modifier)
+                    log.debug("Applying %s() to '%s'" % (modifier, default))
+                    default = modify()
 
         elif self._reference:
             # if a reference entry is given, take default value from there
@@ -603,14 +919,23 @@ class LdapObject:
         else:
             default = None
 
-        # indirectly apply callbacks: give them current default, receive new default
+        # indirectly apply callbacks: give them current default, receive new default;
+        # unless the value is given in the record, so the default is not needed
         try:
-            callback = self._callbacks_pre[key]
-            default = execute_callback(callback, default)
+            if self._record is not None and key in self._record:
+                callback = None
+                if key in self._checks:
+                    execute_callback(self._checks[key], self._record[key])
+            else:
+                callback = self._callbacks_pre[key]
+            if callback:
+                default = execute_callback(callback, default)
         except KeyError:
             pass # no callback set
         except Exception as err:
             # the callback failed; resort to user input
+            if self._record is not None:
+                raise
             log.warn(err)
             default = None
 
@@ -627,7 +952,12 @@ class LdapObject:
             prompt = "%s: " % key
 
         while True:
-            response = input_stderr(prompt)
+            if self._record is None:
+                response = input_stderr(prompt)
+            elif key in self._record:
+                response = self._record[key]
+            else:
+                response = "" # accept default
 
             if response == ".":
                 break # dot entered, delete this attribute
@@ -643,19 +973,26 @@ class LdapObject:
                     pass
                 except Exception as err:
                     # the callback failed; require user input again
+                    if self._record is not None:
+                        raise
                     log.error(err)
                     continue
 
                 if result:
                     self.attrs[names] = result
                     break
+                elif self._record is not None:
+                    raise ValueError("%s requires a value" % key)
                 else:
                     log.error("%s requires a value" % key)
                     continue
 
             else:
                 # try to split string into a list
-                matches = re.split(r'\s*;\s+', response)
+                if type(response) is list:
+                    matches = response # from a record
+                else:
+                    matches = re.split(r'\s*;\s+', response)
                 if len(matches) == 1:
                     result = response # seems to be a single value
                 else:
@@ -669,6 +1006,8 @@ class LdapObject:
                     pass # no callback set
                 except Exception as err:
                     # the callback failed; require user input again
+                    if self._record is not None:
+                        raise
                     log.error(err)
                     continue
 
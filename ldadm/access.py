@@ -0,0 +1,126 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging
+
+from .command import Command
+from .console import Output, output_format
+from .abstract import MissingObjects, entry_name, normalize_dn
+from .replica import max_staleness
+from .config import cfg
+from .user import UserMapping
+from .server import ServerMapping
+from .project import ProjectMapping
+from .references import reference_attributes
+
+log = logging.getLogger(__name__)
+
+def _id_map(mapping):
+    """Map normalized DNs of all objects to their IDs, in one paged search"""
+
+    id_attr = mapping.__class__._attribute
+    return dict( (normalize_dn(entry.entry_dn), entry_name(entry, id_attr))
+            for entry in mapping.values() )
+
+def _values(entry, name):
+    return entry[name].values if name in entry else []
+
+class AccessMatrix:
+    """Which users reach which servers, through which projects. Only active
+    users count; project managers have the same access as members."""
+
+    def __init__(self, max_staleness = None):
+        user_ids = _id_map( UserMapping(base = cfg.user.base.active).from_replica(max_staleness) )
+        server_ids = _id_map( ServerMapping().from_replica(max_staleness) )
+
+        attributes = reference_attributes()
+        projects = ProjectMapping(attrs = attributes)
+
+        # sparse: each user's projects, each project's servers
+        self.user_projects = {}
+        self.project_servers = {}
+        for entry in projects.from_replica(max_staleness).values():
+            project = entry_name(entry, ProjectMapping._attribute)
+
+            # servers may also be listed among members
+            servers = set()
+            users = set()
+            for dn in sum( [ _values(entry, name) for name in attributes ], [] ):
+                key = normalize_dn(dn)
+                if key in server_ids:
+                    servers.add(server_ids[key])
+                elif key in user_ids:
+                    users.add(user_ids[key])
+                else:
+                    log.debug("Project %s: %s is neither an active user nor a server"
+                            % (project, dn))
+
+            if not servers:
+                continue
+            self.project_servers[project] = servers
+            for user in users:
+                self.user_projects.setdefault(user, set()).add(project)
+
+        self.users = set( user_ids.values() )
+        self.servers = set( server_ids.values() )
+
+    def user_access(self, user):
+        """Map servers the user can reach to the projects granting access"""
+
+        access = {}
+        for project in self.user_projects.get(user, ()):
+            for server in self.project_servers[project]:
+                access.setdefault(server, set()).add(project)
+
+        return access
+
+    def rows(self, user = None, server = None):
+        """Yield (user, server, projects) sorted by user, then server"""
+
+        users = [user] if user else sorted(self.user_projects)
+        for user in users:
+            access = self.user_access(user)
+            for found in sorted(access):
+                if server is None or found == server:
+                    yield user, found, sorted(access[found])
+
+class AccessCommand(Command):
+    parser_name = "access"
+    parser_args = {
+        "kwargs": {
+            "help": "Access of users to servers"
+        },
+        "subparsers_title": "Access command",
+        "subparsers": {
+            "report": {
+                "kwargs": {
+                    "parents": [output_format, max_staleness],
+                    "help": "List users, servers they can reach, and projects granting access"
+                },
+                "arguments": {
+                    "--user": {
+                        "metavar": "USER_NAME",
+                        "help": "Only servers this user can reach"
+                    },
+                    "--server": {
+                        "metavar": "SERVER",
+                        "help": "Only users who can reach this server"
+                    }
+                }
+            }
+        }
+    }
+
+    def on_access_report(self):
+        args = self._args
+        matrix = AccessMatrix(args.max_staleness)
+
+        if args.user and args.user not in matrix.users:
+            raise MissingObjects(UserMapping._name, [args.user])
+        if args.server and args.server not in matrix.servers:
+            raise MissingObjects(ServerMapping._name, [args.server])
+
+        with Output(args.output_format, ["user", "server", "projects"]) as output:
+            for user, server, projects in matrix.rows(args.user, args.server):
+                item = {"user": user, "server": server, "projects": projects}
+                output.write_item(item, "%s %s %s" % (user, server, ",".join(projects)))
@@ -0,0 +1,170 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, os, sys, time, json, socket, fcntl, subprocess
+
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import safe_rdn
+
+from .command import Command
+from .cache import cache_dir, cache_key, atomic_write
+from .config import cfg, ConfigAttrError
+from .abstract import MissingObjects, entry_name, normalize_dn
+from .user import UserMapping
+from .server import ServerMapping
+from .project import ProjectMapping
+from .references import reference_attributes
+
+log = logging.getLogger(__name__)
+
+def _setting(name, default):
+    try:
+        return int(getattr(cfg.authorized_keys, name))
+    except ConfigAttrError:
+        return default
+
+def _authorized_keys(server):
+    """Map IDs of active users, members or managers of the projects that
+    include the server, to their public keys"""
+
+    server_dn = escape_filter_chars( ServerMapping.get_dn(server) )
+    attr = cfg.project.attr
+    projects = ProjectMapping(attrs = [attr.member, attr.manager])
+    projects.select("(|%s)" % "".join( "(%s=%s)" % (name, server_dn)
+            for name in reference_attributes() ))
+
+    members = {}
+    for entry in projects.values():
+        for name in (attr.member, attr.manager):
+            if name in entry:
+                members.update( (normalize_dn(dn), dn) for dn in entry[name].values )
+
+    # look users up by the ID in RDN, then make sure the DN matches
+    id_attr = UserMapping._attribute
+    ids = set()
+    for dn in members.values():
+        for name, value in safe_rdn(dn, decompose = True):
+            if name.lower() == id_attr.lower():
+                ids.add(value)
+
+    pubkey_attr = cfg.user.attr.pubkey
+    users = UserMapping(base = cfg.user.base.active, attrs = pubkey_attr).select(ids)
+    result = {}
+    try:
+        for entry in users.values():
+            if normalize_dn(entry.entry_dn) not in members or pubkey_attr not in entry:
+                continue
+            keys = [ key.decode("utf-8") if type(key) is bytes else key
+                    for key in entry[pubkey_attr].values ]
+            result[entry_name(entry, id_attr)] = [ key.strip() for key in keys ]
+    except MissingObjects as err:
+        # suspended members, or servers
+        log.debug("Not active users: %s" % err)
+
+    return result
+
+class _HostCache:
+    """Public keys of users allowed on a server, as of the last refresh"""
+
+    def __init__(self, server):
+        try:
+            directory = cfg.authorized_keys.path
+        except ConfigAttrError:
+            directory = cache_dir("authorized-keys")
+
+        self.server = server
+        self._file_name = os.path.join(directory, cache_key(server) + ".json")
+
+    def load(self):
+        """Return time of the last refresh, and keys by user ID; or None, None"""
+
+        try:
+            with open(self._file_name) as file_object:
+                data = json.load(file_object)
+            return data["time"], data["users"]
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def refresh(self, wait = True):
+        """Fetch keys from LDAP, and save them, unless another process is
+        doing that. Return keys by user ID, or None if not waiting for it."""
+
+        with open(self._file_name + ".lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except BlockingIOError:
+                log.debug("Keys for %s are being refreshed" % self.server)
+                return None
+
+            # refreshed while waiting for the lock
+            refreshed, users = self.load()
+            if wait and refreshed is not None and time.time() - refreshed < _setting("ttl", 60):
+                return users
+
+            users = _authorized_keys(self.server)
+            data = {"time": time.time(), "server": self.server, "users": users}
+            atomic_write(self._file_name, json.dumps(data).encode("utf-8"))
+            log.info("Refreshed keys of %i user(s) for %s" % (len(users), self.server))
+
+            return users
+
+    def refresh_later(self):
+        """Refresh in a detached process, so that sshd doesn't wait for it"""
+
+        argv = [sys.executable, "-m", "ldadm.main", "authorized-keys",
+                "--refresh", "--server", self.server]
+        subprocess.Popen(argv, stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL,
+                stderr = subprocess.DEVNULL, start_new_session = True)
+
+    def get(self):
+        """Return keys by user ID: cached ones, refreshing them in background
+        if older than ttl; if older than ttl + max_stale, refresh and wait"""
+
+        refreshed, users = self.load()
+        age = None if refreshed is None else time.time() - refreshed
+        ttl = _setting("ttl", 60)
+
+        if age is not None and age < ttl:
+            return users
+        elif age is not None and age < ttl + _setting("max_stale", 3600):
+            log.debug("Keys for %s are %i s old, refreshing" % (self.server, age))
+            self.refresh_later()
+            return users
+        else:
+            return self.refresh()
+
+class AuthorizedKeysCommand(Command):
+    parser_name = "authorized-keys"
+    parser_args = {
+        "kwargs": {
+            "help": "Print public keys of a user allowed on a server, for sshd AuthorizedKeysCommand"
+        },
+        "arguments": {
+            "username": {
+                "metavar": "USER_NAME",
+                "nargs": "?",
+                "help": "User ID"
+            },
+            "--server": {
+                "default": socket.gethostname().split(".")[0],
+                "help": "Server ID. Default: short host name"
+            },
+            "--refresh": {
+                "action": "store_true",
+                "help": "Fetch keys of all users allowed on the server"
+            }
+        }
+    }
+
+    def on_authorized_keys(self):
+        cache = _HostCache(self._args.server)
+
+        if self._args.refresh:
+            cache.refresh(wait = False)
+            if not self._args.username:
+                return
+        elif not self._args.username:
+            raise ValueError("User name expected")
+
+        for key in cache.get().get(self._args.username, []):
+            print(key)
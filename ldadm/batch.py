@@ -0,0 +1,112 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, sys, io, json, shlex
+from argparse import FileType
+
+from .command import Command
+
+log = logging.getLogger(__name__)
+
+class _NoInput(io.StringIO):
+    """Empty standard input, that doesn't trigger "input ignored" warnings"""
+
+    def isatty(self):
+        return True
+
+def parse_line(line):
+    """Return arguments and standard input lines from a batch line.
+    Line is either a shell-quoted command, or a JSON record: a list of
+    arguments, or an object with "argv" list or "command" string, and an
+    optional "stdin" string or list of lines."""
+
+    stripped = line.strip()
+    if not stripped or stripped.startswith("#"):
+        return None, None
+
+    if stripped[0] not in "[{":
+        return shlex.split(stripped), None
+
+    record = json.loads(stripped)
+    if type(record) is list:
+        return [str(arg) for arg in record], None
+
+    try:
+        argv = [str(arg) for arg in record["argv"]]
+    except KeyError:
+        argv = shlex.split(record["command"])
+
+    stdin = record.get("stdin")
+    if type(stdin) is list:
+        stdin = "".join("%s\n" % item for item in stdin)
+
+    return argv, stdin
+
+class BatchCommand(Command):
+    parser_name = "batch"
+    parser_args = {
+        "kwargs": {
+            "help": "Run a stream of commands over a single connection"
+        },
+        "arguments": {
+            "file": {
+                "metavar": "FILE_NAME",
+                "type": FileType("r"),
+                "nargs": "?",
+                "help": "Read commands from file. If omitted, read from stdin."
+            }
+        }
+    }
+
+    def on_batch(self):
+        from .main import execute
+
+        if self._args.file:
+            commands = self._args.file
+        else:
+            commands = sys.stdin
+
+        failed = 0
+        saved_stdin = sys.stdin
+        with commands:
+            for line_number, line in enumerate(commands, start = 1):
+                try:
+                    argv, stdin = parse_line(line)
+                except (ValueError, KeyError, TypeError) as err:
+                    self._report(line_number, "Invalid line: %s" % err)
+                    failed += 1
+                    continue
+
+                if not argv:
+                    continue
+                if argv[0] in ("batch", "daemon"):
+                    self._report(line_number, "Command not permitted in batch: %s" % argv[0])
+                    failed += 1
+                    continue
+
+                log.debug("Line %i: %s" % (line_number, " ".join(argv)))
+                sys.stdin = _NoInput() if stdin is None else io.StringIO(stdin)
+                try:
+                    status, message = execute(argv)
+                except Exception as err:
+                    status, message = 1, str(err)
+                finally:
+                    sys.stdin = saved_stdin
+                    sys.stdout.flush()
+
+                if status:
+                    self._report(line_number, message or "Exit status %i" % status)
+                    failed += 1
+                else:
+                    self._report(line_number)
+
+        if failed:
+            raise RuntimeError("%i command(s) failed" % failed)
+
+    @staticmethod
+    def _report(line_number, error = None):
+        if error:
+            print("%i: FAILED: %s" % (line_number, error), file = sys.stderr)
+        else:
+            print("%i: OK" % line_number, file = sys.stderr)
+        sys.stderr.flush()
@@ -0,0 +1,138 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, time
+from collections import deque
+
+from ldap3 import ASYNC
+from ldap3.core.exceptions import LDAPCommunicationError
+from ldap3.core.results import RESULT_SUCCESS, RESULT_NO_SUCH_OBJECT
+
+from .config import cfg, ConfigAttrError
+from .connection import new_connection, retry_delays, ServerUnavailable
+
+log = logging.getLogger(__name__)
+
+class BulkWriter:
+    """Pipeline write operations over an asynchronous connection, keeping
+    a bounded number of requests outstanding. Failures are reported per entry;
+    if any occurred, RuntimeError is raised when leaving the context, unless
+    on_failure callback handles them.
+    If the connection is lost, reconnect and resend the outstanding requests."""
+
+    def __init__(self, on_success = None, on_failure = None):
+        try:
+            self._limit = int(cfg.ldap.max_outstanding)
+        except ConfigAttrError:
+            self._limit = 16
+
+        self._on_success = on_success
+        self._on_failure = on_failure
+        self._conn = None
+        self._outstanding = deque()
+        self.succeeded = 0
+        self.failed = 0
+
+    def __enter__(self):
+        self._conn = new_connection(ASYNC)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            while self._outstanding:
+                self._collect()
+        finally:
+            self._conn.unbind()
+
+        log.info("%i operation(s) succeeded, %i failed" % (self.succeeded, self.failed))
+        if self.failed and exc_type is None and not self._on_failure:
+            raise RuntimeError("%i operation(s) failed" % self.failed)
+
+    def _reconnect(self, err):
+        """Open a new connection with increasing delays, and resend requests
+        that haven't been answered"""
+
+        for delay in retry_delays():
+            log.warning("Connection lost (%s), reconnecting in %i s" % (err, delay))
+            time.sleep(delay)
+            try:
+                self._conn = new_connection(ASYNC)
+                break
+            except (LDAPCommunicationError, ServerUnavailable) as new_err:
+                err = new_err
+        else:
+            raise RuntimeError("Could not reconnect: %s" % err) from err
+
+        unanswered = self._outstanding
+        self._outstanding = deque()
+        for key, description, operation, args, kwargs, message_id, retry in unanswered:
+            self._send(key, description, operation, args, kwargs, retry = True)
+
+    def _send(self, key, description, operation, args, kwargs, retry = False):
+        while True:
+            try:
+                message_id = getattr(self._conn, operation)(*args, **kwargs)
+                break
+            except LDAPCommunicationError as err:
+                self._reconnect(err)
+
+        self._outstanding.append( (key, description, operation, args, kwargs, message_id, retry) )
+
+    def _submit(self, key, description, operation, *args, **kwargs):
+        self._send(key, description, operation, args, kwargs)
+        if len(self._outstanding) >= self._limit:
+            self._collect()
+
+    def _collect(self):
+        """Wait for the oldest outstanding request, and report its result"""
+
+        key, description, operation, args, kwargs, message_id, retry = self._outstanding[0]
+        try:
+            result = self._conn.get_response(message_id)[1]
+        except LDAPCommunicationError as err:
+            self._reconnect(err)
+            return
+        except Exception as err:
+            result = {"result": None, "description": str(err), "message": ""}
+        self._outstanding.popleft()
+
+        # a resent request may have been done before the connection was lost
+        done_before = retry and result["result"] == RESULT_NO_SUCH_OBJECT \
+                and operation in ("delete", "modify_dn")
+
+        if result["result"] == RESULT_SUCCESS or done_before:
+            log.debug("%s: %s" % (key, description))
+            self.succeeded += 1
+            if self._on_success:
+                self._on_success(key)
+        else:
+            message = result["description"]
+            if result["message"]:
+                message += ", " + result["message"]
+            self.fail(key, description, message)
+
+    def fail(self, key, description, message):
+        """Report a failure, e.g. of an operation that couldn't be sent"""
+
+        self.failed += 1
+        if self._on_failure:
+            self._on_failure(key, message)
+        else:
+            log.error("%s: %s failed: %s" % (key, description, message))
+
+    def delete(self, key, dn):
+        self._submit(key, "delete", "delete", dn)
+
+    def modify_dn(self, key, dn, rdn, new_superior = None):
+        if new_superior:
+            description = "move to %s" % new_superior
+        else:
+            description = "rename to %s" % rdn
+
+        self._submit(key, description, "modify_dn", dn, rdn, new_superior = new_superior)
+
+    def add(self, key, dn, object_class, attributes):
+        self._submit(key, "add", "add", dn, object_class, attributes)
+
+    def modify(self, key, dn, changes):
+        self._submit(key, "modify", "modify", dn, changes)
@@ -0,0 +1,41 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import os, hashlib, tempfile
+
+def cache_dir(*parts):
+    """Return a directory for ldadm cache files, creating it if needed"""
+
+    try:
+        root = os.environ["XDG_CACHE_HOME"]
+    except KeyError:
+        root = os.path.join(os.environ["HOME"], ".cache")
+
+    path = os.path.join(root, "ldadm", *parts)
+    os.makedirs(path, mode = 0o700, exist_ok = True)
+
+    return path
+
+def cache_key(*values):
+    """Hash values into a string safe to use as a file name"""
+
+    digest = hashlib.sha1()
+    for value in values:
+        digest.update(str(value).encode("utf-8"))
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+def atomic_write(filename, data, mode = 0o600):
+    """Replace file contents, so that readers never see a partial file"""
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir = directory, prefix = ".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file_object:
+            file_object.write(data)
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
@@ -0,0 +1,139 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, sys, os, json, socket, struct, select
+
+log = logging.getLogger(__name__)
+
+# output frame channels
+STDOUT = 1
+STDERR = 2
+EXIT = 3
+
+frame_header = struct.Struct("!BI")
+request_length = struct.Struct("!I")
+
+# short read-only commands; others, like exports, audits and writes, run
+# in-process, so that they don't hold the daemon serving one at a time
+_forwarded = [ [kind] + words for kind in ("user", "server", "project")
+        for words in (["list"], ["count"], ["show"], ["info"],
+                ["unit", "list"], ["unit", "show"], ["unit", "info"]) ] + [
+        ["user", "search"],
+        ["user", "key", "list"],
+        ["user", "key", "show"],
+        ["key", "find"],
+        ["authorized-keys"],
+        ["replica", "status"],
+        ["complete"] ]
+
+def socket_path():
+    """Return the daemon socket path; this must not require loading config"""
+
+    try:
+        return os.environ["LDADM_SOCKET"]
+    except KeyError:
+        pass
+
+    try:
+        directory = os.environ["XDG_RUNTIME_DIR"]
+    except KeyError:
+        from .cache import cache_dir
+        directory = cache_dir()
+
+    return os.path.join(directory, "ldadm.sock")
+
+def forward(argv):
+    """Run the command in the daemon, relaying standard streams.
+    Return exit status, or None if the command is to run in-process."""
+
+    if not any(argv[:len(words)] == words for words in _forwarded):
+        return None
+
+    try:
+        stdin_fd = sys.stdin.fileno()
+    except (AttributeError, ValueError, OSError):
+        stdin_fd = None
+
+    # answers to prompts, and names typed at a terminal, are read in-process,
+    # so that waiting for the user doesn't hold the daemon
+    if stdin_fd is not None and os.isatty(stdin_fd):
+        log.debug("Standard input is a terminal, not forwarding")
+        return None
+
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as err:
+        log.debug("Daemon not available at %s: %s" % (path, err))
+        sock.close()
+        return None
+
+    log.debug("Forwarding to daemon at %s" % path)
+
+    header = json.dumps({
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "log_level": os.environ.get("LOG_LEVEL"),
+        "stdout_tty": sys.stdout.isatty()
+    }).encode("utf-8")
+    sock.sendall(request_length.pack(len(header)) + header)
+
+    if stdin_fd is None:
+        sock.shutdown(socket.SHUT_WR)
+
+    # never block on sending input, while the daemon is waiting to send output
+    sock.setblocking(False)
+
+    outputs = {
+        STDOUT: sys.stdout.buffer,
+        STDERR: sys.stderr.buffer
+    }
+    pending = b""
+    buf = b""
+    with sock:
+        while True:
+            watch_read = [sock]
+            if stdin_fd is not None and not pending:
+                watch_read.append(stdin_fd)
+            watch_write = [sock] if pending else []
+            readable, writable = select.select(watch_read, watch_write, [])[:2]
+
+            if stdin_fd in readable:
+                pending = os.read(stdin_fd, 65536)
+                if not pending:
+                    sock.shutdown(socket.SHUT_WR)
+                    stdin_fd = None
+
+            if sock in writable:
+                try:
+                    pending = pending[sock.send(pending):]
+                except BlockingIOError:
+                    pass
+
+            if sock in readable:
+                try:
+                    data = sock.recv(65536)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    print("Daemon closed connection unexpectedly", file = sys.stderr)
+                    return 1
+                buf += data
+
+                while len(buf) >= frame_header.size:
+                    channel, size = frame_header.unpack_from(buf)
+                    end = frame_header.size + size
+                    if len(buf) < end:
+                        break
+                    payload = buf[frame_header.size:end]
+                    buf = buf[end:]
+
+                    if channel == EXIT:
+                        return int(payload)
+                    else:
+                        outputs[channel].write(payload)
+                        outputs[channel].flush()
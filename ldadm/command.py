@@ -1,7 +1,7 @@
 # Copyright 2017, Development Gateway, Inc.
 # This file is part of ldadm, see COPYING.
 
-import logging, sys, argparse
+import logging, sys, os, argparse
 from copy import copy
 
 log = logging.getLogger(__name__)
@@ -13,7 +13,7 @@ class Command:
     def _args_or_stdin(self, argname):
         args = getattr(self._args, argname)
         if args:
-            if not sys.__stdin__.isatty():
+            if not sys.stdin.isatty():
                 log.warning("Standard input ignored, because arguments are present")
             if hasattr(args[0], "read"):
                 with args[0] as file_object:
@@ -23,12 +23,77 @@ class Command:
                 for arg in args:
                     yield arg
         else:
-            with sys.__stdin__ as file_object:
+            with sys.stdin as file_object:
                 for line in file_object:
                     yield line[:-1] # in text mode linesep is always "\n"
 
+    def _journal(self):
+        """Open the journal of objects processed by this command, with these
+        arguments, in this directory"""
+
+        from .journal import Journal
+        from .cache import cache_key
+
+        def describe(value):
+            if type(value) is list:
+                return [ describe(item) for item in value ]
+            return getattr(value, "name", value) # file objects by name
+
+        name = self._args._event[len("on_"):]
+        args = sorted( (arg, describe(value)) for arg, value in vars(self._args).items()
+                if not arg.startswith("_") and arg != "resume" )
+        key = cache_key(os.getcwd(), args)
+
+        return Journal(name, key, resume = getattr(self._args, "resume", False))
+
+    def _projection(self, mapping_class):
+        """Attributes that show command arguments ask for"""
+
+        args = self._args
+        if args.save:
+            return [ args.save[0] ]
+
+        return mapping_class.projection(args.attrs,
+                binary = args.binary,
+                operational = args.operational)
+
+    def _show(self, mapping, argname):
+        """Write objects selected by arguments or stdin, or save one value"""
+
+        from .console import Output, save_value
+        mapping.select( self._args_or_stdin(argname) )
+
+        if self._args.save:
+            save_value(mapping.values(), *self._args.save)
+            return
+
+        with Output(self._args.output_format) as output:
+            for entry in mapping.values():
+                output.write_entry(entry)
+
     @classmethod
-    def add_subparser(cls, parent, full_name = []):
+    def _children(cls, options):
+        """Map names and aliases of nested subcommands to their names"""
+
+        result = {}
+        for name, child in options.get("subparsers", {}).items():
+            result[name] = name
+            for alias in child.get("kwargs", {}).get("aliases", []):
+                result[alias] = name
+
+        return result
+
+    @staticmethod
+    def _event_name(full_name):
+        """Handler name: hyphens in command names become underscores"""
+
+        return "on_" + "_".join(full_name).replace("-", "_")
+
+    @classmethod
+    def add_subparser(cls, parent, full_name = [], path = None):
+        """Add parser for this command; if path is given, only add nested
+        subcommands along that path of argument words"""
+
         if not full_name:
             full_name = [cls.parser_name]
 
@@ -45,7 +110,7 @@ class Command:
             kwargs = {}
         parser = parent.add_parser(this_name, **kwargs)
 
-        event_name = "on_" + "_".join(full_name)
+        event_name = cls._event_name(full_name)
         parser.set_defaults(_class = cls)
         parser.set_defaults(_event = event_name)
 
@@ -61,8 +126,18 @@ class Command:
             child_name = copy(full_name)
             title = options["subparsers_title"]
             new_parent = parser.add_subparsers(title = title)
-            for name in options["subparsers"]:
+
+            # build just the subcommand being invoked, unless it's unknown
+            children = cls._children(options)
+            if path and path[0] in children:
+                names = [ children[path[0]] ]
+                child_path = path[1:]
+            else:
+                names = options["subparsers"]
+                child_path = None
+
+            for name in names:
                 log.debug("%s.add_subparser %s" % (this_name, name))
                 child_name.append(name)
-                cls.add_subparser(new_parent, child_name)
+                cls.add_subparser(new_parent, child_name, child_path)
                 child_name.pop()
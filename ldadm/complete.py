@@ -0,0 +1,125 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, os, time, json
+
+from .command import Command
+from .cache import cache_dir, atomic_write
+from .config import cfg
+from .user import UserMapping
+from .unit import UnitMapping
+
+log = logging.getLogger(__name__)
+
+# seconds to answer from cached results
+_ttl = 30
+
+# most IDs to fetch for one prefix
+_size_limit = 100
+
+_kinds = ["user", "suspended", "server", "project", "user-unit", "server-unit", "project-unit"]
+
+# command modules needing the config section of the kind
+_kind_modules = {
+    "server": "server",
+    "server-unit": "server",
+    "project": "project",
+    "project-unit": "project"
+}
+
+def _mapping(kind):
+    """Return mapping of the kind of objects; servers and projects
+    are imported on demand, their sections are optional"""
+
+    if kind == "user":
+        return UserMapping(base = cfg.user.base.active)
+    elif kind == "suspended":
+        return UserMapping(base = cfg.user.base.suspended)
+    elif kind == "server":
+        from .server import ServerMapping
+        return ServerMapping()
+    elif kind == "project":
+        from .project import ProjectMapping
+        return ProjectMapping()
+    elif kind == "user-unit":
+        return UnitMapping(cfg.user.base.active)
+    elif kind == "server-unit":
+        return UnitMapping(cfg.server.base)
+    else:
+        return UnitMapping(cfg.project.base)
+
+class _PrefixCache:
+    """IDs found by prefix, for a short time. Results for a prefix that
+    weren't cut by the size limit also answer for longer prefixes."""
+
+    def __init__(self, kind):
+        self._file_name = os.path.join(cache_dir("complete"), kind + ".json")
+        try:
+            with open(self._file_name) as file_object:
+                self._data = json.load(file_object)
+        except (OSError, ValueError):
+            self._data = {}
+
+        now = time.time()
+        self._data = dict( (prefix, item) for prefix, item in self._data.items()
+                if now - item["time"] < _ttl )
+
+    def get(self, prefix):
+        lower = prefix.lower()
+        for length in range(len(lower), -1, -1):
+            try:
+                item = self._data[ lower[:length] ]
+            except KeyError:
+                continue
+
+            if length == len(lower) or item["complete"]:
+                return [ id for id in item["ids"] if id.lower().startswith(lower) ]
+
+        return None
+
+    def put(self, prefix, ids, complete):
+        self._data[prefix.lower()] = {"time": time.time(), "ids": ids, "complete": complete}
+        try:
+            atomic_write(self._file_name, json.dumps(self._data).encode("utf-8"))
+        except OSError as err:
+            log.debug("Completion cache not saved: %s" % err)
+
+class CompleteCommand(Command):
+    parser_name = "complete"
+    parser_args = {
+        "kwargs": {
+            "help": "List IDs starting with prefix, for shell completion"
+        },
+        "arguments": {
+            "kind": {
+                "choices": _kinds,
+                "help": "Kind of objects"
+            },
+            "prefix": {
+                "nargs": "?",
+                "default": "",
+                "help": "Beginning of the ID"
+            }
+        }
+    }
+
+    def on_complete(self):
+        from .main import load_manifest
+
+        kind = self._args.kind
+        prefix = self._args.prefix
+
+        # nothing to complete, if the section is missing from the config
+        unconfigured = load_manifest()[1]
+        if _kind_modules.get(kind) in unconfigured:
+            log.debug("Can't complete %s: %s" % (kind, unconfigured[_kind_modules[kind]]))
+            return
+
+        cache = _PrefixCache(kind)
+        ids = cache.get(prefix)
+        if ids is None:
+            ids, complete = _mapping(kind).starting_with(prefix, _size_limit)
+            cache.put(prefix, ids, complete)
+
+        for id in sorted(ids):
+            print(id)
@@ -1,9 +1,15 @@
 # Copyright 2017, Development Gateway, Inc.
 # This file is part of ldadm, see COPYING.
 
-import logging, os, copy
+import logging, os, marshal
 
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+from .cache import cache_dir, cache_key, atomic_write
 
 class ConfigAttrError(AttributeError):
     pass
@@ -11,57 +17,144 @@ class ConfigAttrError(AttributeError):
 class ConfigException(Exception):
     pass
 
+# expected type of each setting: a type, a dictionary of nested settings,
+# or a tuple of alternatives; names of optional settings end with "?"
+_schema = {
+    "ldap": {
+        "uri": (str, {"write": str, "read?": (str, list)}),
+        "binddn?": str,
+        "bindpw?": str,
+        "paged_search_size": int,
+        "retries?": int,
+        "max_outstanding?": int
+    },
+    "user": {
+        "base": {"active": str, "suspended": str},
+        "nuid": {"min": int, "max": int, "counter?": str},
+        "message_on_create?": str,
+        "objectclass": (str, list),
+        "attr": {
+            "uid": str,
+            "nuid": str,
+            "passwd": str,
+            "pubkey?": str,
+            "templates?": dict,
+            "modify?": dict
+        }
+    },
+    "server?": {
+        "base": str,
+        "message_on_create?": str,
+        "objectclass": (str, list),
+        "attr": {"id": str, "templates?": dict, "modify?": dict}
+    },
+    "project?": {
+        "base": str,
+        "message_on_create?": str,
+        "objectclass": (str, list),
+        "attr": {
+            "id": str,
+            "member": str,
+            "manager": str,
+            "server?": str,
+            "gid?": str,
+            "templates?": dict,
+            "modify?": dict
+        }
+    },
+    "unit?": dict,
+    "replica?": {"max_staleness?": int, "path?": str},
+    "authorized_keys?": {"ttl?": int, "max_stale?": int, "path?": str},
+    "nss?": {"path?": str}
+}
+
+def _type_names(options):
+    return " or ".join( "dictionary" if type(option) is dict else option.__name__
+            for option in options )
+
+def _validate(value, expected, path):
+    """Raise ConfigException unless the value matches the schema"""
+
+    options = expected if type(expected) is tuple else (expected,)
+    for option in options:
+        if type(option) is dict:
+            if type(value) is not dict:
+                continue
+
+            for key, nested in option.items():
+                name = key.rstrip("?")
+                if value.get(name) is not None:
+                    _validate(value[name], nested, path + [name])
+                elif not key.endswith("?"):
+                    raise ConfigException("Setting %s is missing" % ".".join(path + [name]))
+            return
+
+        # YAML booleans are integers in Python
+        if isinstance(value, option) and not (type(value) is bool and option is not bool):
+            return
+
+    raise ConfigException("Setting %s must be %s, not %s"
+            % (".".join(path) or "file", _type_names(options), type(value).__name__))
+
 class Config:
-    def __init__(self):
-        self._parent = None
-        self._name = None
-        if not hasattr(__class__, "_cfg"):
-            self._load_from_file()
-
-    def _load_from_file(self):
-        basename = "ldadm.yml"
-        try:
-            filename = os.path.join(os.environ["XDG_CONFIG_HOME"], basename)
-        except KeyError:
-            filename = os.path.join(os.environ["HOME"], ".config", basename)
+    """Immutable node of settings, compiled once from the parsed file;
+    nested dictionaries are nodes, too. Each node gets a class with a slot
+    per setting, so reading one is as fast as reading any attribute. Settings
+    can also be iterated over and read by name, like a dictionary."""
 
-        logging.getLogger(__name__).debug("Loading config from %s" % filename)
-        try:
-            __class__._cfg = yaml.safe_load(open(filename))
-            self._cfg = __class__._cfg
-        except OSError as err:
-            msg = "Config file '%s': %s" % (err.filename, err.strerror)
-            raise ConfigException(msg) from err
+    __slots__ = ("_path", "_values")
+
+    def __new__(cls, values, path = ()):
+        names = tuple( name for name in map(str, values)
+                if name.isidentifier() and not name.startswith("_") )
+        node_class = type(cls.__name__, (cls,), {"__slots__": names})
+        return object.__new__(node_class)
+
+    def __init__(self, values, path = ()):
+        compiled = {}
+        for name, value in values.items():
+            name = str(name)
+            if type(value) is dict:
+                value = Config(value, path + (name,))
+            compiled[name] = value
+            # unset slots of missing settings raise ConfigAttrError
+            if value is not None and name in self.__class__.__slots__:
+                object.__setattr__(self, name, value)
+
+        object.__setattr__(self, "_path", path)
+        object.__setattr__(self, "_values", compiled)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is read-only")
 
     def __getattr__(self, name):
-        try:
-            attr = self._cfg[name]
-        except KeyError as key:
-            raise ConfigAttrError(self._attr_name(name)) from key
-        except TypeError as err:
-            raise ConfigAttrError(self._attr_name(name)) from err
-
-        if type(attr) is dict:
-            cfg = __class__()
-            cfg._cfg = attr
-            cfg._parent = self
-            cfg._name = name
-            return cfg
-        elif attr is None:
-            raise ConfigAttrError(self._attr_name(name))
-        else:
-            return attr
-
-    def _get_path(self):
-        if self._parent:
-            path = self._parent._get_path() + [self._name]
-        else:
-            path = []
-
-        return path
+        # only called for settings without a slot, or with no value
+        if name.startswith("__") or name in Config.__slots__:
+            raise AttributeError(name)
+
+        raise ConfigAttrError("Setting %s is missing from the config file"
+                % self._attr_name(name))
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __bool__(self):
+        return True
 
     def _attr_name(self, name = None):
-        path = self._get_path()
+        path = list(self._path)
         if name:
             path.append(name)
 
@@ -70,4 +163,67 @@ class Config:
     def __str__(self):
         return self._attr_name()
 
-cfg = Config()
+def file_name():
+    """Path of the configuration file"""
+
+    basename = "ldadm.yml"
+    try:
+        return os.path.join(os.environ["XDG_CONFIG_HOME"], basename)
+    except KeyError:
+        return os.path.join(os.environ["HOME"], ".config", basename)
+
+def _parse(filename):
+    """Return the parsed file; from the marshalled copy, if the file
+    hasn't been modified since it was made"""
+
+    log = logging.getLogger(__name__)
+    stat = os.stat(filename)
+    stamp = [stat.st_mtime_ns, stat.st_size]
+
+    try:
+        cache_file = os.path.join(cache_dir("config"), cache_key(os.path.abspath(filename)))
+    except OSError as err:
+        log.debug("Config cache not available: %s" % err)
+        cache_file = None
+
+    if cache_file:
+        try:
+            with open(cache_file, "rb") as file_object:
+                cached_stamp, data = marshal.load(file_object)
+            if cached_stamp == stamp:
+                return data
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    log.debug("Parsing config %s" % filename)
+    with open(filename) as file_object:
+        data = yaml.load(file_object, Loader = SafeLoader)
+
+    if cache_file:
+        try:
+            # the file holds the bind password, too
+            atomic_write(cache_file, marshal.dumps([stamp, data]), mode = 0o600)
+        except (OSError, ValueError) as err:
+            log.debug("Config not cached: %s" % err) # e.g. dates aren't marshallable
+
+    return data
+
+def load_config():
+    """Parse, validate and compile the configuration file"""
+
+    filename = file_name()
+    logging.getLogger(__name__).debug("Loading config from %s" % filename)
+    try:
+        data = _parse(filename)
+    except OSError as err:
+        msg = "Config file '%s': %s" % (err.filename, err.strerror)
+        raise ConfigException(msg) from err
+
+    try:
+        _validate(data, _schema, [])
+    except ConfigException as err:
+        raise ConfigException("Config file '%s': %s" % (filename, err)) from err
+
+    return Config(data)
+
+cfg = load_config()
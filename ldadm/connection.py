@@ -1,16 +1,139 @@
 # Copyright 2017, Development Gateway, Inc.
 # This file is part of ldadm, see COPYING.
 
-import logging
+import logging, os, socket, time, json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
-from ldap3 import Connection
+from ldap3 import Connection, Server, ServerPool, NONE, FIRST, RESTARTABLE, set_config_parameter
 from ldap3.utils.log import set_library_log_detail_level, PROTOCOL
+from ldap3.core.exceptions import LDAPServerPoolExhaustedError, LDAPMaximumRetriesError, \
+        LDAPCommunicationError
 
-from .config import cfg
+from .config import cfg, ConfigAttrError
+from .cache import cache_dir, cache_key, atomic_write
+from . import schema
 
 log = logging.getLogger(__name__)
 
-def _connect():
+# seconds to skip an unreachable server, before trying it again;
+# also how long the ranking of replicas by latency is reused
+_exhaust_time = 60
+
+# passes over the server pool, before giving up; reconnection attempts
+# wait for the restartable strategy instead of a fixed pause after each pass
+_pool_cycles = 1
+set_config_parameter("POOLING_LOOP_TIMEOUT", 0)
+
+# seconds before the first reconnection attempt, doubled with each next one
+_retry_delay = 1
+_max_retry_delay = 60
+
+_connections = {}
+
+def _get_uris():
+    """Return a list of read replica URIs, and the write master URI"""
+
+    uri = cfg.ldap.uri
+    if type(uri) is str:
+        return [uri], uri
+
+    write_uri = uri.write
+    try:
+        read_uris = uri.read
+        if type(read_uris) is not list:
+            read_uris = [read_uris]
+    except ConfigAttrError:
+        read_uris = [write_uri]
+
+    return read_uris, write_uri
+
+def _latency(uri):
+    """Measure TCP connection time to the server; None if unreachable"""
+
+    parts = urlsplit(uri)
+    if not parts.hostname:
+        return 0 # e.g. ldapi:// socket
+
+    if parts.port:
+        port = parts.port
+    elif parts.scheme == "ldaps":
+        port = 636
+    else:
+        port = 389
+
+    start = time.monotonic()
+    try:
+        with socket.create_connection((parts.hostname, port), timeout = 2):
+            return time.monotonic() - start
+    except OSError as err:
+        log.warning("Server %s unreachable: %s" % (uri, err))
+        return None
+
+def _rank_by_latency(uris):
+    """Order URIs from the fastest to respond; unreachable ones last.
+    The ranking is cached, so that servers are only probed once a minute."""
+
+    if len(uris) < 2:
+        return uris
+
+    file_name = os.path.join(cache_dir("servers"), cache_key(*uris) + ".json")
+    try:
+        with open(file_name) as file_object:
+            cached = json.load(file_object)
+        if 0 <= time.time() - cached["time"] < _exhaust_time:
+            return cached["uris"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with ThreadPoolExecutor(max_workers = len(uris)) as executor:
+        latencies = list( executor.map(_latency, uris) )
+
+    ranked = sorted( zip(uris, latencies),
+            key = lambda pair: float("inf") if pair[1] is None else pair[1] )
+    log.debug("Replicas by latency: %s" % ", ".join(uri for uri, latency in ranked))
+
+    result = [uri for uri, latency in ranked]
+    try:
+        atomic_write(file_name, json.dumps({"time": time.time(), "uris": result}).encode("utf-8"))
+    except OSError as err:
+        log.debug("Replica ranking not saved: %s" % err)
+
+    return result
+
+def _read_pool(read_uris, write_uri):
+    """Replicas by latency, then the write master as the last resort"""
+
+    uris = _rank_by_latency(read_uris)
+    if write_uri not in uris:
+        uris = uris + [write_uri]
+
+    return uris
+
+def retry_delays():
+    """Yield delays before each reconnection attempt, backing off exponentially"""
+
+    try:
+        tries = int(cfg.ldap.retries)
+    except ConfigAttrError:
+        tries = 5
+
+    delay = _retry_delay
+    for attempt in range(tries):
+        yield delay
+        delay = min(delay * 2, _max_retry_delay)
+
+class ServerUnavailable(RuntimeError):
+    """None of the LDAP servers could be reached"""
+
+def _bind(conn, uris):
+    try:
+        conn.bind()
+    except (LDAPServerPoolExhaustedError, LDAPMaximumRetriesError, LDAPCommunicationError) as err:
+        msg = "No LDAP server available: %s" % ", ".join(uris)
+        raise ServerUnavailable(msg) from err
+
+def _connect(uris, client_strategy = RESTARTABLE):
     try:
         binddn = cfg.ldap.binddn
         bindpw = cfg.ldap.bindpw
@@ -21,13 +144,78 @@ def _connect():
     if log.isEnabledFor(logging.DEBUG):
         set_library_log_detail_level(PROTOCOL)
 
+    # schema is loaded separately, to use the local cache
+    servers = [ Server(uri, get_info = NONE) for uri in uris ]
+    if len(servers) == 1:
+        server = servers[0]
+    else:
+        # try servers in order; skip the failed ones for a while
+        server = ServerPool(servers,
+                pool_strategy = FIRST,
+                active = _pool_cycles,
+                exhaust = _exhaust_time)
+
+    restartable = client_strategy == RESTARTABLE
     conn = Connection(
-            server = cfg.ldap.uri,
+            server = server,
             user = binddn,
             password = bindpw,
-            raise_exceptions = True)
-    conn.bind()
+            client_strategy = client_strategy,
+            raise_exceptions = restartable)
+
+    if not restartable:
+        _bind(conn, uris)
+        return conn # raw operations only, schema not needed
+
+    # reopen and rebind transparently, if the server goes away; the strategy
+    # pauses for a fixed time, so spread the total of the backoff delays evenly
+    delays = list( retry_delays() )
+    conn.strategy.restartable_tries = len(delays)
+    conn.strategy.restartable_sleep_time = sum(delays) / len(delays) if delays else 0
+    _bind(conn, uris)
+
+    # replicas share schema with the master, so cache it by master URI
+    schema.attach(conn, _get_uris()[1])
+
+    # make schema available if the pool fails over to another server
+    for server in servers:
+        server.attach_schema_info(conn.server.schema)
 
     return conn
 
-ldap = _connect()
+def cached_schema():
+    """Return the schema cached by an earlier run, without connecting;
+    None if there is none"""
+
+    return schema.load( _get_uris()[1] )
+
+def get_connection(write = False):
+    """Return the shared connection to read replicas, or to the write master,
+    binding on first use"""
+
+    key = "write" if write else "read"
+    if key not in _connections:
+        read_uris, write_uri = _get_uris()
+        if read_uris == [write_uri]:
+            log.debug("Connecting to %s" % write_uri)
+            _connections["read"] = _connections["write"] = _connect([write_uri])
+        elif write:
+            log.debug("Connecting to write master %s" % write_uri)
+            _connections["write"] = _connect([write_uri])
+        else:
+            log.debug("Connecting to read replicas %s" % ", ".join(read_uris))
+            _connections["read"] = _connect( _read_pool(read_uris, write_uri) )
+
+    return _connections[key]
+
+def new_connection(client_strategy, write = True):
+    """Open a separate connection with another strategy, e.g. asynchronous.
+    Exceptions are not raised; check results of the operations."""
+
+    read_uris, write_uri = _get_uris()
+    if write:
+        uris = [write_uri]
+    else:
+        uris = _read_pool(read_uris, write_uri)
+
+    return _connect(uris, client_strategy)
@@ -1,43 +1,221 @@
 # Copyright 2017, Development Gateway, Inc.
 # This file is part of ldadm, see COPYING.
 
-from functools import reduce
 from datetime import datetime
-import sys
+from argparse import ArgumentParser
+import sys, io, csv, json, base64
 
-def pretty_print(entry):
-    def output(k, v):
-        try:
-            s = v.decode("utf-8")
-        except AttributeError:
-            s = str(v)
+from ldap3 import get_config_parameter
 
-        print(formatter.format(k, s))
+from .schema import value_kind, TEXT, BINARY
 
-    attrs = entry.entry_attributes
-    longest = reduce(lambda x, y: x if len(x) > len(y) else y, attrs)
-    width = len(longest) + 1
-    formatter = "{:%is} {:s}" % width
+output_formats = ["text", "json", "jsonl", "csv", "tsv"]
 
-    for key in sorted(attrs):
-        value = entry[key].value
+output_format = ArgumentParser(add_help = False)
+output_format.add_argument("--format",
+        dest = "output_format",
+        choices = output_formats,
+        default = "text",
+        help = "Output format. Default: text")
 
-        if type(value) is list:
-            first_value = value.pop(0)
-            output(key + ":", first_value)
-            for elem in value:
-                output("", elem)
+def _attribute_list(value):
+    return [ name.strip() for name in value.split(",") if name.strip() ]
 
-        elif type(value) is datetime:
-            output(key + ":", value.strftime("%c"))
+show_attributes = ArgumentParser(add_help = False)
+show_attributes.add_argument("--attrs",
+        metavar = "ATTR[,ATTR...]",
+        type = _attribute_list,
+        help = "Only fetch and show these attributes")
+show_attributes.add_argument("--binary",
+        action = "store_true",
+        help = "Also fetch binary attributes, e.g. photos and certificates")
+show_attributes.add_argument("--operational", "--full",
+        dest = "operational",
+        action = "store_true",
+        help = "Also fetch operational attributes")
+show_attributes.add_argument("--save",
+        nargs = 2,
+        metavar = ("ATTR", "FILE_NAME"),
+        help = "Write the raw attribute value into file, '-' for stdout")
 
+# bytes to collect before writing to stdout
+_buffer_size = 65536
+
+def entry_record(dn, raw_attributes):
+    """Make a dictionary of entry DN, text attribute values, and base64-encoded
+    binary values, if any. The kind of values is told by the schema syntax:
+    only string syntaxes are decoded, octet strings are encoded as binary."""
+
+    attributes = {}
+    binary = {}
+    for name, values in raw_attributes.items():
+        if not values:
+            continue
+        elif value_kind(name) == TEXT:
+            attributes[name] = [ value.decode("utf-8", "replace") for value in values ]
+        else:
+            binary[name] = [ base64.b64encode(value).decode("ascii") for value in values ]
+
+    record = {"dn": dn, "attributes": attributes}
+    if binary:
+        record["binary"] = binary
+
+    return record
+
+def _text_value(value):
+    if type(value) is datetime:
+        return value.strftime("%c")
+    elif type(value) is bytes:
+        return value.decode("utf-8", "backslashreplace")
+    else:
+        return str(value)
+
+class Output:
+    """Buffered writer of items or entries to stdout in one of output_formats.
+    Items are dictionaries with the given columns; entries are ldap3 entries.
+    Use as a context manager, to finish the output."""
+
+    def __init__(self, output_format = "text", columns = ["id"]):
+        self._format = output_format
+        self._columns = columns
+        self._buffer = io.StringIO()
+        self._count = 0
+        self._csv = None
+
+        if output_format in ("csv", "tsv"):
+            dialect = "excel" if output_format == "csv" else "excel-tab"
+            self._csv = csv.writer(self._buffer, dialect = dialect, lineterminator = "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._format == "json":
+            self._buffer.write("[]\n" if not self._count else "\n]\n")
+        self.flush()
+
+    def flush(self):
+        sys.stdout.write( self._buffer.getvalue() )
+        sys.stdout.flush()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def _json(self, record):
+        if self._format == "json":
+            self._buffer.write("[\n" if not self._count else ",\n")
+            self._buffer.write( json.dumps(record, sort_keys = True) )
+        else:
+            self._buffer.write( json.dumps(record, sort_keys = True) + "\n" )
+
+    def _header(self, columns):
+        if self._csv and not self._count:
+            self._csv.writerow(columns)
+
+    def _written(self):
+        self._count += 1
+        if self._buffer.tell() >= _buffer_size:
+            self.flush()
+
+    def write_item(self, item, text = None):
+        """Write a dictionary; in text format, write text, or the values"""
+
+        if self._format == "text":
+            if text is None:
+                text = " ".join( str(item[column]) for column in self._columns )
+            self._buffer.write(text + "\n")
+        elif self._csv:
+            self._header(self._columns)
+            row = [ item.get(column, "") for column in self._columns ]
+            self._csv.writerow([ "; ".join(value) if type(value) is list else value
+                for value in row ])
         else:
-            output(key + ":", value)
+            self._json(item)
 
-    print()
+        self._written()
+
+    def write_entry(self, entry):
+        """Write an ldap3 entry. In CSV and TSV, each value is a row of DN,
+        attribute name, and value; binary values are base64-encoded, with the
+        ;binary option added to the attribute name."""
+
+        if self._format == "text":
+            self._text_entry(entry)
+        else:
+            record = entry_record(entry.entry_dn, entry.entry_raw_attributes)
+            if self._csv:
+                self._header(["dn", "attribute", "value"])
+                for section, suffix in (("attributes", ""), ("binary", ";binary")):
+                    for name, values in sorted( record.get(section, {}).items() ):
+                        for value in values:
+                            self._csv.writerow([record["dn"], name + suffix, value])
+            else:
+                self._json(record)
+
+        self._written()
+
+    def _text_entry(self, entry):
+        """Human-readable attribute names and values, aligned in columns"""
+
+        # ldap3 prefixes names of operational attributes
+        prefix = get_config_parameter("ABSTRACTION_OPERATIONAL_ATTRIBUTE_PREFIX")
+        names = {}
+        for key in entry.entry_attributes:
+            if not entry[key].raw_values:
+                continue
+            elif key.startswith(prefix):
+                names[key] = key[len(prefix):]
+            else:
+                names[key] = key
+
+        width = max( [len(name) for name in names.values()] + [0] ) + 1
+        formatter = "{:%is} {:s}\n" % width
+
+        for key in sorted(names, key = lambda key: names[key]):
+            if value_kind(names[key]) == BINARY:
+                values = [ "(%i bytes)" % len(value) for value in entry[key].raw_values ]
+            else:
+                values = entry[key].values
+
+            label = names[key] + ":"
+            for value in values:
+                self._buffer.write( formatter.format(label, _text_value(value)) )
+                label = ""
+
+        self._buffer.write("\n")
+
+def save_value(entries, name, file_name):
+    """Write the raw value of the attribute of a single entry into file,
+    as received, without decoding"""
+
+    entries = list(entries)
+    if len(entries) != 1:
+        raise ValueError("Select one object to save %s, got %i" % (name, len(entries)))
+
+    values = None
+    for key, raw_values in entries[0].entry_raw_attributes.items():
+        if key.lower() == name.lower():
+            values = raw_values
+
+    if not values:
+        raise ValueError("%s has no attribute %s" % (entries[0].entry_dn, name))
+    elif len(values) > 1:
+        raise ValueError("Attribute %s has %i values, can't save them into one file"
+                % (name, len(values)))
+
+    if file_name == "-":
+        sys.stdout.buffer.write(values[0])
+        sys.stdout.flush()
+    else:
+        with open(file_name, "wb") as file_object:
+            file_object.write(values[0])
 
 def input_stderr(prompt = None):
     if prompt:
         sys.stderr.write(prompt)
         sys.stderr.flush()
-    return sys.stdin.readline()[:-1]
+
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError("Unexpected end of input")
+
+    return line.rstrip("\n")
@@ -0,0 +1,174 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, sys, os, io, json, socket, struct, signal, traceback
+import socketserver
+
+from .command import Command
+from .client import socket_path, STDOUT, STDERR, EXIT, frame_header, request_length
+
+log = logging.getLogger(__name__)
+
+class _SocketInput(io.RawIOBase):
+    """Client standard input, read from the socket; never a terminal"""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        return self._sock.recv_into(buf)
+
+    def isatty(self):
+        return False
+
+class _SocketOutput(io.RawIOBase):
+    """Client standard output or error, written to the socket in frames"""
+
+    def __init__(self, sock, channel, tty):
+        self._sock = sock
+        self._channel = channel
+        self._tty = tty
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._sock.sendall(frame_header.pack(self._channel, len(data)) + data)
+        return len(data)
+
+    def isatty(self):
+        return self._tty
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        uid = self._peer_uid()
+        if uid is not None and uid != os.getuid():
+            log.warning("Rejected connection from UID %i" % uid)
+            return
+
+        reader = io.BufferedReader(_SocketInput(sock))
+        size = request_length.unpack(reader.read(request_length.size))[0]
+        request = json.loads(reader.read(size).decode("utf-8"))
+        log.info("Request: %s" % " ".join(request["argv"]))
+
+        stdin = io.TextIOWrapper(reader, encoding = "utf-8")
+        stdout = io.TextIOWrapper(
+                io.BufferedWriter(_SocketOutput(sock, STDOUT, request["stdout_tty"])),
+                encoding = "utf-8",
+                line_buffering = request["stdout_tty"])
+        stderr = io.TextIOWrapper(
+                io.BufferedWriter(_SocketOutput(sock, STDERR, False)),
+                encoding = "utf-8",
+                line_buffering = True)
+
+        status = self.server.execute(request, stdin, stdout, stderr)
+
+        for stream in (stdout, stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        sock.sendall(frame_header.pack(EXIT, len(str(status))) + str(status).encode())
+
+    def _peer_uid(self):
+        try:
+            creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                    struct.calcsize("3i"))
+            return struct.unpack("3i", creds)[1]
+        except (AttributeError, OSError):
+            return None # not Linux
+
+class Daemon(socketserver.UnixStreamServer):
+    """Serve short commands one at a time, using warm connection, config and schema"""
+
+    def execute(self, request, stdin, stdout, stderr):
+        from . import main
+
+        saved_streams = (sys.stdin, sys.stdout, sys.stderr)
+        saved_cwd = os.getcwd()
+        root = logging.getLogger()
+        saved_logging = (root.handlers, root.level)
+
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+        root.handlers = [logging.StreamHandler(stderr)]
+        root.setLevel( main.get_log_level(request["log_level"]) )
+        try:
+            os.chdir(request["cwd"])
+            status, message = main.execute(request["argv"])
+            if message:
+                print(message, file = stderr)
+        except Exception:
+            traceback.print_exc(file = stderr)
+            status = 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved_streams
+            root.handlers, root.level = saved_logging
+            os.chdir(saved_cwd)
+
+        return status
+
+def _warm_up():
+    """Bind, load schema and object definitions before serving requests"""
+
+    from .connection import get_connection
+    from .main import command_modules, load_manifest
+    from .abstract import LdapObject
+    from .template import template_plan
+    from importlib import import_module
+
+    get_connection()
+    manifest, unconfigured = load_manifest()
+    for module_name in command_modules:
+        if module_name in unconfigured:
+            continue
+        module = import_module("." + module_name, "ldadm")
+        for value in vars(module).values():
+            if isinstance(value, type) and issubclass(value, LdapObject) \
+                    and value._object_class:
+                value._object_def
+                if value._config_node:
+                    template_plan(value)
+
+class DaemonCommand(Command):
+    parser_name = "daemon"
+    parser_args = {
+        "kwargs": {
+            "help": "Serve commands from a persistent process"
+        }
+    }
+
+    def on_daemon(self):
+        path = socket_path()
+
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise RuntimeError("Daemon already listening at %s" % path)
+            except OSError:
+                log.info("Removing stale socket %s" % path)
+                os.unlink(path)
+            finally:
+                probe.close()
+
+        _warm_up()
+
+        old_umask = os.umask(0o177)
+        try:
+            server = Daemon(path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        log.info("Listening at %s" % path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(path)
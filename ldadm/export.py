@@ -0,0 +1,169 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, sys, os, json, base64, gzip
+from argparse import ArgumentParser
+
+from ldap3 import ALL_ATTRIBUTES
+from ldap3.core.exceptions import LDAPOperationResult
+from ldap3.protocol.rfc2849 import search_response_to_ldif
+
+from .cache import cache_dir, cache_key, atomic_write
+from .console import entry_record
+
+log = logging.getLogger(__name__)
+
+export_output = ArgumentParser(add_help = False)
+export_output.add_argument("--format",
+        dest = "export_format",
+        choices = ["ldif", "jsonl"],
+        default = "ldif",
+        help = "Output format. Default: ldif")
+export_output.add_argument("--output",
+        metavar = "FILE_NAME",
+        help = "Write to file. If omitted, write to stdout.")
+export_output.add_argument("--compress",
+        choices = ["gzip", "zstd"],
+        help = "Compress each page of entries separately")
+export_output.add_argument("--resume",
+        action = "store_true",
+        help = "Continue the interrupted export to the same file")
+
+def _ldif_page(entries):
+    # ldap3 appends a comment with the entry count
+    lines = search_response_to_ldif(entries, False)[:-1]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def _jsonl_page(entries):
+    """Each entry is a JSON object with DN, text attributes, and base64-encoded
+    binary attributes, if any"""
+
+    chunks = []
+    for entry in entries:
+        record = entry_record(entry["dn"], entry["raw_attributes"])
+        chunks.append( json.dumps(record, sort_keys = True) + "\n" )
+
+    return "".join(chunks).encode("utf-8")
+
+def _compressor(method):
+    """Return a function compressing data into a self-contained frame.
+    Concatenated gzip members, as well as zstd frames, make a valid file."""
+
+    if not method:
+        return lambda data: data
+    elif method == "gzip":
+        return gzip.compress
+
+    try:
+        import zstandard
+    except ImportError as err:
+        msg = "Module 'zstandard' required for zstd compression, install ldadm[zstd]"
+        raise RuntimeError(msg) from err
+
+    return zstandard.ZstdCompressor().compress
+
+class _Checkpoint:
+    """State of an export to a file: where the next page starts in the file,
+    and the paged search cookie to fetch it"""
+
+    def __init__(self, file_name):
+        key = cache_key( os.path.abspath(file_name) )
+        self._file_name = os.path.join(cache_dir("export"), key + ".json")
+
+    def load(self):
+        try:
+            with open(self._file_name) as file_object:
+                return json.load(file_object)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        atomic_write(self._file_name, json.dumps(state).encode("utf-8"))
+
+    def remove(self):
+        try:
+            os.unlink(self._file_name)
+        except FileNotFoundError:
+            pass
+
+def export(mapping, export_format = "ldif", output = None, compress = None, resume = False):
+    """Write selected objects page by page, in constant memory. If written to
+    a file, save a checkpoint after each page, to resume after interruption."""
+
+    if resume and not output:
+        raise ValueError("Only export to a file can be resumed")
+
+    encode = _ldif_page if export_format == "ldif" else _jsonl_page
+    compress_frame = _compressor(compress)
+    query = [mapping._base, mapping._search_filter(), export_format, compress]
+
+    checkpoint = _Checkpoint(output) if output else None
+    state = checkpoint.load() if resume else None
+    if state and state["query"] != query:
+        raise ValueError("Export parameters differ from the interrupted export")
+    elif resume and not state:
+        log.warning("No interrupted export to %s, starting over" % output)
+
+    if state:
+        log.info("Resuming export after %i entries" % state["count"])
+        file_object = open(output, "r+b")
+        # drop a partially written page
+        file_object.truncate(state["offset"])
+        file_object.seek(state["offset"])
+        cookie = base64.b64decode(state["cookie"])
+        count = state["count"]
+    else:
+        state = {"query": query}
+        file_object = open(output, "wb") if output else sys.stdout.buffer
+        cookie = None
+        count = 0
+        if export_format == "ldif":
+            file_object.write( compress_frame(b"version: 1\n\n") )
+
+    skip = 0
+    restarted = False
+    try:
+        while True:
+            try:
+                for entries, cookie in mapping.pages(ALL_ATTRIBUTES, cookie):
+                    # entries exported before the cookie was rejected
+                    if skip:
+                        skipped = min(skip, len(entries))
+                        entries = entries[skipped:]
+                        skip -= skipped
+
+                    if entries:
+                        file_object.write( compress_frame(encode(entries)) )
+                        count += len(entries)
+                    file_object.flush()
+
+                    if checkpoint and cookie:
+                        os.fsync( file_object.fileno() )
+                        state["cookie"] = base64.b64encode(cookie).decode("ascii")
+                        state["count"] = count
+                        state["offset"] = file_object.tell()
+                        checkpoint.save(state)
+                break
+
+            except LDAPOperationResult as err:
+                # cookies are usually only valid for the connection that got them
+                if cookie is None or restarted or not count:
+                    raise
+                log.warning("Paged search can't be continued (%s), skipping %i exported entries"
+                        % (err, count))
+                cookie = None
+                skip = count
+                restarted = True
+
+    except BaseException:
+        if checkpoint:
+            log.warning("Export interrupted after %i entries; rerun with --resume to continue"
+                    % count)
+        raise
+    finally:
+        if output:
+            file_object.close()
+
+    if checkpoint:
+        checkpoint.remove()
+    log.info("Exported %i entries" % count)
@@ -0,0 +1,81 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, os, json, fcntl
+from argparse import ArgumentParser
+
+from .cache import cache_dir
+
+log = logging.getLogger(__name__)
+
+resumable = ArgumentParser(add_help = False)
+resumable.add_argument("--resume",
+        action = "store_true",
+        help = "Skip objects processed by the previous failed run")
+
+class Journal:
+    """Record IDs of objects processed by a bulk command, so that a failed run
+    can be resumed, and their DN changes, so that references to them can still
+    be updated. The journal is removed when the command succeeds. Each
+    command and its arguments have their own journal, locked while in use."""
+
+    def __init__(self, name, key, resume = False):
+        self._file_name = os.path.join(cache_dir("journal"), "%s-%s" % (name, key))
+        # IDs match case-insensitively, like in LDAP searches
+        self._done = set()
+        self._count = 0
+        # (old DN, new DN or None) of objects processed by previous runs
+        self.changes = []
+
+        fd = os.open(self._file_name, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        self._file = os.fdopen(fd, "r+")
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as err:
+            self._file.close()
+            raise RuntimeError("Another %s with the same arguments is running"
+                    % name.replace("_", " ")) from err
+
+        if not resume:
+            self._file.truncate(0)
+        else:
+            for line in self._file:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue # partially written, when interrupted
+                self._done.update( id.lower() for id in item["ids"] )
+                self._count += 1
+                if "dn" in item:
+                    self.changes.append( (item["dn"], item["new_dn"]) )
+
+            if self._count:
+                log.info("Resuming, skipping %i processed object(s)" % self._count)
+            else:
+                log.warning("No journal found for %s, nothing to resume" % name)
+
+    def __contains__(self, id):
+        return id.lower() in self._done
+
+    def record(self, ids, dn = None, new_dn = None):
+        """Mark the object with the IDs as processed, and moved from dn
+        to new_dn, or deleted; written immediately to survive a crash"""
+
+        self._done.update( id.lower() for id in ids )
+        self._count += 1
+        item = {"ids": ids}
+        if dn is not None:
+            item.update({"dn": dn, "new_dn": new_dn})
+        self._file.write(json.dumps(item) + "\n")
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            os.unlink(self._file_name)
+        elif self._count:
+            log.warning("%i object(s) processed; rerun with --resume to skip them"
+                    % self._count)
+        self._file.close()
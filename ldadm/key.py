@@ -0,0 +1,108 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging
+
+from .command import Command
+from .console import Output, output_format
+from .abstract import MissingObjects
+from .replica import max_staleness
+from .user import key_index
+
+log = logging.getLogger(__name__)
+
+def _problems(index, min_rsa_bits):
+    """Yield (user ID, DN, parsed key, problem, detail) for each key that is
+    invalid, unsupported, weak, or belongs to more than one user"""
+
+    for id, dn, key in index.keys:
+        if "error" in key:
+            problem = "unsupported" if key["unsupported"] else "invalid"
+            yield id, dn, key, problem, key["error"]
+            continue
+
+        if key["type"] == "ssh-dss":
+            yield id, dn, key, "weak", "DSA"
+        elif key["type"] == "ssh-rsa" and key["bits"] < min_rsa_bits:
+            yield id, dn, key, "weak", "RSA %i bits" % key["bits"]
+
+        others = set( owner for owner, owner_dn, owner_key in index.find(key["sha256"])
+                if owner_dn != dn )
+        if others:
+            yield id, dn, key, "shared", "also " + ", ".join(sorted(others))
+
+class KeyCommand(Command):
+    parser_name = "key"
+    parser_args = {
+        "kwargs": {
+            "help": "SSH public keys of all users"
+        },
+        "subparsers_title": "Key command",
+        "subparsers": {
+            "find": {
+                "kwargs": {
+                    "parents": [output_format, max_staleness],
+                    "help": "Find owners of public keys by fingerprint"
+                },
+                "arguments": {
+                    "fingerprint": {
+                        "metavar": "FINGERPRINT",
+                        "nargs": "*",
+                        "help": "MD5 or SHA256 fingerprint, as printed by ssh-keygen -l. "
+                                "If omitted, read from stdin."
+                    }
+                }
+            },
+            "audit": {
+                "kwargs": {
+                    "parents": [output_format, max_staleness],
+                    "help": "Report invalid, unsupported, weak and shared public keys"
+                },
+                "arguments": {
+                    "--min-rsa-bits": {
+                        "metavar": "BITS",
+                        "type": int,
+                        "default": 2048,
+                        "help": "Shorter RSA keys are weak. Default: 2048"
+                    }
+                }
+            }
+        }
+    }
+
+    def on_key_audit(self):
+        index = key_index(self._args.max_staleness)
+
+        columns = ["id", "dn", "problem", "detail", "fingerprint", "comment"]
+        with Output(self._args.output_format, columns) as output:
+            for id, dn, key, problem, detail in _problems(index, self._args.min_rsa_bits):
+                item = {"id": id, "dn": dn, "problem": problem, "detail": detail,
+                        "fingerprint": key.get("sha256"), "comment": key.get("comment")}
+                text = "%s %s: %s" % (id, problem, detail)
+                if key.get("sha256"):
+                    text += " %s" % key["sha256"]
+                if key.get("comment"):
+                    text += " (%s)" % key["comment"]
+                output.write_item(item, text)
+
+    def on_key_find(self):
+        index = key_index(self._args.max_staleness)
+
+        missing = []
+        columns = ["fingerprint", "id", "dn", "comment"]
+        with Output(self._args.output_format, columns) as output:
+            for fingerprint in self._args_or_stdin("fingerprint"):
+                owners = index.find(fingerprint)
+                if not owners:
+                    missing.append(fingerprint)
+
+                for id, dn, key in owners:
+                    item = {"fingerprint": fingerprint, "id": id, "dn": dn,
+                            "comment": key["comment"]}
+                    text = "%s %s" % (fingerprint, id)
+                    if key["comment"]:
+                        text += " (%s)" % key["comment"]
+                    output.write_item(item, text)
+
+        if missing:
+            raise MissingObjects("Keys", missing)
@@ -0,0 +1,195 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, os, re, time, json, hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from sshpubkeys import SSHKey, InvalidKeyException
+
+from .cache import cache_dir, atomic_write
+from .abstract import entry_name
+from .config import cfg
+
+log = logging.getLogger(__name__)
+
+# keys to parse, to be worth starting a process pool, and per worker task
+_parallel_keys = 2000
+_chunk_size = 100
+
+# seconds to reuse the cached owners of keys, unless a bound is given
+_max_age = 300
+
+_re_md5 = re.compile(r"^(?:MD5:)?((?:[0-9a-f]{2}:?){15}[0-9a-f]{2})$", re.IGNORECASE)
+_re_sha256 = re.compile(r"^(?:SHA256:)?([A-Za-z0-9+/]{43})=?$")
+
+def normalize_fingerprint(fingerprint):
+    """Return fingerprint as printed by ssh-keygen -l: MD5 with colons,
+    or base64 SHA256; the prefix and colons are optional"""
+
+    fingerprint = fingerprint.strip()
+    match = _re_md5.match(fingerprint)
+    if match:
+        digits = match.group(1).replace(":", "").lower()
+        return "MD5:" + ":".join( digits[i:i + 2] for i in range(0, len(digits), 2) )
+
+    match = _re_sha256.match(fingerprint)
+    if match:
+        return "SHA256:" + match.group(1)
+
+    raise ValueError("Invalid fingerprint: %s" % fingerprint)
+
+def parse_key(raw_key):
+    """Return a dictionary of key type, bits, fingerprints and comment;
+    or error message, if the key is invalid or unsupported"""
+
+    try:
+        pk = SSHKey(raw_key.decode("utf-8"))
+        pk.parse()
+    except NotImplementedError as err:
+        return {"error": str(err), "unsupported": True}
+    except (InvalidKeyException, UnicodeDecodeError) as err:
+        return {"error": str(err), "unsupported": False}
+
+    return {
+        "type": pk.key_type.decode("ascii"),
+        "bits": pk.bits,
+        "md5": pk.hash_md5(),
+        "sha256": pk.hash_sha256(),
+        "comment": pk.comment
+    }
+
+def _parse_keys(raw_keys):
+    """Parse a dictionary of raw keys, in a process pool if there are many
+    and more than one CPU; sshpubkeys is pure Python"""
+
+    if len(raw_keys) < _parallel_keys or (os.cpu_count() or 1) < 2:
+        return dict( (digest, parse_key(raw_key)) for digest, raw_key in raw_keys.items() )
+
+    log.debug("Parsing %i keys in parallel" % len(raw_keys))
+    with ProcessPoolExecutor() as executor:
+        keys = executor.map(parse_key, raw_keys.values(), chunksize = _chunk_size)
+        return dict( zip(raw_keys.keys(), keys) )
+
+class KeyIndex:
+    """Owners of SSH public keys by MD5 and SHA256 fingerprint, built from one
+    search of the public key attribute per user mapping. Parsed keys are cached
+    by hash of the raw value, so unchanged keys are never parsed again. Owners
+    are cached, too, and reused if the cache is no older than max_age seconds."""
+
+    def __init__(self, mappings, max_age = None):
+        directory = cache_dir("keys")
+        self._file_name = os.path.join(directory, "parsed.json")
+        self._owners_file = os.path.join(directory, "owners.json")
+        if max_age is None:
+            max_age = _max_age
+
+        try:
+            with open(self._file_name) as file_object:
+                cached = json.load(file_object)
+        except (OSError, ValueError):
+            cached = {}
+
+        # (user ID, DN, hash of the raw key) for each key
+        self._found = self._load_owners(max_age, cached)
+        pending = {}
+        if self._found is None:
+            self._found = []
+            pubkey_attr = cfg.user.attr.pubkey
+            for mapping in mappings:
+                id_attr = mapping.__class__._attribute
+                for entry in mapping.values():
+                    if pubkey_attr not in entry:
+                        continue
+
+                    id = entry_name(entry, id_attr)
+                    for raw_key in entry[pubkey_attr].raw_values:
+                        digest = hashlib.sha256(raw_key).hexdigest()
+                        if digest not in cached:
+                            pending[digest] = raw_key
+                        self._found.append( (id, entry.entry_dn, digest) )
+            self._save_owners()
+
+        self._parsed = dict( (digest, cached[digest]) for id, dn, digest in self._found
+                if digest in cached )
+        self._parsed.update( _parse_keys(pending) )
+
+        # (user ID, DN, parsed key) for each key
+        self.keys = []
+        self._owners = {}
+        for id, dn, digest in self._found:
+            self._index(id, dn, self._parsed[digest])
+
+        # keys no longer found are dropped from the cache
+        if self._parsed.keys() != cached.keys():
+            log.debug("Parsed %i new key(s)" % len(self._parsed.keys() - cached.keys()))
+            self._save_parsed()
+
+    def _load_owners(self, max_age, parsed):
+        """Return cached owners, unless older than max_age, or their keys
+        aren't in the parsed cache; else None"""
+
+        try:
+            with open(self._owners_file) as file_object:
+                data = json.load(file_object)
+            age = time.time() - data["time"]
+            found = [ tuple(item) for item in data["keys"] ]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        if not 0 <= age < max_age or any( digest not in parsed for id, dn, digest in found ):
+            return None
+
+        log.debug("Using owners of keys cached %i s ago" % age)
+        return found
+
+    def _save_owners(self):
+        data = {"time": time.time(), "keys": self._found}
+        try:
+            atomic_write(self._owners_file, json.dumps(data).encode("utf-8"))
+        except OSError as err:
+            log.debug("Key owners not saved: %s" % err)
+
+    def _save_parsed(self):
+        try:
+            atomic_write(self._file_name, json.dumps(self._parsed).encode("utf-8"))
+        except OSError as err:
+            log.debug("Key cache not saved: %s" % err)
+
+    def _index(self, id, dn, key):
+        item = (id, dn, key)
+        self.keys.append(item)
+        for fingerprint in (key.get("md5"), key.get("sha256")):
+            if fingerprint:
+                self._owners.setdefault(fingerprint, []).append(item)
+
+    def add(self, id, dn, raw_key):
+        """Record a key added to the user, keeping the cached owners age"""
+
+        digest = hashlib.sha256(raw_key).hexdigest()
+        if digest not in self._parsed:
+            self._parsed[digest] = parse_key(raw_key)
+            self._save_parsed()
+
+        self._found.append( (id, dn, digest) )
+        self._index(id, dn, self._parsed[digest])
+        try:
+            with open(self._owners_file) as file_object:
+                data = json.load(file_object)
+            data["keys"].append( [id, dn, digest] )
+            atomic_write(self._owners_file, json.dumps(data).encode("utf-8"))
+        except (OSError, ValueError, KeyError) as err:
+            log.debug("Key owners not saved: %s" % err)
+
+    @staticmethod
+    def invalidate():
+        """Forget cached owners, e.g. when a key is deleted"""
+
+        try:
+            os.unlink( os.path.join(cache_dir("keys"), "owners.json") )
+        except FileNotFoundError:
+            pass
+
+    def find(self, fingerprint):
+        """Return (user ID, DN, parsed key) of each key with the fingerprint"""
+
+        return self._owners.get(normalize_fingerprint(fingerprint), [])
@@ -1,17 +1,23 @@
 # Copyright 2017, Development Gateway, Inc.
 # This file is part of ldadm, see COPYING.
 
-import logging, sys, os, argparse, inspect
+import logging, sys, os, argparse, inspect, json
 from importlib import import_module
 
 from .command import Command
+from .cache import cache_dir, atomic_write
+from . import client
 
 log = None
 
-def _set_log_level():
+# modules containing Command subclasses
+command_modules = ["user", "server", "project", "access", "key", "authorized_keys", "nss", "replica", "complete", "daemon", "batch"]
+
+def get_log_level(env_level):
     valid_levels = ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"]
     try:
-        env_level = os.environ["LOG_LEVEL"]
+        if env_level is None:
+            raise KeyError("LOG_LEVEL")
         valid_levels.remove(env_level)
         level = getattr(logging, env_level)
     except KeyError:
@@ -22,26 +28,117 @@ def _set_log_level():
         print(msg, file = sys.stderr)
         level = logging.WARNING
 
+    return level
+
+def _set_log_level():
+    level = get_log_level(os.environ.get("LOG_LEVEL"))
     logging.basicConfig(level = level)
     global log
     log = logging.getLogger(__name__)
 
-def main():
-    _set_log_level()
+def _package_stamp():
+    """Describe the package directory and the config file, to detect if the
+    manifest is outdated. Installing or checking out the package replaces
+    the files, changing the directory modification time."""
 
-    ap = argparse.ArgumentParser(description = "Manage LDAP accounts")
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    stamp = [ ["package", os.stat(package_dir).st_mtime] ]
 
-    subcommands = ap.add_subparsers(description = "Objects to manage", dest = "subcommand")
-    subcommands.required = True
+    # commands of sections added to the config become available
+    from .config import file_name as config_file_name
+    stat = os.stat(config_file_name())
+    stamp.append(["config", stat.st_mtime, stat.st_size])
+
+    return stamp
+
+def _build_manifest():
+    """Import all command modules, and map commands to their classes;
+    return the map, and the errors of modules missing settings"""
+
+    from .config import ConfigAttrError
 
-    command_modules = ["user", "server", "project"]
+    manifest = {}
+    unconfigured = {}
     for module_name in command_modules:
-        module = import_module("." + module_name, "ldadm")
+        try:
+            module = import_module("." + module_name, "ldadm")
+        except ConfigAttrError as err:
+            log.debug("Module %s not loaded: %s" % (module_name, err))
+            unconfigured[module_name] = str(err)
+            continue
+
         for name, cls in inspect.getmembers(module, inspect.isclass):
-            if cls is not Command and issubclass(cls, Command):
-                cls.add_subparser(subcommands)
+            if cls is not Command and issubclass(cls, Command) \
+                    and cls.__module__ == module.__name__:
+                manifest[cls.parser_name] = {
+                    "module": module_name,
+                    "class": name
+                }
+
+    return manifest, unconfigured
+
+def load_manifest():
+    """Return the command manifest, and why modules are missing from it;
+    rebuild it only if sources or the config changed"""
+
+    stamp = _package_stamp()
+    try:
+        file_name = os.path.join(cache_dir(), "commands.json")
+        with open(file_name) as file_object:
+            cached = json.load(file_object)
+        if cached["stamp"] == stamp:
+            return cached["commands"], cached["unconfigured"]
+    except (OSError, KeyError, ValueError) as err:
+        log.debug("Command manifest not loaded: %s" % err)
+
+    log.debug("Building command manifest")
+    manifest, unconfigured = _build_manifest()
+    try:
+        data = json.dumps({"stamp": stamp, "commands": manifest, "unconfigured": unconfigured})
+        atomic_write(os.path.join(cache_dir(), "commands.json"), data.encode("utf-8"))
+    except (OSError, KeyError) as err:
+        log.debug("Command manifest not saved: %s" % err)
+
+    return manifest, unconfigured
+
+def build_parser(argv):
+    """Build argument parser for the command in argv; the whole tree only if
+    the command is unknown, or help is requested for the top level"""
+
+    manifest, unconfigured = load_manifest()
 
-    args = ap.parse_args()
+    if unconfigured:
+        for module_name, message in sorted(unconfigured.items()):
+            log.debug("Commands in module %s are not available: %s" % (module_name, message))
+        epilog = "Commands of modules %s are not available, because their settings are " \
+                "missing from the config file." % ", ".join(sorted(unconfigured))
+    else:
+        epilog = None
+
+    ap = argparse.ArgumentParser(description = "Manage LDAP accounts", epilog = epilog)
+
+    subcommands = ap.add_subparsers(description = "Objects to manage", dest = "subcommand")
+    subcommands.required = True
+
+    if argv and argv[0] in manifest:
+        names = [ argv[0] ]
+        path = argv[1:]
+    else:
+        names = list(manifest)
+        path = None
+
+    for name in names:
+        entry = manifest[name]
+        module = import_module("." + entry["module"], "ldadm")
+        cls = getattr(module, entry["class"])
+        cls.add_subparser(subcommands, path = path)
+
+    return ap
+
+def run(argv):
+    """Parse arguments, and invoke the command handler in this process"""
+
+    args = build_parser(argv).parse_args(argv)
 
     log.debug("Invoking %s.%s" % (args._class.__name__, args._event))
     try:
@@ -54,5 +151,33 @@ def main():
         else:
             sys.exit(str(e))
 
+def execute(argv):
+    """Run the command in this process; return exit status and error message"""
+
+    try:
+        run(argv)
+    except SystemExit as exit:
+        if exit.code is None:
+            return 0, None
+        elif type(exit.code) is int:
+            return exit.code, None
+        else:
+            return 1, str(exit.code)
+
+    return 0, None
+
+def main():
+    _set_log_level()
+
+    argv = sys.argv[1:]
+
+    # let the daemon handle the command, if it's running
+    if argv[:1] != ["daemon"]:
+        status = client.forward(argv)
+        if status is not None:
+            sys.exit(status)
+
+    run(argv)
+
 if __name__ == "__main__":
     main()
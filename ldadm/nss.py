@@ -0,0 +1,237 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, os, json
+
+from ldap3.utils.dn import safe_rdn
+
+from .command import Command
+from .cache import cache_dir, cache_key, atomic_write
+from .config import cfg, ConfigAttrError
+from .abstract import normalize_dn
+from .user import UserMapping
+from .project import ProjectMapping
+
+log = logging.getLogger(__name__)
+
+# RFC 2307 attributes
+_gid_number = "gidNumber"
+_home = "homeDirectory"
+_shell = "loginShell"
+_gecos = "gecos"
+
+def _values(response, name):
+    try:
+        return [ value.decode("utf-8") for value in response["raw_attributes"][name] ]
+    except KeyError:
+        return []
+
+def _first(response, name):
+    values = _values(response, name)
+    return values[0] if values else None
+
+def _response_id(response, id_attr):
+    """ID of a raw search response: the single value, or the one in RDN"""
+
+    values = _values(response, id_attr)
+    if len(values) == 1:
+        return values[0]
+
+    for name, value in safe_rdn(response["dn"], decompose = True):
+        if name.lower() == id_attr.lower() and value in values:
+            return value
+
+    return min(values) if values else None
+
+def _field(value):
+    """Make a value safe to use as a colon-separated field"""
+
+    if value is None:
+        return ""
+    return str(value).replace(":", " ").replace("\n", " ")
+
+class _Map:
+    """Lines of a libnss-cache map, indexed by fields, e.g. name and ID"""
+
+    def __init__(self, name, mode, indices):
+        self.name = name
+        self.mode = mode
+        self.indices = indices
+        self._lines = []
+
+    def add(self, fields):
+        self._lines.append( [ _field(field) for field in fields ] )
+
+    def write(self, directory):
+        """Write the map sorted by name, then its indices: a line per key,
+        with the key, the offset of the map line, and NUL padding"""
+
+        self._lines.sort(key = lambda fields: fields[0])
+
+        data = []
+        offsets = []
+        offset = 0
+        for fields in self._lines:
+            line = (":".join(fields) + "\n").encode("utf-8")
+            data.append(line)
+            offsets.append(str(offset))
+            offset += len(line)
+
+        file_name = os.path.join(directory, self.name + ".cache")
+        atomic_write(file_name, b"".join(data), mode = self.mode)
+
+        for index_name, column in self.indices.items():
+            index = sorted( (fields[column], position)
+                    for fields, position in zip(self._lines, offsets) )
+            width = max( [ len(key) + len(position) for key, position in index ] + [0] )
+
+            lines = [ "%s\0%s\0%s\n" % (key, position, "\0" * (width - len(key) - len(position)))
+                    for key, position in index ]
+            atomic_write(file_name + ".ix" + index_name, "".join(lines).encode("utf-8"),
+                    mode = self.mode)
+
+        log.info("Wrote %i entries to %s" % (len(self._lines), file_name))
+
+class NssExport:
+    """Write passwd, shadow and group maps of active users, and groups made
+    from projects, reading each in one paged search"""
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._state_file = os.path.join(cache_dir("nss"), cache_key(directory) + ".json")
+        try:
+            self._gid_attr = cfg.project.attr.gid
+        except ConfigAttrError:
+            self._gid_attr = _gid_number
+
+    def _mappings(self):
+        return {
+            "users": UserMapping(base = cfg.user.base.active),
+            "projects": ProjectMapping()
+        }
+
+    def _load_state(self):
+        try:
+            with open(self._state_file) as file_object:
+                return json.load(file_object)
+        except (OSError, ValueError):
+            return None
+
+    def changed(self):
+        """Check if users or projects were modified, added or deleted since
+        the last export: by modifyTimestamp, and by number of entries"""
+
+        state = self._load_state()
+        if not state:
+            return True
+
+        for name, mapping in self._mappings().items():
+            latest = state["latest"][name]
+            if latest is None or len(mapping) != state["counts"][name]:
+                return True
+
+            mapping.select("(&(modifyTimestamp>=%s)(!(modifyTimestamp=%s)))" % (latest, latest))
+            if mapping:
+                return True
+
+        return False
+
+    @staticmethod
+    def _responses(mapping, attributes, state, name):
+        """Yield raw entries page by page, noting the latest modifyTimestamp
+        and the number of entries in state"""
+
+        count = 0
+        latest = None
+        for entries, cookie in mapping.pages(attributes + ["modifyTimestamp"]):
+            for response in entries:
+                modified = _first(response, "modifyTimestamp")
+                if modified and (latest is None or modified > latest):
+                    latest = modified
+                count += 1
+                yield response
+
+        state["latest"][name] = latest
+        state["counts"][name] = count
+
+    def write(self):
+        mappings = self._mappings()
+        state = {"latest": {}, "counts": {}}
+
+        passwd = _Map("passwd", 0o644, {"name": 0, "uid": 2})
+        shadow = _Map("shadow", 0o600, {"name": 0})
+        group = _Map("group", 0o644, {"name": 0, "gid": 2})
+
+        id_attr = UserMapping._attribute
+        nuid_attr = cfg.user.attr.nuid
+        attributes = [id_attr, nuid_attr, _gid_number, _home, _shell, _gecos]
+        users = {}
+        for response in self._responses(mappings["users"], attributes, state, "users"):
+            name = _response_id(response, id_attr)
+            uid = _first(response, nuid_attr)
+            gid = _first(response, _gid_number)
+            home = _first(response, _home)
+            if not (name and uid and gid and home):
+                log.warning("%s is not a POSIX account, skipped" % response["dn"])
+                continue
+
+            users[normalize_dn(response["dn"])] = name
+            passwd.add([name, "x", uid, gid, _first(response, _gecos), home,
+                _first(response, _shell)])
+            shadow.add([name, "*", "", "", "", "", "", "", ""])
+
+        attr = cfg.project.attr
+        project_attr = ProjectMapping._attribute
+        attributes = [project_attr, self._gid_attr, attr.member, attr.manager]
+        for response in self._responses(mappings["projects"], attributes, state, "projects"):
+            name = _response_id(response, project_attr)
+            gid = _first(response, self._gid_attr)
+            if not (name and gid):
+                log.debug("%s has no group ID, skipped" % response["dn"])
+                continue
+
+            members = set()
+            for dn in _values(response, attr.member) + _values(response, attr.manager):
+                try:
+                    members.add( users[normalize_dn(dn)] )
+                except KeyError:
+                    pass # not an active user
+            group.add([name, "*", gid, ",".join(sorted(members))])
+
+        for nss_map in (passwd, shadow, group):
+            nss_map.write(self._directory)
+
+        atomic_write(self._state_file, json.dumps(state).encode("utf-8"))
+
+class NssExportCommand(Command):
+    parser_name = "nss-export"
+    parser_args = {
+        "kwargs": {
+            "help": "Write passwd, shadow and group maps for libnss-cache"
+        },
+        "arguments": {
+            "--directory": {
+                "metavar": "DIRECTORY",
+                "help": "Where to write the maps. Default: path in section nss, or /etc"
+            },
+            "--incremental": {
+                "action": "store_true",
+                "help": "Only write the maps if users or projects changed since the last export"
+            }
+        }
+    }
+
+    def on_nss_export(self):
+        directory = self._args.directory
+        if not directory:
+            try:
+                directory = cfg.nss.path
+            except ConfigAttrError:
+                directory = "/etc"
+
+        nss_export = NssExport(directory)
+        if self._args.incremental and not nss_export.changed():
+            log.info("No changes since the last export")
+            return
+
+        nss_export.write()
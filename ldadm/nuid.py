@@ -0,0 +1,174 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging
+
+from ldap3 import BASE, MODIFY_ADD, MODIFY_DELETE
+from ldap3.core.exceptions import LDAPOperationResult, LDAPNoSuchObjectResult
+from ldap3.core.results import RESULT_NO_SUCH_ATTRIBUTE, RESULT_ATTRIBUTE_OR_VALUE_EXISTS, \
+        RESULT_CONSTRAINT_VIOLATION
+
+from .config import cfg, ConfigAttrError
+from .connection import get_connection
+
+log = logging.getLogger(__name__)
+
+# attempts to update the counter, if other clients keep changing it
+_max_attempts = 10
+
+class NumberBitmap:
+    """Set of integers within a range, one bit per number"""
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        self._bits = bytearray( (high - low) // 8 + 1 )
+
+    def add(self, number):
+        if self.low <= number <= self.high:
+            offset = number - self.low
+            self._bits[offset >> 3] |= 1 << (offset & 7)
+
+    def __contains__(self, number):
+        if number < self.low or number > self.high:
+            return False
+        offset = number - self.low
+        return bool( self._bits[offset >> 3] & (1 << (offset & 7)) )
+
+    def free(self, start = None):
+        """Yield numbers not in the set, in ascending order, skipping full bytes"""
+
+        number = self.low if start is None else max(start, self.low)
+        while number <= self.high:
+            offset = number - self.low
+            if not offset & 7 and self._bits[offset >> 3] == 0xff:
+                number += 8
+                continue
+            if number not in self:
+                yield number
+            number += 1
+
+    def find_block(self, count, start = None):
+        """Return the lowest number starting a run of count free numbers"""
+
+        run_start = None
+        for number in self.free(start):
+            if run_start is None or number != previous + 1:
+                run_start = number
+            previous = number
+            if number - run_start + 1 == count:
+                return run_start
+
+        raise RuntimeError("No %i free numeric user ID(s) left in range %i-%i"
+                % (count, self.low, self.high))
+
+class NumberAllocator:
+    """Reserve unused numeric user IDs. All the numbers in use are read once.
+    If a counter entry is configured, it holds the next number to hand out,
+    and is updated atomically, so concurrent clients never get the same one."""
+
+    def __init__(self):
+        self._attr_name = cfg.user.attr.nuid
+        self._used = NumberBitmap(cfg.user.nuid.min, cfg.user.nuid.max)
+        try:
+            self._counter = cfg.user.nuid.counter
+        except ConfigAttrError:
+            self._counter = None
+            log.debug("Numeric user ID counter not configured")
+
+        self._scan()
+
+    def _scan(self):
+        """Stream numeric IDs of all active and suspended users into the bitmap"""
+
+        conn = get_connection()
+        for base in (cfg.user.base.suspended, cfg.user.base.active):
+            results = conn.extend.standard.paged_search(
+                    search_base = base,
+                    search_filter = "(%s=*)" % self._attr_name,
+                    attributes = [self._attr_name],
+                    paged_size = cfg.ldap.paged_search_size,
+                    generator = True)
+            for response in results:
+                if response["type"] != "searchResEntry":
+                    continue
+                for value in response["raw_attributes"].get(self._attr_name, []):
+                    self._used.add( int(value) )
+
+    def _read_counter(self):
+        conn = get_connection(write = True)
+        try:
+            conn.search(self._counter, "(objectClass=*)",
+                    search_scope = BASE,
+                    attributes = [self._attr_name])
+        except LDAPNoSuchObjectResult:
+            raise RuntimeError("Numeric user ID counter entry %s not found" % self._counter)
+        try:
+            values = conn.response[0]["raw_attributes"][self._attr_name]
+            return int(values[0])
+        except (IndexError, KeyError):
+            return None
+
+    def _swap_counter(self, old, new):
+        """Change counter value, failing if it's not the old one anymore"""
+
+        # another client set the counter first: the same value exists, a single
+        # valued attribute can't take another one, or the old value is gone
+        if old is None:
+            changes = [ (MODIFY_ADD, [str(new)]) ]
+            conflicts = (RESULT_ATTRIBUTE_OR_VALUE_EXISTS, RESULT_CONSTRAINT_VIOLATION)
+        else:
+            changes = [ (MODIFY_DELETE, [str(old)]), (MODIFY_ADD, [str(new)]) ]
+            conflicts = (RESULT_NO_SUCH_ATTRIBUTE,)
+
+        try:
+            get_connection(write = True).modify(self._counter, {self._attr_name: changes})
+            return True
+        except LDAPOperationResult as err:
+            if err.result not in conflicts:
+                raise
+            log.debug("Counter changed by another client: %s" % err)
+            return False
+
+    def reserve(self, count = 1):
+        """Return a list of count consecutive free numbers"""
+
+        if not self._counter:
+            start = self._used.find_block(count)
+            self._mark(start, count)
+            return list( range(start, start + count) )
+
+        for attempt in range(_max_attempts):
+            current = self._read_counter()
+            start = self._used.find_block(count, current)
+            if self._swap_counter(current, start + count):
+                log.debug("Reserved %i numeric user ID(s) from %i" % (count, start))
+                self._mark(start, count)
+                return list( range(start, start + count) )
+
+        raise RuntimeError("Couldn't update numeric user ID counter in %i attempts"
+                % _max_attempts)
+
+    def claim(self, number):
+        """Reserve a given number, failing if it's in use"""
+
+        if number in self._used or not self._used.low <= number <= self._used.high \
+                and self._in_use(number):
+            raise RuntimeError("Numeric user ID %i already in use" % number)
+
+        self._mark(number, 1)
+
+    def _in_use(self, number):
+        """Search for a number outside the range, which the bitmap doesn't hold"""
+
+        conn = get_connection()
+        for base in (cfg.user.base.suspended, cfg.user.base.active):
+            conn.search(base, "(%s=%i)" % (self._attr_name, number), attributes = [])
+            if conn.entries:
+                return True
+
+        return False
+
+    def _mark(self, start, count):
+        for number in range(start, start + count):
+            self._used.add(number)
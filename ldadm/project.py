@@ -6,16 +6,17 @@ from argparse import ArgumentParser
 
 from ldap3.core.exceptions import LDAPEntryAlreadyExistsResult, LDAPKeyError, \
         LDAPAttributeOrValueExistsResult
-from ldap3 import ALL_ATTRIBUTES, ObjectDef
+from ldap3 import ALL_ATTRIBUTES
 
 from .command import Command
-from .abstract import MissingObjects, LdapObjectMapping, LdapObject
+from .journal import resumable
+from .records import record_input, read_records, import_records
+from .export import export_output, export
+from .abstract import MissingObjects, LdapObjectMapping, LdapObject, LazyObjectDef
 from .config import cfg
-from .user import single_user, multi_user, UserMapping
 from .unit import UnitMapping, single_unit, multi_unit
-from .console import pretty_print
-from .connection import ldap
-from .server import ServerMapping
+from .replica import max_staleness
+from .console import Output, output_format, show_attributes
 
 log = logging.getLogger(__name__)
 
@@ -24,6 +25,11 @@ single_project.add_argument("project",
         metavar = "PROJECT",
         help = "Project name")
 
+single_manager = ArgumentParser(add_help = False)
+single_manager.add_argument("username",
+        metavar = "USER_NAME",
+        help = "User ID")
+
 multi_project = ArgumentParser(add_help = False)
 multi_project.add_argument("project",
         metavar = "PROJECT_NAME",
@@ -33,12 +39,13 @@ multi_project.add_argument("project",
 class Project(LdapObject):
     _config_node = cfg.project
     _object_class = cfg.project.objectclass
-    _object_def = ObjectDef(object_class = _object_class, schema = ldap)
+    _object_def = LazyObjectDef(_object_class)
     attribute = cfg.project.attr.id
 
 class ProjectMapping(LdapObjectMapping):
     _name = "Projects"
-    _object_def = Project._object_def
+    _object_class = Project._object_class
+    _object_def = LazyObjectDef(_object_class)
     _base = cfg.project.base
     _attribute = Project.attribute
 
@@ -53,12 +60,19 @@ class ProjectCommand(Command):
         "subparsers": {
             "list": {
                 "kwargs": {
+                    "parents": [output_format, max_staleness],
                     "help": "List all projects"
                 }
             },
+            "count": {
+                "kwargs": {
+                    "parents": [max_staleness],
+                    "help": "Count projects"
+                }
+            },
             "show": {
                 "kwargs": {
-                    "parents": [multi_project],
+                    "parents": [multi_project, output_format, show_attributes, max_staleness],
                     "aliases": ["info"],
                     "help": "List project attributes"
                 }
@@ -77,9 +91,21 @@ class ProjectCommand(Command):
                     }
                 }
             },
+            "export": {
+                "kwargs": {
+                    "parents": [export_output],
+                    "help": "Write all projects as LDIF or JSON lines"
+                }
+            },
+            "import": {
+                "kwargs": {
+                    "parents": [record_input],
+                    "help": "Add projects from CSV, JSON lines or LDIF records, without prompting"
+                }
+            },
             "delete": {
                 "kwargs": {
-                    "parents": [multi_project],
+                    "parents": [multi_project, resumable],
                     "aliases": ["remove"],
                     "help": "Delete projects"
                 }
@@ -112,7 +138,7 @@ class ProjectCommand(Command):
             },
             "manage": {
                 "kwargs": {
-                    "parents": [single_project, single_user],
+                    "parents": [single_project, single_manager],
                     "help": "Make user the manager of the project"
                 }
             },
@@ -124,12 +150,13 @@ class ProjectCommand(Command):
                 "subparsers": {
                     "list": {
                         "kwargs": {
+                            "parents": [output_format, max_staleness],
                             "help": "List all units"
                         }
                     },
                     "show": {
                         "kwargs": {
-                            "parents": [single_unit],
+                            "parents": [single_unit, output_format, max_staleness],
                             "aliases": ["info"],
                             "help": "List projects in the unit"
                         },
@@ -161,7 +188,7 @@ class ProjectCommand(Command):
                     },
                     "assign": {
                         "kwargs": {
-                            "parents": [single_unit, multi_project],
+                            "parents": [single_unit, multi_project, resumable],
                             "help": "Move projects to the unit (category)"
                         }
                     }
@@ -171,15 +198,17 @@ class ProjectCommand(Command):
     }
 
     def on_project_list(self):
-        projects = ProjectMapping()
-        for name in projects:
-            print(name)
+        projects = ProjectMapping().from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for name in projects:
+                output.write_item({"id": name})
+
+    def on_project_count(self):
+        print( len(ProjectMapping().from_replica(self._args.max_staleness)) )
 
     def on_project_show(self):
-        projects = ProjectMapping(attrs = ALL_ATTRIBUTES)
-        projects.select(self._args_or_stdin("project"))
-        for entry in projects.values():
-            pretty_print(entry)
+        projects = ProjectMapping(attrs = self._projection(ProjectMapping)).from_replica(self._args.max_staleness)
+        self._show(projects, "project")
 
     def on_project_add(self):
         attr_name = Project.attribute
@@ -191,34 +220,51 @@ class ProjectCommand(Command):
         else:
             source_obj = None
 
-        post = {
-                cfg.project.attr.manager: UserMapping.get_dn,
-                cfg.project.attr.member: UserMapping.get_dn
-                }
-        project = Project(reference_object = source_obj, post = post)
+        project = Project(reference_object = source_obj, post = self._callbacks_post())
         id = project.attrs[attr_name]
         projects[id] = project.attrs
 
         if project.message:
             print(project.message)
 
+    def _callbacks_post(self):
+        from .user import UserMapping
+        return {
+                cfg.project.attr.manager: UserMapping.get_dn,
+                cfg.project.attr.member: UserMapping.get_dn
+                }
+
+    def on_project_export(self):
+        export(ProjectMapping(),
+                export_format = self._args.export_format,
+                output = self._args.output,
+                compress = self._args.compress,
+                resume = self._args.resume)
+
+    def on_project_import(self):
+        post = self._callbacks_post()
+        records = read_records(self._args.file, self._args.input_format)
+        import_records(ProjectMapping(), records, Project, post = post)
+
     def on_project_delete(self):
         project_names = self._args_or_stdin("project")
         projects = ProjectMapping()
-        projects.select(project_names).delete()
+        with self._journal() as journal:
+            projects.select(project_names).delete(journal = journal)
 
     def on_project_addserver(self):
         project_name = self._args.project
         attr_name = cfg.project.attr.server
 
         projects = ProjectMapping(attrs = attr_name)
-        project = projects[project_name].entry_writable()
+        project = projects.writable(project_name)
         servers = project[attr_name]
 
         names = list(self._args_or_stdin("names"))
         if not names:
             raise RuntimeError("Expected server IDs to add to %s" % project_name)
 
+        from .server import ServerMapping
         servers += ServerMapping.get_dn(names)
 
         try:
@@ -231,13 +277,14 @@ class ProjectCommand(Command):
         attr_name = cfg.project.attr.member
 
         projects = ProjectMapping(attrs = attr_name)
-        project = projects[project_name].entry_writable()
+        project = projects.writable(project_name)
         members = project[attr_name]
 
         names = list(self._args_or_stdin("names"))
         if not names:
             raise RuntimeError("Expected user IDs to assign to %s" % project_name)
 
+        from .user import UserMapping
         members += UserMapping.get_dn(names)
 
         try:
@@ -250,8 +297,9 @@ class ProjectCommand(Command):
         attr_name = cfg.project.attr.manager
 
         projects = ProjectMapping(attrs = attr_name)
-        project = projects[self._args.project].entry_writable()
+        project = projects.writable(self._args.project)
 
+        from .user import UserMapping
         users = UserMapping(base = cfg.user.base.active)
         users.select([user_name])
         dn = list( users.dns() )[0]
@@ -260,17 +308,19 @@ class ProjectCommand(Command):
         project.entry_commit_changes(refresh = False)
 
     def on_project_unit_list(self):
-        units = UnitMapping(cfg.project.base)
-        for unit in units:
-            print(unit)
+        units = UnitMapping(cfg.project.base).from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for unit in units:
+                output.write_item({"id": unit})
 
     def on_project_unit_show(self):
-        units = UnitMapping(cfg.project.base)
+        units = UnitMapping(cfg.project.base).from_replica(self._args.max_staleness)
         base = units[self._args.unit].entry_dn
 
-        projects = ProjectMapping(base = base, sub_tree = self._args.full)
-        for uid in projects:
-            print(uid)
+        projects = ProjectMapping(base = base, sub_tree = self._args.full).from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for uid in projects:
+                output.write_item({"id": uid})
 
     def on_project_unit_add(self):
         units = UnitMapping(cfg.project.base)
@@ -292,4 +342,5 @@ class ProjectCommand(Command):
 
         projects = ProjectMapping(base = base)
         projects.select(self._args_or_stdin("project"))
-        projects.move(unit.entry_dn)
+        with self._journal() as journal:
+            projects.move(unit.entry_dn, journal = journal)
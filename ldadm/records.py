@@ -0,0 +1,164 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, sys, os, csv, json, base64
+from argparse import ArgumentParser, FileType
+
+from .template import template_plan
+
+log = logging.getLogger(__name__)
+
+input_formats = ["csv", "jsonl", "ldif"]
+
+record_input = ArgumentParser(add_help = False)
+record_input.add_argument("file",
+        metavar = "FILE_NAME",
+        type = FileType("r"),
+        nargs = "?",
+        help = "Read records from file. If omitted, read from stdin.")
+record_input.add_argument("--format",
+        dest = "input_format",
+        choices = input_formats,
+        help = "Record format. If omitted, guessed from file extension.")
+
+def _read_csv(file_object):
+    """First row names the attributes; multiple values are separated by
+    a semicolon and a space, like in interactive input"""
+
+    for row in csv.DictReader(file_object):
+        yield row
+
+def _read_jsonl(file_object):
+    """One JSON object per line; multiple values are lists"""
+
+    for line in file_object:
+        if line.strip():
+            record = json.loads(line)
+            if type(record) is not dict:
+                raise ValueError("JSON object expected, got: %s" % line.strip())
+            yield record
+
+def _ldif_value(line):
+    name, sep, value = line.partition(":")
+    if not sep:
+        raise ValueError("Invalid LDIF line: %s" % line)
+
+    if value.startswith(":"):
+        try:
+            value = base64.b64decode(value[1:].strip()).decode("utf-8")
+        except UnicodeDecodeError as err:
+            raise ValueError("Binary values not supported: %s" % name) from err
+    elif value.startswith("<"):
+        raise ValueError("URL values not supported: %s" % name)
+    else:
+        value = value.strip()
+
+    return name.strip(), value
+
+def _ldif_record(lines):
+    record = {}
+    for line in lines:
+        name, value = _ldif_value(line)
+        lower = name.lower()
+        if lower in ("dn", "version"):
+            continue # DN is made from the template
+        elif lower == "changetype":
+            if value.lower() != "add":
+                raise ValueError("Only additions supported, got changetype: %s" % value)
+            continue
+        record.setdefault(name, []).append(value)
+
+    # a single value needn't be a list
+    return dict( (name, values[0] if len(values) == 1 else values)
+            for name, values in record.items() )
+
+def _read_ldif(file_object):
+    """Content records separated by empty lines; DN is ignored"""
+
+    lines = []
+    for raw_line in file_object:
+        line = raw_line.rstrip("\n")
+        if line.startswith(" ") and lines:
+            lines[-1] += line[1:] # folded line
+        elif line.startswith("#"):
+            continue
+        elif line.strip():
+            lines.append(line)
+        elif lines:
+            yield _ldif_record(lines)
+            lines = []
+
+    if lines:
+        yield _ldif_record(lines)
+
+def read_records(file_object, input_format = None):
+    """Yield dictionaries of attribute values, read from file or stdin"""
+
+    if not file_object:
+        file_object = sys.stdin
+
+    if not input_format:
+        extension = os.path.splitext(getattr(file_object, "name", ""))[1][1:].lower()
+        if extension == "json":
+            extension = "jsonl"
+        if extension not in input_formats:
+            raise ValueError("Input format required: %s" % "|".join(input_formats))
+        input_format = extension
+
+    readers = {
+        "csv": _read_csv,
+        "jsonl": _read_jsonl,
+        "ldif": _read_ldif
+    }
+    with file_object:
+        for record in readers[input_format](file_object):
+            yield record
+
+def _report(result):
+    print( json.dumps(result, sort_keys = True) )
+    sys.stdout.flush()
+
+def import_records(mapping, records, object_class, **kwargs):
+    """Create objects of LdapObject subclass from records without prompting,
+    and add them to the mapping in a pipeline. Print a JSON result line for
+    each record. Keyword arguments are passed to the object constructor."""
+
+    # fail early on template errors, rather than on each record
+    template_plan(object_class)
+
+    id_attr = mapping.__class__._attribute
+    pending = {}
+    failures = []
+
+    def objects():
+        for row, record in enumerate(records, start = 1):
+            try:
+                obj = object_class(record = record, **kwargs)
+                id = obj.attrs[id_attr]
+                if type(id) is list:
+                    id = id[0]
+            except Exception as err:
+                log.debug("Row %i: %s" % (row, err))
+                failures.append(row)
+                _report({"row": row, "status": "failed", "error": str(err)})
+                continue
+
+            pending[row] = {"row": row, "id": id, "message": obj.message}
+            yield row, obj.attrs
+
+    def on_success(row):
+        result = pending.pop(row)
+        result["status"] = "ok"
+        _report(result)
+
+    def on_failure(row, message):
+        result = pending.pop(row)
+        result["status"] = "failed"
+        result["error"] = message
+        failures.append(row)
+        _report(result)
+
+    mapping.add_many(objects(), on_success, on_failure)
+
+    if failures:
+        raise RuntimeError("%i record(s) failed" % len(failures))
@@ -0,0 +1,124 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging
+
+from ldap3 import SUBTREE, MODIFY_ADD, MODIFY_DELETE
+from ldap3.utils.conv import escape_filter_chars
+
+from .abstract import normalize_dn
+from .bulk import BulkWriter
+from .config import cfg, ConfigAttrError
+from .connection import get_connection
+
+log = logging.getLogger(__name__)
+
+def reference_attributes():
+    """Project attributes referring to users and servers"""
+
+    attr = cfg.project.attr
+    try:
+        return [attr.member, attr.manager, attr.server]
+    except ConfigAttrError:
+        return [attr.member, attr.manager]
+
+class References:
+    """Keep project members, managers and servers pointing at existing entries.
+    Collect DNs of moved, renamed and deleted entries; when leaving the context,
+    find projects referring to them with one OR filter per window of DNs,
+    and rewrite or remove the values in pipelined modify requests."""
+
+    def __init__(self):
+        # normalized old DN: (old DN, new DN or None if deleted)
+        self._changes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # entries changed before a failure are referred to all the same
+        if self._changes:
+            self.update()
+
+    def changed(self, old_dn, new_dn = None):
+        """Record that the entry was moved to new_dn, or deleted"""
+
+        self._changes[normalize_dn(old_dn)] = (old_dn, new_dn)
+
+
+    def _referring(self, dns):
+        """Yield projects referring to any of the DNs, as raw search responses"""
+
+        attributes = reference_attributes()
+        terms = [ "(%s=%s)" % (name, escape_filter_chars(dn))
+                for dn in dns for name in set(attributes) ]
+
+        results = get_connection(write = True).extend.standard.paged_search(
+                search_base = cfg.project.base,
+                search_filter = "(|%s)" % "".join(terms),
+                search_scope = SUBTREE,
+                attributes = attributes,
+                paged_size = cfg.ldap.paged_search_size,
+                generator = True)
+
+        for response in results:
+            if response["type"] == "searchResEntry":
+                yield response
+
+    def _modification(self, attributes):
+        """Return changes rewriting or removing values referring to changed DNs"""
+
+        modification = {}
+        for name, values in attributes.items():
+            present = set( normalize_dn(value) for value in values )
+            removed = []
+            added = []
+            for value in values:
+                try:
+                    old_dn, new_dn = self._changes[normalize_dn(value)]
+                except KeyError:
+                    continue
+
+                removed.append(value)
+                if new_dn is not None and normalize_dn(new_dn) not in present:
+                    present.add( normalize_dn(new_dn) )
+                    added.append(new_dn)
+
+            if removed:
+                modification[name] = [(MODIFY_DELETE, removed)]
+                if added:
+                    modification[name].append( (MODIFY_ADD, added) )
+
+        return modification
+
+    def update(self):
+        """Modify projects referring to the changed DNs"""
+
+        def on_failure(dn, message):
+            log.warning("References in %s not updated: %s" % (dn, message))
+
+        try:
+            cfg.project
+        except ConfigAttrError:
+            log.debug("No projects configured, references not updated")
+            self._changes = {}
+            return
+
+        dns = [ old_dn for old_dn, new_dn in self._changes.values() ]
+        size = cfg.ldap.paged_search_size
+        # a project found again in a later window was already modified for all DNs
+        modified = set()
+        with BulkWriter(on_failure = on_failure) as bulk:
+            for start in range(0, len(dns), size):
+                for response in self._referring(dns[start:start + size]):
+                    key = normalize_dn(response["dn"])
+                    if key in modified:
+                        continue
+
+                    modification = self._modification(response["attributes"])
+                    if modification:
+                        modified.add(key)
+                        bulk.modify(response["dn"], response["dn"], modification)
+
+        log.info("Updated references in %i project(s)" % len(modified))
+        self._changes = {}
@@ -0,0 +1,546 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, os, time, sqlite3
+from argparse import ArgumentParser
+
+from ldap3 import ALL_ATTRIBUTES, NO_ATTRIBUTES, SUBTREE
+from ldap3.core.exceptions import LDAPOperationResult, LDAPKeyError
+from ldap3.core.results import RESULT_E_SYNC_REFRESH_REQUIRED, \
+        RESULT_UNAVAILABLE_CRITICAL_EXTENSION
+from ldap3.utils.dn import to_dn
+
+from .command import Command
+from .config import cfg, ConfigAttrError
+from .connection import get_connection, cached_schema
+from .cache import cache_dir, cache_key
+from . import schema, syncrepl
+
+log = logging.getLogger(__name__)
+
+# sync modes
+SYNCREPL = "syncrepl"
+TIMESTAMP = "timestamp"
+
+# values longer than that aren't looked up by, so needn't be indexed
+_max_key_length = 256
+
+_tables = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    ndn TEXT NOT NULL UNIQUE,
+    parent TEXT NOT NULL,
+    dn TEXT NOT NULL,
+    uuid TEXT UNIQUE,
+    modified TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+
+CREATE TABLE IF NOT EXISTS attribute_values (
+    entry INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    cname TEXT NOT NULL,
+    value BLOB NOT NULL,
+    key TEXT
+);
+CREATE INDEX IF NOT EXISTS attribute_values_entry ON attribute_values (entry);
+CREATE INDEX IF NOT EXISTS attribute_values_key ON attribute_values (cname, key)
+    WHERE key IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS attribute_names (
+    alias TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bases (
+    base TEXT PRIMARY KEY,
+    mode TEXT,
+    cookie BLOB,
+    modified TEXT,
+    synced REAL
+);
+"""
+
+class SyncUnsupported(Exception):
+    """The server doesn't support LDAP Content Synchronization"""
+
+max_staleness = ArgumentParser(add_help = False)
+max_staleness.add_argument("--max-staleness",
+        dest = "max_staleness",
+        metavar = "SECONDS",
+        type = int,
+        help = "Read from the local replica, synchronizing it first if it is older")
+
+def _split_dn(dn):
+    """Return normalized DN, and that of the parent entry"""
+
+    parts = [ part.strip().lower() for part in to_dn(dn) ]
+    return ",".join(parts), ",".join(parts[1:])
+
+def _scope(base, sub_tree):
+    """SQL condition and parameters selecting entries within the base"""
+
+    ndn = _split_dn(base)[0]
+    if sub_tree:
+        suffix = "," + ndn
+        return "(e.ndn = ? OR substr(e.ndn, ?) = ?)", [ndn, -len(suffix), suffix]
+    else:
+        return "e.parent = ?", [ndn]
+
+class ReplicaAttribute:
+    """Values of an attribute read from the replica, like ldap3 Attribute"""
+
+    def __init__(self, name, raw_values):
+        self.key = name
+        self.raw_values = raw_values
+        if schema.value_kind(name) == schema.BINARY:
+            self.values = raw_values
+            return
+
+        self.values = []
+        for value in raw_values:
+            try:
+                self.values.append( value.decode("utf-8") )
+            except UnicodeDecodeError:
+                self.values.append(value)
+
+    @property
+    def value(self):
+        """None, the only value, or the list of values, like ldap3 Attribute"""
+
+        if not self.values:
+            return None
+        elif len(self.values) == 1:
+            return self.values[0]
+        else:
+            return self.values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+class ReplicaEntry:
+    """Entry read from the replica, with the parts of ldap3 Entry interface
+    that read commands use"""
+
+    def __init__(self, dn, raw_attributes, canonicalize):
+        self.entry_dn = dn
+        self.entry_raw_attributes = raw_attributes
+        self._canonicalize = canonicalize
+        self._names = dict( (canonicalize(name), name) for name in raw_attributes )
+
+    @property
+    def entry_attributes(self):
+        return list(self.entry_raw_attributes)
+
+    def __getitem__(self, name):
+        try:
+            key = self._names[ self._canonicalize(name) ]
+        except KeyError as err:
+            raise LDAPKeyError("Key '%s' not found" % name) from err
+
+        return ReplicaAttribute(key, self.entry_raw_attributes[key])
+
+    def __contains__(self, name):
+        return self._canonicalize(name) in self._names
+
+class Replica:
+    """Local SQLite copy of the entries under the configured bases, kept
+    in sync with LDAP Content Synchronization (RFC 4533) where the server
+    supports it, or else by fetching entries modified since the last sync.
+    Values are indexed by attribute, for lookups by UID, number, mail or member."""
+
+    def __init__(self):
+        try:
+            self.file_name = cfg.replica.path
+        except ConfigAttrError:
+            uri = cfg.ldap.uri if type(cfg.ldap.uri) is str else cfg.ldap.uri.write
+            self.file_name = os.path.join(cache_dir("replica"), cache_key(uri) + ".sqlite")
+
+        # entries may hold password hashes; SQLite gives its journal
+        # the same permissions as the database
+        old_umask = os.umask(0o077)
+        try:
+            self._db = sqlite3.connect(self.file_name, timeout = 30)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.file_name, 0o600) # made by an older version
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(_tables)
+        self._names = None
+
+    @staticmethod
+    def bases():
+        """Configured bases, except those nested in others"""
+
+        bases = [cfg.user.base.active, cfg.user.base.suspended]
+        for name in ("server", "project"):
+            try:
+                bases.append( getattr(cfg, name).base )
+            except ConfigAttrError:
+                pass # optional sections
+        ndns = [ _split_dn(base)[0] for base in bases ]
+
+        result = []
+        for base, ndn in zip(bases, ndns):
+            nested = any( ndn.endswith("," + other) for other in ndns )
+            if not nested and base not in result:
+                result.append(base)
+
+        return result
+
+    def age(self):
+        """Seconds since the least recent sync of any base; None if never synced"""
+
+        oldest = None
+        for base in self.bases():
+            row = self._db.execute("SELECT synced FROM bases WHERE base = ?", [base]).fetchone()
+            if not row or row[0] is None:
+                return None
+            if oldest is None or row[0] < oldest:
+                oldest = row[0]
+
+        return time.time() - oldest
+
+    def canonicalize(self, name):
+        """Lowercase primary name of the attribute, per schema at the last sync"""
+
+        if self._names is None:
+            self._names = dict( self._db.execute("SELECT alias, name FROM attribute_names") )
+
+        lower = name.lower()
+        return self._names.get(lower, lower)
+
+    def _save_names(self, schema_info):
+        rows = []
+        for attribute_type in schema_info.attribute_types.values():
+            primary = attribute_type.name[0].lower()
+            for alias in attribute_type.name:
+                rows.append( (alias.lower(), primary) )
+
+        self._db.execute("DELETE FROM attribute_names")
+        self._db.executemany("INSERT OR REPLACE INTO attribute_names VALUES (?, ?)", rows)
+        self._names = None
+
+    def _store(self, dn, uuid, raw_attributes):
+        ndn, parent = _split_dn(dn)
+        try:
+            modified = raw_attributes["modifyTimestamp"][0].decode("utf-8")
+        except (KeyError, IndexError):
+            modified = None
+
+        # renamed entries keep UUID
+        self._db.execute("DELETE FROM entries WHERE ndn = ? OR uuid = ?", [ndn, uuid])
+        cursor = self._db.execute(
+                "INSERT INTO entries (ndn, parent, dn, uuid, modified) VALUES (?, ?, ?, ?, ?)",
+                [ndn, parent, dn, uuid, modified])
+        entry_id = cursor.lastrowid
+
+        rows = []
+        for name, values in raw_attributes.items():
+            cname = self.canonicalize(name)
+            if cname in ("entryuuid", "modifytimestamp"):
+                continue
+
+            binary = schema.value_kind(name) == schema.BINARY
+            for value in values:
+                key = None
+                if not binary and len(value) <= _max_key_length:
+                    try:
+                        key = value.decode("utf-8").lower()
+                    except UnicodeDecodeError:
+                        pass
+                rows.append( (entry_id, name, cname, value, key) )
+
+        self._db.executemany("INSERT INTO attribute_values VALUES (?, ?, ?, ?, ?)", rows)
+        return modified
+
+    def _delete_missing(self, base, kept, column):
+        """Delete entries within the base, unless their column is in kept"""
+
+        condition, params = _scope(base, True)
+        rows = self._db.execute("SELECT e.id, e.%s FROM entries e WHERE %s" % (column, condition),
+                params).fetchall()
+        gone = [ (row[0],) for row in rows if row[1] not in kept ]
+        self._db.executemany("DELETE FROM entries WHERE id = ?", gone)
+        return len(gone)
+
+    def _clear(self, base):
+        return self._delete_missing(base, set(), "id")
+
+    def _sync_content(self, conn, base, cookie):
+        """Refresh the base with a syncrepl refreshOnly search; return the new cookie.
+        Without a cookie, all entries are sent, and the rest are deleted."""
+
+        try:
+            conn.search(base, "(objectClass=*)",
+                    search_scope = SUBTREE,
+                    attributes = [ALL_ATTRIBUTES, "entryUUID", "modifyTimestamp"],
+                    controls = [syncrepl.request_control(cookie)])
+        except LDAPOperationResult as err:
+            if cookie and err.result == RESULT_E_SYNC_REFRESH_REQUIRED:
+                log.info("Replica of %s too old to update, reloading" % base)
+                return self._sync_content(conn, base, None)
+            elif err.result == RESULT_UNAVAILABLE_CRITICAL_EXTENSION:
+                raise SyncUnsupported(str(err)) from err
+            raise
+
+        present = set()
+        changed = 0
+        deleted = 0
+        for response in conn.response:
+            if response["type"] == "searchResEntry":
+                control = response.get("controls", {}).get(syncrepl.sync_state_oid)
+                if not control:
+                    continue
+                state, uuid, new_cookie = syncrepl.decode_state(control["value"])
+                if state == syncrepl.DELETE:
+                    deleted += self._db.execute("DELETE FROM entries WHERE uuid = ?", [uuid]).rowcount
+                else:
+                    if state != syncrepl.PRESENT:
+                        self._store(response["dn"], uuid, response["raw_attributes"])
+                        changed += 1
+                    present.add(uuid)
+
+            elif response["type"] == "intermediateResponse" \
+                    and response.get("responseName") == syncrepl.sync_info_oid:
+                new_cookie, uuids, refresh_deletes = syncrepl.decode_info(response["responseValue"])
+                if uuids and refresh_deletes:
+                    for uuid in uuids:
+                        deleted += self._db.execute("DELETE FROM entries WHERE uuid = ?",
+                                [uuid]).rowcount
+                elif uuids:
+                    present.update(uuids)
+            else:
+                continue
+
+            if new_cookie:
+                cookie = new_cookie
+
+        control = conn.result.get("controls", {}).get(syncrepl.sync_done_oid)
+        if not control:
+            raise SyncUnsupported("Server ignored content synchronization request")
+
+        new_cookie, refresh_deletes = syncrepl.decode_done(control["value"])
+        if not refresh_deletes:
+            # present phase: entries not reported present are gone
+            deleted += self._delete_missing(base, present, "uuid")
+
+        log.info("Replica of %s: %i changed, %i deleted" % (base, changed, deleted))
+        return new_cookie or cookie
+
+    def _sync_timestamp(self, conn, base, since):
+        """Fetch entries modified since the timestamp; find deleted ones
+        by listing DNs. Return the latest modification timestamp."""
+
+        if since:
+            search_filter = "(modifyTimestamp>=%s)" % since
+        else:
+            self._clear(base)
+            search_filter = "(objectClass=*)"
+
+        results = conn.extend.standard.paged_search(base, search_filter,
+                search_scope = SUBTREE,
+                attributes = [ALL_ATTRIBUTES, "entryUUID", "modifyTimestamp"],
+                paged_size = cfg.ldap.paged_search_size,
+                generator = True)
+
+        latest = since
+        changed = 0
+        for response in results:
+            if response["type"] != "searchResEntry":
+                continue
+            try:
+                uuid = response["raw_attributes"]["entryUUID"][0].decode("utf-8").lower()
+            except (KeyError, IndexError):
+                uuid = None
+
+            modified = self._store(response["dn"], uuid, response["raw_attributes"])
+            if modified and (latest is None or modified > latest):
+                latest = modified
+            changed += 1
+
+        deleted = 0
+        if since:
+            results = conn.extend.standard.paged_search(base, "(objectClass=*)",
+                    search_scope = SUBTREE,
+                    attributes = NO_ATTRIBUTES,
+                    paged_size = cfg.ldap.paged_search_size,
+                    generator = True)
+            present = set( _split_dn(response["dn"])[0] for response in results
+                    if response["type"] == "searchResEntry" )
+            deleted = self._delete_missing(base, present, "ndn")
+
+        log.info("Replica of %s: %i changed, %i deleted" % (base, changed, deleted))
+        return latest
+
+    def sync(self, full = False):
+        """Bring the replica up to date with the directory"""
+
+        conn = get_connection()
+        with self._db:
+            if conn.server.schema:
+                self._save_names(conn.server.schema)
+
+            if full:
+                self._db.execute("DELETE FROM bases")
+
+            for base in self.bases():
+                row = self._db.execute("SELECT mode, cookie, modified FROM bases WHERE base = ?",
+                        [base]).fetchone()
+                mode, cookie, modified = row if row else (None, None, None)
+
+                if mode != TIMESTAMP:
+                    try:
+                        cookie = self._sync_content(conn, base, cookie)
+                        mode = SYNCREPL
+                    except SyncUnsupported as err:
+                        log.info("Content synchronization of %s unavailable (%s), "
+                                "comparing modification timestamps instead" % (base, err))
+                        mode = TIMESTAMP
+                        cookie = None
+                        modified = None
+                    except LDAPOperationResult as err:
+                        # e.g. size limit; the cookie is kept to try again next time
+                        log.warning("Content synchronization of %s failed (%s), "
+                                "fetching all entries instead" % (base, err))
+                        self._sync_timestamp(conn, base, None)
+
+                if mode == TIMESTAMP:
+                    modified = self._sync_timestamp(conn, base, modified)
+
+                self._db.execute("INSERT OR REPLACE INTO bases VALUES (?, ?, ?, ?, ?)",
+                        [base, mode, cookie, modified, time.time()])
+
+    def _query(self, base, sub_tree, object_classes, id_attr, ids):
+        """SQL selecting IDs and DNs of entries with all the object classes,
+        and any of the IDs, unless those are None"""
+
+        condition, params = _scope(base, sub_tree)
+        conditions = [condition]
+
+        for object_class in object_classes:
+            conditions.append("e.id IN (SELECT entry FROM attribute_values "
+                    "WHERE cname = 'objectclass' AND key = ?)")
+            params.append( object_class.lower() )
+
+        if ids is not None:
+            keys = [ (id[0] if type(id) is list else id).lower() for id in ids ]
+            conditions.append("e.id IN (SELECT entry FROM attribute_values "
+                    "WHERE cname = ? AND key IN (%s))" % ",".join("?" * len(keys)))
+            params.append( self.canonicalize(id_attr) )
+            params.extend(keys)
+
+        return "SELECT e.id, e.dn FROM entries e WHERE " + " AND ".join(conditions), params
+
+    def entries(self, base, sub_tree, object_classes, id_attr, ids = None, attributes = ALL_ATTRIBUTES):
+        """Yield entries within the base, with the requested attributes"""
+
+        if type(attributes) is str:
+            attributes = [attributes]
+        if ALL_ATTRIBUTES in attributes:
+            wanted = None
+        else:
+            wanted = set( self.canonicalize(name) for name in attributes + [id_attr] )
+
+        sql, params = self._query(base, sub_tree, object_classes, id_attr, ids)
+        for entry_id, dn in self._db.execute(sql, params).fetchall():
+            raw_attributes = {}
+            for name, cname, value in self._db.execute(
+                    "SELECT name, cname, value FROM attribute_values WHERE entry = ? ORDER BY rowid",
+                    [entry_id]):
+                if wanted is None or cname in wanted:
+                    raw_attributes.setdefault(name, []).append( bytes(value) )
+
+            yield ReplicaEntry(dn, raw_attributes, self.canonicalize)
+
+    def count(self, base, sub_tree, object_classes, id_attr, ids = None):
+        sql, params = self._query(base, sub_tree, object_classes, id_attr, ids)
+        return self._db.execute("SELECT count(*) FROM (%s)" % sql, params).fetchone()[0]
+
+    def find(self, attribute, value):
+        """Return DNs of entries having the attribute value, e.g. a member DN"""
+
+        return [ row[0] for row in self._db.execute(
+                "SELECT DISTINCT e.dn FROM entries e JOIN attribute_values v ON v.entry = e.id "
+                "WHERE v.cname = ? AND v.key = ?",
+                [self.canonicalize(attribute), value.lower()]) ]
+
+    def status(self):
+        """Yield base, sync mode, time of the last sync, and entry count"""
+
+        for base in self.bases():
+            row = self._db.execute("SELECT mode, synced FROM bases WHERE base = ?", [base]).fetchone()
+            mode, synced = row if row else (None, None)
+            condition, params = _scope(base, True)
+            count = self._db.execute("SELECT count(*) FROM entries e WHERE " + condition,
+                    params).fetchone()[0]
+            yield base, mode, synced, count
+
+_replica = None
+
+def local_replica(staleness = None):
+    """Return the replica to read from, synchronized no longer than staleness
+    seconds ago; or None, if no bound is given or configured"""
+
+    global _replica
+
+    if staleness is None:
+        try:
+            staleness = int(cfg.replica.max_staleness)
+        except ConfigAttrError:
+            return None
+
+    if _replica is None:
+        _replica = Replica()
+        # value kinds of the attributes, without connecting
+        cached_schema()
+
+    age = _replica.age()
+    if age is None or age > staleness:
+        log.debug("Replica older than %i s, synchronizing" % staleness)
+        _replica.sync()
+
+    return _replica
+
+class ReplicaCommand(Command):
+    parser_name = "replica"
+    parser_args = {
+        "kwargs": {
+            "help": "Local replica of the directory, for fast reads"
+        },
+        "subparsers_title": "Replica command",
+        "subparsers": {
+            "sync": {
+                "kwargs": {
+                    "help": "Fetch changes from the directory"
+                },
+                "arguments": {
+                    "--full": {
+                        "action": "store_true",
+                        "help": "Reload all entries"
+                    }
+                }
+            },
+            "status": {
+                "kwargs": {
+                    "help": "Show sync mode, time and entry count for each base"
+                }
+            }
+        }
+    }
+
+    def on_replica_sync(self):
+        Replica().sync(full = self._args.full)
+
+    def on_replica_status(self):
+        replica = Replica()
+        print("File: %s" % replica.file_name)
+        for base, mode, synced, count in replica.status():
+            if synced:
+                when = time.strftime("%c", time.localtime(synced))
+            else:
+                when = "never"
+            print("%s: %i entries, synced %s (%s)" % (base, count, when, mode or "-"))
@@ -0,0 +1,247 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, os, json
+
+from ldap3 import BASE, SCHEMA
+from ldap3.protocol.rfc4512 import SchemaInfo
+from ldap3.core.exceptions import LDAPException
+
+from .cache import cache_dir, cache_key, atomic_write
+
+log = logging.getLogger(__name__)
+
+# kinds of attribute values
+TEXT = "text"
+BINARY = "binary"
+OCTETS = "octets" # may be either, e.g. userPassword or sshPublicKey
+
+_binary_syntaxes = {
+    "1.3.6.1.4.1.1466.115.121.1.4", # Audio
+    "1.3.6.1.4.1.1466.115.121.1.5", # Binary
+    "1.3.6.1.4.1.1466.115.121.1.8", # Certificate
+    "1.3.6.1.4.1.1466.115.121.1.9", # Certificate List
+    "1.3.6.1.4.1.1466.115.121.1.10", # Certificate Pair
+    "1.3.6.1.4.1.1466.115.121.1.23", # Fax
+    "1.3.6.1.4.1.1466.115.121.1.28", # JPEG
+    "1.3.6.1.4.1.1466.115.121.1.49" # Supported Algorithm
+}
+_octet_string_syntax = "1.3.6.1.4.1.1466.115.121.1.40"
+
+_value_kinds = {}
+
+def _get_timestamp(conn, dn):
+    """Read modification time of the subschema entry, or None if unavailable"""
+
+    try:
+        conn.search(dn, "(objectClass=*)",
+                search_scope = BASE,
+                attributes = ["modifyTimestamp"])
+        return conn.response[0]["raw_attributes"]["modifyTimestamp"][0].decode("utf-8")
+    except (LDAPException, IndexError, KeyError) as err:
+        log.debug("Can't read schema timestamp: %s" % err)
+        return None
+
+class SchemaCache:
+    """Server schema and attribute alias tables, persisted between runs"""
+
+    def __init__(self, uri):
+        self._filename = os.path.join(cache_dir("schema"), cache_key(uri) + ".json")
+        self._data = {}
+        self._schema_info = None
+        self._checked = False
+        try:
+            with open(self._filename) as file_object:
+                self._data = json.load(file_object)
+        except (OSError, ValueError) as err:
+            log.debug("Schema cache not loaded: %s" % err)
+
+    def _save(self):
+        try:
+            atomic_write(self._filename, json.dumps(self._data).encode("utf-8"))
+        except OSError as err:
+            log.warning("Can't save schema cache: %s" % err)
+
+    def attach(self, conn):
+        """Provide schema to the bound connection, downloading only if it changed"""
+
+        if self._checked:
+            conn.server.attach_schema_info(self._schema_info)
+            return
+
+        dn = self._data.get("subschema")
+        if dn and self._data.get("timestamp"):
+            timestamp = _get_timestamp(conn, dn)
+            if timestamp == self._data["timestamp"]:
+                try:
+                    self._schema_info = SchemaInfo.from_json(self._data["schema"])
+                    self._checked = True
+                    conn.server.attach_schema_info(self._schema_info)
+                    log.debug("Using schema cached at %s" % timestamp)
+                    return
+                except (LDAPException, KeyError, ValueError) as err:
+                    log.warning("Invalid schema cache: %s" % err)
+
+        log.debug("Downloading schema")
+        conn.server.get_info = SCHEMA
+        conn.refresh_server_info()
+
+        schema = conn.server.schema
+        if not schema:
+            log.warning("Server provided no schema")
+            return
+
+        self._schema_info = schema
+        self._checked = True
+
+        timestamp = _get_timestamp(conn, schema.schema_entry)
+        if timestamp:
+            self._data = {
+                "subschema": schema.schema_entry,
+                "timestamp": timestamp,
+                "schema": schema.to_json(indent = None),
+                "aliases": {}
+            }
+            self._save()
+
+    def load(self):
+        """Return cached schema without connecting, for local reads;
+        attach() still checks that it is current"""
+
+        if self._schema_info is None and "schema" in self._data:
+            try:
+                self._schema_info = SchemaInfo.from_json(self._data["schema"])
+            except (LDAPException, ValueError) as err:
+                log.warning("Invalid schema cache: %s" % err)
+
+        return self._schema_info
+
+    def aliases(self, key, object_def):
+        """Return a table mapping lowercase attribute names to the primary name and aliases"""
+
+        tables = self._data.setdefault("aliases", {})
+        table_name = ",".join(key).lower()
+        try:
+            return tables[table_name]
+        except KeyError:
+            pass
+
+        table = {}
+        for definition in object_def:
+            names = [definition.key]
+            if definition.oid_info:
+                for name in definition.oid_info.name:
+                    if definition.key.lower() != name.lower():
+                        names.append(name)
+
+            for name in names:
+                table[name.lower()] = names
+
+        tables[table_name] = table
+        if "schema" in self._data:
+            self._save()
+
+        return table
+
+_cache = None
+
+def attach(conn, uri):
+    """Load schema for the connection from local cache, or from the server"""
+
+    global _cache
+    if _cache is None:
+        _cache = SchemaCache(uri)
+
+    _cache.attach(conn)
+
+def load(uri):
+    """Load schema cached for the URI by an earlier run, without connecting;
+    return None if there is none"""
+
+    global _cache
+    if _cache is None:
+        _cache = SchemaCache(uri)
+
+    return _cache.load()
+
+def class_attributes(object_classes):
+    """Names of attributes that object classes and their superiors may hold,
+    like ObjectDef keys, from schema loaded before"""
+
+    if _cache is None or not _cache._schema_info:
+        raise RuntimeError("Schema has not been loaded")
+
+    classes = [object_classes] if type(object_classes) is str else list(object_classes)
+    seen_classes = set()
+    seen_names = set()
+    names = []
+    while classes:
+        class_name = classes.pop(0)
+        if class_name.lower() in seen_classes:
+            continue
+        seen_classes.add( class_name.lower() )
+
+        try:
+            class_info = _cache._schema_info.object_classes[class_name]
+        except KeyError:
+            continue
+
+        for name in (class_info.must_contain or []) + (class_info.may_contain or []):
+            if name.lower() not in seen_names:
+                seen_names.add( name.lower() )
+                names.append(name)
+        classes.extend(class_info.superior or [])
+
+    return names
+
+def aliases(key, object_def):
+    """Return the attribute alias table for object classes"""
+
+    if _cache is None:
+        raise RuntimeError("Schema has not been loaded")
+
+    return _cache.aliases(key, object_def)
+
+def _syntax(schema_info, name):
+    """Find attribute syntax, inherited from superior types if necessary"""
+
+    seen = set()
+    while name and name.lower() not in seen:
+        seen.add( name.lower() )
+        try:
+            attribute_type = schema_info.attribute_types[name]
+        except KeyError:
+            return None
+
+        if attribute_type.syntax:
+            return attribute_type.syntax
+        name = attribute_type.superior[0] if attribute_type.superior else None
+
+    return None
+
+def value_kind(name):
+    """Tell if attribute values are TEXT, BINARY, or OCTETS that may be either,
+    judging by the syntax in schema, so that values needn't be inspected"""
+
+    lower = name.lower()
+    try:
+        return _value_kinds[lower]
+    except KeyError:
+        pass
+
+    if ";binary" in lower:
+        kind = BINARY
+    else:
+        syntax = None
+        if _cache is not None and _cache._schema_info:
+            syntax = _syntax(_cache._schema_info, name.split(";")[0])
+
+        if syntax in _binary_syntaxes:
+            kind = BINARY
+        elif syntax is None or syntax == _octet_string_syntax:
+            kind = OCTETS
+        else:
+            kind = TEXT
+
+    _value_kinds[lower] = kind
+    return kind
@@ -6,15 +6,18 @@ from argparse import ArgumentParser
 
 from ldap3.core.exceptions import LDAPEntryAlreadyExistsResult, LDAPKeyError, \
         LDAPAttributeOrValueExistsResult
-from ldap3 import ALL_ATTRIBUTES, ObjectDef
+from ldap3 import ALL_ATTRIBUTES
 
 from .command import Command
-from .abstract import MissingObjects, LdapObjectMapping, LdapObject
+from .journal import resumable
+from .records import record_input, read_records, import_records
+from .export import export_output, export
+from .abstract import MissingObjects, LdapObjectMapping, LdapObject, LazyObjectDef
 from .config import cfg
-from .user import single_user, multi_user, UserMapping
 from .unit import UnitMapping, single_unit, multi_unit
-from .console import pretty_print
-from .connection import ldap
+from .replica import max_staleness
+from .references import References
+from .console import Output, output_format, show_attributes
 
 log = logging.getLogger(__name__)
 
@@ -32,12 +35,13 @@ multi_server.add_argument("server",
 class Server(LdapObject):
     _config_node = cfg.server
     _object_class = cfg.server.objectclass
-    _object_def = ObjectDef(object_class = _object_class, schema = ldap)
+    _object_def = LazyObjectDef(_object_class)
     attribute = cfg.server.attr.id
 
 class ServerMapping(LdapObjectMapping):
     _name = "Servers"
-    _object_def = Server._object_def
+    _object_class = Server._object_class
+    _object_def = LazyObjectDef(_object_class)
     _base = cfg.server.base
     _attribute = Server.attribute
 
@@ -61,12 +65,19 @@ class ServerCommand(Command):
         "subparsers": {
             "list": {
                 "kwargs": {
+                    "parents": [output_format, max_staleness],
                     "help": "List all servers"
                 }
             },
+            "count": {
+                "kwargs": {
+                    "parents": [max_staleness],
+                    "help": "Count servers"
+                }
+            },
             "show": {
                 "kwargs": {
-                    "parents": [multi_server],
+                    "parents": [multi_server, output_format, show_attributes, max_staleness],
                     "aliases": ["info"],
                     "help": "List server attributes"
                 }
@@ -85,9 +96,21 @@ class ServerCommand(Command):
                     }
                 }
             },
+            "export": {
+                "kwargs": {
+                    "parents": [export_output],
+                    "help": "Write all servers as LDIF or JSON lines"
+                }
+            },
+            "import": {
+                "kwargs": {
+                    "parents": [record_input],
+                    "help": "Add servers from CSV, JSON lines or LDIF records, without prompting"
+                }
+            },
             "delete": {
                 "kwargs": {
-                    "parents": [multi_server],
+                    "parents": [multi_server, resumable],
                     "aliases": ["remove"],
                     "help": "Delete servers"
                 }
@@ -100,12 +123,13 @@ class ServerCommand(Command):
                 "subparsers": {
                     "list": {
                         "kwargs": {
+                            "parents": [output_format, max_staleness],
                             "help": "List all units"
                         }
                     },
                     "show": {
                         "kwargs": {
-                            "parents": [single_unit],
+                            "parents": [single_unit, output_format, max_staleness],
                             "aliases": ["info"],
                             "help": "List servers in the unit"
                         },
@@ -137,7 +161,7 @@ class ServerCommand(Command):
                     },
                     "assign": {
                         "kwargs": {
-                            "parents": [single_unit, multi_server],
+                            "parents": [single_unit, multi_server, resumable],
                             "help": "Move servers to the unit (category)"
                         }
                     }
@@ -147,15 +171,17 @@ class ServerCommand(Command):
     }
 
     def on_server_list(self):
-        servers = ServerMapping()
-        for name in servers:
-            print(name)
+        servers = ServerMapping().from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for name in servers:
+                output.write_item({"id": name})
+
+    def on_server_count(self):
+        print( len(ServerMapping().from_replica(self._args.max_staleness)) )
 
     def on_server_show(self):
-        servers = ServerMapping(attrs = ALL_ATTRIBUTES)
-        servers.select(self._args_or_stdin("server"))
-        for entry in servers.values():
-            pretty_print(entry)
+        servers = ServerMapping(attrs = self._projection(ServerMapping)).from_replica(self._args.max_staleness)
+        self._show(servers, "server")
 
     def on_server_add(self):
         attr_name = Server.attribute
@@ -174,23 +200,37 @@ class ServerCommand(Command):
         if server.message:
             print(server.message)
 
+    def on_server_export(self):
+        export(ServerMapping(),
+                export_format = self._args.export_format,
+                output = self._args.output,
+                compress = self._args.compress,
+                resume = self._args.resume)
+
+    def on_server_import(self):
+        records = read_records(self._args.file, self._args.input_format)
+        import_records(ServerMapping(), records, Server)
+
     def on_server_delete(self):
         server_names = self._args_or_stdin("server")
         servers = ServerMapping()
-        servers.select(server_names).delete()
+        with self._journal() as journal, References() as references:
+            servers.select(server_names).delete(journal = journal, references = references)
 
     def on_server_unit_list(self):
-        units = UnitMapping(cfg.server.base)
-        for unit in units:
-            print(unit)
+        units = UnitMapping(cfg.server.base).from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for unit in units:
+                output.write_item({"id": unit})
 
     def on_server_unit_show(self):
-        units = UnitMapping(cfg.server.base)
+        units = UnitMapping(cfg.server.base).from_replica(self._args.max_staleness)
         base = units[self._args.unit].entry_dn
 
-        servers = ServerMapping(base = base, sub_tree = self._args.full)
-        for uid in servers:
-            print(uid)
+        servers = ServerMapping(base = base, sub_tree = self._args.full).from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for uid in servers:
+                output.write_item({"id": uid})
 
     def on_server_unit_add(self):
         units = UnitMapping(cfg.server.base)
@@ -212,4 +252,5 @@ class ServerCommand(Command):
 
         servers = ServerMapping(base = base)
         servers.select(self._args_or_stdin("server"))
-        servers.move(unit.entry_dn)
+        with self._journal() as journal, References() as references:
+            servers.move(unit.entry_dn, journal = journal, references = references)
@@ -0,0 +1,114 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+# LDAP Content Synchronization (RFC 4533) controls, refreshOnly mode only
+
+import uuid
+
+from pyasn1.type import univ, namedtype, namedval, tag
+from pyasn1.codec.ber import encoder, decoder
+from ldap3.protocol.controls import build_control
+
+sync_request_oid = "1.3.6.1.4.1.4203.1.9.1.1"
+sync_state_oid = "1.3.6.1.4.1.4203.1.9.1.2"
+sync_done_oid = "1.3.6.1.4.1.4203.1.9.1.3"
+sync_info_oid = "1.3.6.1.4.1.4203.1.9.1.4"
+
+# entry states
+PRESENT = "present"
+ADD = "add"
+MODIFY = "modify"
+DELETE = "delete"
+
+def _context(number, constructed = False):
+    tag_format = tag.tagFormatConstructed if constructed else tag.tagFormatSimple
+    return tag.Tag(tag.tagClassContext, tag_format, number)
+
+class _SyncRequestValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+            namedtype.NamedType("mode", univ.Enumerated(
+                namedValues = namedval.NamedValues(("refreshOnly", 1), ("refreshAndPersist", 3)))),
+            namedtype.OptionalNamedType("cookie", univ.OctetString()),
+            namedtype.DefaultedNamedType("reloadHint", univ.Boolean(False)))
+
+class _SyncStateValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+            namedtype.NamedType("state", univ.Enumerated(
+                namedValues = namedval.NamedValues(
+                    (PRESENT, 0), (ADD, 1), (MODIFY, 2), (DELETE, 3)))),
+            namedtype.NamedType("entryUUID", univ.OctetString()),
+            namedtype.OptionalNamedType("cookie", univ.OctetString()))
+
+class _SyncDoneValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+            namedtype.OptionalNamedType("cookie", univ.OctetString()),
+            namedtype.DefaultedNamedType("refreshDeletes", univ.Boolean(False)))
+
+class _RefreshPhase(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+            namedtype.OptionalNamedType("cookie", univ.OctetString()),
+            namedtype.DefaultedNamedType("refreshDone", univ.Boolean(True)))
+
+class _SyncIdSet(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+            namedtype.OptionalNamedType("cookie", univ.OctetString()),
+            namedtype.DefaultedNamedType("refreshDeletes", univ.Boolean(False)),
+            namedtype.NamedType("syncUUIDs", univ.SetOf(componentType = univ.OctetString())))
+
+class _SyncInfoValue(univ.Choice):
+    componentType = namedtype.NamedTypes(
+            namedtype.NamedType("newcookie", univ.OctetString().subtype(
+                implicitTag = _context(0))),
+            namedtype.NamedType("refreshDelete", _RefreshPhase().subtype(
+                implicitTag = _context(1, constructed = True))),
+            namedtype.NamedType("refreshPresent", _RefreshPhase().subtype(
+                implicitTag = _context(2, constructed = True))),
+            namedtype.NamedType("syncIdSet", _SyncIdSet().subtype(
+                implicitTag = _context(3, constructed = True))))
+
+def _optional(sequence, name):
+    value = sequence.getComponentByName(name)
+    return bytes(value) if value.isValue else None
+
+def _uuid(value):
+    return str( uuid.UUID(bytes = bytes(value)) )
+
+def request_control(cookie = None):
+    """Critical Sync Request control for a refreshOnly search"""
+
+    value = _SyncRequestValue()
+    value["mode"] = "refreshOnly"
+    if cookie:
+        value["cookie"] = cookie
+
+    return build_control(sync_request_oid, True, encoder.encode(value),
+            encode_control_value = False)
+
+def decode_state(value):
+    """Return entry state, entryUUID as text, and cookie or None"""
+
+    state = decoder.decode(value, asn1Spec = _SyncStateValue())[0]
+    return str(state["state"]), _uuid(state["entryUUID"]), _optional(state, "cookie")
+
+def decode_done(value):
+    """Return cookie or None, and whether deleted entries were sent
+    rather than the present ones"""
+
+    done = decoder.decode(value, asn1Spec = _SyncDoneValue())[0]
+    return _optional(done, "cookie"), bool(done["refreshDeletes"])
+
+def decode_info(value):
+    """Return cookie or None, and for syncIdSet messages, a list of UUIDs,
+    and whether they were deleted or present; else None and None"""
+
+    info = decoder.decode(value, asn1Spec = _SyncInfoValue())[0]
+    name = info.getName()
+    component = info.getComponent()
+
+    if name == "newcookie":
+        return bytes(component), None, None
+    elif name == "syncIdSet":
+        uuids = [ _uuid(item) for item in component["syncUUIDs"] ]
+        return _optional(component, "cookie"), uuids, bool(component["refreshDeletes"])
+    else:
+        return _optional(component, "cookie"), None, None
@@ -0,0 +1,137 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import logging, re
+from string import Formatter
+
+from .config import ConfigAttrError
+
+log = logging.getLogger(__name__)
+
+_plans = {}
+
+def _field_names(template):
+    """Yield attribute names that a format string refers to"""
+
+    for literal, field_name, format_spec, conversion in Formatter().parse(template):
+        if field_name is None:
+            continue
+        if field_name == "" or field_name.isdigit():
+            raise ValueError("Positional field in template: %s" % template)
+
+        # e.g. {mail[0]} or {name.attr}
+        yield re.split(r"[.\[]", field_name)[0]
+
+        # nested fields, e.g. {uid:>{width}}
+        if format_spec:
+            yield from _field_names(format_spec)
+
+class TemplatePlan:
+    """Templates, modifiers and creation message of an LdapObject class, parsed
+    once; and the order to resolve attributes in, so that each template is
+    formatted after the attributes it refers to"""
+
+    def __init__(self, cls):
+        self._cls = cls
+        self._names = {}
+        self.templates = cls._read_templates()
+        self.modifiers = cls._read_modifiers()
+
+        try:
+            node = cls._config_node
+            if not node:
+                raise ConfigAttrError()
+            self.message = node.message_on_create
+        except ConfigAttrError:
+            self.message = None
+
+        self.dependencies = {}
+        for key in self.templates:
+            templates = self.templates[key]
+            if type(templates) is not list:
+                templates = [templates]
+            self.dependencies[key] = self._keys( name for template in templates
+                    for name in _field_names(template) )
+
+        # attributes in the message are prompted first, then in schema order
+        required = [ self.names(name)[0] for name in cls._required_attrs ]
+        roots = []
+        if self.message:
+            roots.extend( self._keys(_field_names(self.message)) )
+        for attr_def in cls._object_def:
+            key = attr_def.key
+            if key in self.templates \
+                    or key in required \
+                    or attr_def.mandatory \
+                    or key.lower() == cls.attribute.lower():
+                roots.append( self.names(key)[0] )
+
+        self.order = self._sort(roots)
+        log.debug("Attribute order for %s: %s" % (cls.__name__, ", ".join(self.order)))
+
+    def names(self, raw_name):
+        """Return canonical name and aliases of the attribute, cached"""
+
+        lower = raw_name.lower()
+        try:
+            return self._names[lower]
+        except KeyError:
+            names = self._cls._canonicalize_name(raw_name)
+            self._names[lower] = names
+            return names
+
+    def _keys(self, raw_names):
+        result = []
+        for raw_name in raw_names:
+            try:
+                key = self.names(raw_name)[0]
+            except KeyError as err:
+                raise ValueError("Unknown attribute in template: %s" % raw_name) from err
+            if key not in result:
+                result.append(key)
+
+        return result
+
+    def _sort(self, roots):
+        """Order attributes depth first, dependencies before dependents;
+        raise ValueError if templates refer to each other in a loop"""
+
+        order = []
+        done = set()
+        path = []
+
+        def visit(key):
+            lower = key.lower()
+            if lower in done:
+                return
+            if lower in path:
+                loop = [self.names(name)[0] for name in path[path.index(lower):]]
+                raise ValueError("Templates refer to each other: %s"
+                        % " -> ".join(loop + [key]))
+
+            path.append(lower)
+            try:
+                dependencies = self.dependencies[key]
+            except KeyError:
+                dependencies = []
+            for dependency in dependencies:
+                visit(dependency)
+            path.pop()
+
+            done.add(lower)
+            order.append(key)
+
+        for key in roots:
+            visit(key)
+
+        return order
+
+def template_plan(cls):
+    """Return the plan for LdapObject class, compiling it on first use"""
+
+    try:
+        return _plans[cls]
+    except KeyError:
+        plan = TemplatePlan(cls)
+        _plans[cls] = plan
+        return plan
@@ -4,13 +4,11 @@
 import logging
 from argparse import ArgumentParser
 
-from ldap3 import ObjectDef
 from ldap3.core.exceptions import LDAPEntryAlreadyExistsResult, LDAPKeyError, \
         LDAPAttributeOrValueExistsResult, LDAPNotAllowedOnNotLeafResult
 
-from .abstract import LdapObjectMapping, LdapObject
+from .abstract import LdapObjectMapping, LdapObject, LazyObjectDef
 from .config import cfg, ConfigAttrError
-from .connection import ldap
 
 log = logging.getLogger(__name__)
 
@@ -33,12 +31,13 @@ class Unit(LdapObject):
 
     _object_class = "organizationalUnit"
     # Load attribute definitions by ObjectClass
-    _object_def = ObjectDef(object_class = _object_class, schema = ldap)
+    _object_def = LazyObjectDef(_object_class)
     attribute = "organizationalUnitName"
 
 class UnitMapping(LdapObjectMapping):
     _name = "Units"
-    _object_def = Unit._object_def
+    _object_class = Unit._object_class
+    _object_def = LazyObjectDef(_object_class)
     _attribute = Unit.attribute
 
     def __init__(self, base):
@@ -4,17 +4,23 @@
 import random, re, logging, string
 from argparse import FileType, ArgumentParser
 
-from ldap3 import ALL_ATTRIBUTES, ObjectDef
+from ldap3 import ALL_ATTRIBUTES
 from ldap3.core.exceptions import LDAPEntryAlreadyExistsResult, \
         LDAPKeyError, LDAPAttributeOrValueExistsResult
 from sshpubkeys import SSHKey, InvalidKeyException
 
-from .console import pretty_print
+from .console import Output, output_format, show_attributes
 from .command import Command
-from .abstract import LdapObjectMapping, MissingObjects, LdapObject
+from .journal import resumable
+from .records import record_input, read_records, import_records
+from .export import export_output, export
+from .abstract import LdapObjectMapping, MissingObjects, LdapObject, LazyObjectDef
 from .unit import UnitMapping, single_unit, multi_unit
+from .nuid import NumberAllocator
+from .replica import max_staleness
+from .references import References
+from .keyindex import KeyIndex
 from .config import cfg
-from .connection import ldap
 
 log = logging.getLogger(__name__)
 
@@ -38,10 +44,10 @@ class User(LdapObject):
     _config_node = cfg.user
     _object_class = cfg.user.objectclass
     # Load attribute definitions by ObjectClass
-    _object_def = ObjectDef(object_class = _object_class, schema = ldap)
+    _object_def = LazyObjectDef(_object_class)
+    _required_attrs = [cfg.user.attr.passwd]
     attribute = cfg.user.attr.uid
 
-
     @staticmethod
     def make_password(*args_ignored):
         """Generate a random password of random length"""
@@ -62,13 +68,10 @@ class User(LdapObject):
 
         return ''.join(chars)
 
-    def __init__(self, reference_object = None, pre = {}, post = {}):
-        self.__class__._required_attrs = [ self._canonicalize_name(cfg.user.attr.passwd)[0] ]
-        super().__init__(reference_object = reference_object, pre = pre, post = post)
-
 class UserMapping(LdapObjectMapping):
     _name = "Users"
-    _object_def = User._object_def
+    _object_class = User._object_class
+    _object_def = LazyObjectDef(_object_class)
     _attribute = User.attribute
 
     @staticmethod
@@ -80,6 +83,18 @@ class UserMapping(LdapObjectMapping):
             msg = "Unknown users: " + ", ".join(err.items)
             raise RuntimeError(msg) from err
 
+def key_index(max_staleness = None, max_age = None):
+    """Index public keys of active and suspended users; reuse the cached
+    owners if no older than max_age seconds, or else max_staleness"""
+
+    if max_age is None:
+        max_age = max_staleness
+
+    pubkey_attr = cfg.user.attr.pubkey
+    return KeyIndex( ( UserMapping(base = base, attrs = pubkey_attr).from_replica(max_staleness)
+            for base in (cfg.user.base.active, cfg.user.base.suspended) ),
+            max_age = max_age )
+
 class UserCommand(Command):
     parser_name = "user"
     parser_args = {
@@ -90,13 +105,19 @@ class UserCommand(Command):
         "subparsers": {
             "list": {
                 "kwargs": {
-                    "parents": [only_suspended],
+                    "parents": [only_suspended, output_format, max_staleness],
                     "help": "List all active or suspended users"
                 },
             },
+            "count": {
+                "kwargs": {
+                    "parents": [only_suspended, max_staleness],
+                    "help": "Count active or suspended users"
+                },
+            },
             "search": {
                 "kwargs": {
-                    "parents": [only_suspended],
+                    "parents": [only_suspended, output_format],
                     "help": "Search users with LDAP filter"
                 },
                 "arguments": {
@@ -109,34 +130,28 @@ class UserCommand(Command):
             "show": {
                 "kwargs": {
                     "aliases": ["info"],
-                    "parents": [multi_user, only_suspended],
+                    "parents": [multi_user, only_suspended, output_format, show_attributes, max_staleness],
                     "help": "Show details for accounts"
-                },
-                "arguments": {
-                    "--full": {
-                        "action": "store_true",
-                        "help": "Also show operational attributes"
-                    }
                 }
             },
             "suspend": {
                 "kwargs": {
                     "aliases": ["lock", "ban", "disable"],
-                    "parents": [multi_user],
+                    "parents": [multi_user, resumable],
                     "help": "Make accounts inactive"
                 }
             },
             "restore": {
                 "kwargs": {
                     "aliases": ["unlock", "unban", "enable"],
-                    "parents": [multi_user],
+                    "parents": [multi_user, resumable],
                     "help": "Re-activate accounts"
                 }
             },
             "delete": {
                 "kwargs": {
                     "aliases": ["remove"],
-                    "parents": [multi_user],
+                    "parents": [multi_user, resumable],
                     "help": "Irreversibly destroy suspended accounts"
                 }
             },
@@ -154,6 +169,18 @@ class UserCommand(Command):
                     }
                 }
             },
+            "export": {
+                "kwargs": {
+                    "parents": [only_suspended, export_output],
+                    "help": "Write all accounts as LDIF or JSON lines"
+                }
+            },
+            "import": {
+                "kwargs": {
+                    "parents": [record_input],
+                    "help": "Add accounts from CSV, JSON lines or LDIF records, without prompting"
+                }
+            },
             "passwd": {
                 "kwargs": {
                     "help": "Reset user password"
@@ -167,16 +194,25 @@ class UserCommand(Command):
             },
             "rename": {
                 "kwargs": {
+                    "parents": [resumable],
                     "help": "Change account UID"
                 },
                 "arguments": {
                     "oldname": {
                         "metavar": "OLD_NAME",
+                        "nargs": "?",
                         "help": "Old UID"
                     },
                     "newname": {
                         "metavar": "NEW_NAME",
+                        "nargs": "?",
                         "help": "New UID"
+                    },
+                    "--file": {
+                        "dest": "rename_file",
+                        "metavar": "FILE_NAME",
+                        "type": FileType("r"),
+                        "help": "Read pairs of old and new UIDs, one pair per line"
                     }
                 }
             },
@@ -188,12 +224,13 @@ class UserCommand(Command):
                 "subparsers": {
                     "list": {
                         "kwargs": {
+                            "parents": [output_format, max_staleness],
                             "help": "List all units"
                         }
                     },
                     "show": {
                         "kwargs": {
-                            "parents": [single_unit],
+                            "parents": [single_unit, output_format, max_staleness],
                             "aliases": ["info"],
                             "help": "List members of the unit"
                         },
@@ -225,7 +262,7 @@ class UserCommand(Command):
                     },
                     "assign": {
                         "kwargs": {
-                            "parents": [single_unit, multi_user],
+                            "parents": [single_unit, multi_user, resumable],
                             "help": "Move users to the organizational unit"
                         }
                     }
@@ -240,7 +277,7 @@ class UserCommand(Command):
                     "list": {
                         "kwargs": {
                             "aliases": ["show"],
-                            "parents": [single_user],
+                            "parents": [single_user, output_format],
                             "help": "List public keys for a user"
                         }
                     },
@@ -280,47 +317,32 @@ class UserCommand(Command):
     }
 
     def _get_unique_id_number(self, *args_ignored):
-        """Suggest a unique user ID number"""
+        """Reserve a unique user ID number"""
 
-        umin = cfg.user.nuid.min
-        umax = cfg.user.nuid.max
-        attr_name = cfg.user.attr.nuid
+        # read numbers in use once per command
+        try:
+            allocator = self._allocator
+        except AttributeError:
+            allocator = self._allocator = NumberAllocator()
 
-        n = 50 # candidates for the unique UID
-        candidates = set( random.randint(umin, umax) for i in range(n) )
+        return allocator.reserve()[0]
 
-        # find existing UIDs, and remove them from the list of candidates
-        for base in (cfg.user.base.suspended, cfg.user.base.active):
-            users = UserMapping(base = base, attrs = attr_name)
-            try:
-                query = attr_name + ": " + "; ".join( map(str, candidates) )
-                users.select(query)
-            except MissingObjects:
-                pass
-
-            collisions = set( user[attr_name].value for user in users.values() )
-            candidates -= collisions
-            if collisions:
-                log.debug("UID collisions skipped: " + " ".join(map(str, collisions)))
+    def _nuid_unique(self, number):
+        """Check if numeric user ID is not in use, and reserve it"""
 
         try:
-            # randomly return one of the remaining candidates
-            return random.choice(list(candidates))
-        except IndexError as err:
-            raise RuntimeError("Couldn't create a unique UID in %i attempts" % n) from err
+            allocator = self._allocator
+        except AttributeError:
+            allocator = self._allocator = NumberAllocator()
+
+        allocator.claim( int(number) )
+        return number
 
     def _uid_unique(self, uid):
         """Check if user ID is unique among active and suspended users"""
 
-        query = "%s: %s" % (cfg.user.attr.uid, uid)
         for base in (cfg.user.base.suspended, cfg.user.base.active):
-            collisions = UserMapping(base = base)
-            try:
-                collisions.select(query)
-            except MissingObjects:
-                pass
-
-            if collisions:
+            if uid in UserMapping(base = base):
                 raise RuntimeError("UID %s already in use" % uid)
 
         return uid
@@ -334,7 +356,8 @@ class UserCommand(Command):
             base_to = cfg.user.base.suspended
 
         users = UserMapping(base = base_from)
-        users.select(usernames).move(base_to)
+        with self._journal() as journal, References() as references:
+            users.select(usernames).move(base_to, journal = journal, references = references)
 
     def _list_users(self, filter = None):
         if self._args.suspended:
@@ -343,12 +366,23 @@ class UserCommand(Command):
             base = cfg.user.base.active
 
         users = UserMapping(base = base)
-        for uid in users.select(filter):
-            print(uid)
+        if filter is None:
+            users.from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for uid in users.select(filter):
+                output.write_item({"id": uid})
 
     def on_user_list(self):
         self._list_users()
 
+    def on_user_count(self):
+        if self._args.suspended:
+            base = cfg.user.base.suspended
+        else:
+            base = cfg.user.base.active
+
+        print( len(UserMapping(base = base).from_replica(self._args.max_staleness)) )
+
     def on_user_search(self):
         self._list_users(filter = self._args.filter)
 
@@ -358,11 +392,8 @@ class UserCommand(Command):
         else:
             base = cfg.user.base.active
 
-        # TODO: operational attributes
-        users = UserMapping(base = base, attrs = ALL_ATTRIBUTES)
-        users.select( self._args_or_stdin("username") )
-        for user_entry in users.values():
-            pretty_print(user_entry)
+        users = UserMapping(base = base, attrs = self._projection(UserMapping)).from_replica(self._args.max_staleness)
+        self._show(users, "username")
 
     def on_user_suspend(self):
         usernames = self._args_or_stdin("username")
@@ -375,14 +406,37 @@ class UserCommand(Command):
     def on_user_delete(self):
         usernames = self._args_or_stdin("username")
         users = UserMapping(base = cfg.user.base.suspended)
-        users.select(usernames).delete()
+        with self._journal() as journal, References() as references:
+            users.select(usernames).delete(journal = journal, references = references)
+
+    @staticmethod
+    def _read_pairs(file_object):
+        with file_object:
+            for line_number, line in enumerate(file_object, start = 1):
+                words = line.split()
+                if not words or words[0].startswith("#"):
+                    continue
+                if len(words) != 2:
+                    raise ValueError("Line %i: expected OLD_NAME NEW_NAME" % line_number)
+                yield tuple(words)
 
     def on_user_rename(self):
         base = cfg.user.base.active
 
         users = UserMapping(base = base)
+        if self._args.rename_file:
+            if self._args.oldname:
+                raise ValueError("Either names or --file expected, not both")
+            with self._journal() as journal, References() as references:
+                users.rename_many(self._read_pairs(self._args.rename_file),
+                        journal = journal, references = references)
+            return
+        elif not self._args.newname:
+            raise ValueError("Old and new names expected")
+
         try:
-            users.rename(self._args.oldname, self._args.newname)
+            with References() as references:
+                users.rename(self._args.oldname, self._args.newname, references = references)
         except LDAPEntryAlreadyExistsResult as err:
             msg = "User '%s' already exists" % self._args.newname
             raise RuntimeError(msg) from err
@@ -396,13 +450,7 @@ class UserCommand(Command):
         else:
             source_obj = None
 
-        pre = {
-            cfg.user.attr.nuid: self._get_unique_id_number,
-            cfg.user.attr.uid: self._uid_unique,
-            cfg.user.attr.passwd: User.make_password
-        }
-
-        user = User(reference_object = source_obj, pre = pre)
+        user = User(reference_object = source_obj, pre = self._callbacks_pre())
 
         # Write the object to LDAP
         uid = user.attrs[User.attribute]
@@ -413,14 +461,46 @@ class UserCommand(Command):
         if user.message:
             print(user.message)
 
-    def _get_user(self, username, attrs = None):
+    def _callbacks_pre(self):
+        return {
+            cfg.user.attr.nuid: self._get_unique_id_number,
+            cfg.user.attr.uid: self._uid_unique,
+            cfg.user.attr.passwd: User.make_password
+        }
+
+    def on_user_export(self):
+        if self._args.suspended:
+            base = cfg.user.base.suspended
+        else:
+            base = cfg.user.base.active
+
+        export(UserMapping(base = base),
+                export_format = self._args.export_format,
+                output = self._args.output,
+                compress = self._args.compress,
+                resume = self._args.resume)
+
+    def on_user_import(self):
+        pre = self._callbacks_pre()
+        checks = {
+            cfg.user.attr.nuid: self._nuid_unique,
+            cfg.user.attr.uid: self._uid_unique
+        }
+        records = read_records(self._args.file, self._args.input_format)
+        users = UserMapping(base = cfg.user.base.active)
+        import_records(users, records, User, pre = pre, checks = checks)
+
+    def _get_user(self, username, attrs = None, writable = False):
         users = UserMapping(base = cfg.user.base.active, attrs = attrs)
-        return users[username]
+        if writable:
+            return users.writable(username)
+        else:
+            return users[username]
 
     def on_user_passwd(self):
         username = self._args.username
         passwd_attr = cfg.user.attr.passwd
-        user = self._get_user(username).entry_writable()
+        user = self._get_user(username, writable = True)
         password = User.make_password()
 
         setattr(user, passwd_attr, password)
@@ -430,52 +510,52 @@ class UserCommand(Command):
 
     def on_user_key_list(self):
         username = self._args.username
+        pubkey_attr = cfg.user.attr.pubkey
+        user = self._get_user(username, pubkey_attr)
 
-        def get_keys():
-            pubkey_attr = cfg.user.attr.pubkey
-
-            user = self._get_user(username, pubkey_attr)
-
-            try:
-                keys = user[pubkey_attr]
-            except LDAPKeyError:
-                log.info("User %s has no public keys" % usernames)
-                keys = []
-
-            return keys
-
-        for key in get_keys():
-            if type(key) is bytes:
-                key_string = key.decode("utf-8")
-            elif type(key) is str:
-                key_string = key
-            else:
-                raise TypeError("Public key must be bytes or str")
+        try:
+            keys = user[pubkey_attr].values
+        except LDAPKeyError:
+            log.info("User %s has no public keys" % username)
+            keys = []
 
-            try:
-                pk = SSHKey(key_string)
-                pk.parse()
-                if pk.comment:
-                    output = "%s (%s)" % (pk.hash_md5(), pk.comment)
+        with Output(self._args.output_format, ["fingerprint", "comment"]) as output:
+            for key in keys:
+                if type(key) is bytes:
+                    key_string = key.decode("utf-8")
+                elif type(key) is str:
+                    key_string = key
                 else:
-                    output = pk.hash_md5()
-            except NotImplementedError as err:
-                log.warning("User %s has an unsupported key: %s" % (username, err))
-                output = "(Unsupported key)"
-            except InvalidKeyError as err:
-                log.error("User %s has an invalid key: %s" % (username, err))
-                output = "(Invalid key)"
+                    raise TypeError("Public key must be bytes or str")
 
-            print(output)
+                item = {"fingerprint": None, "comment": None}
+                try:
+                    pk = SSHKey(key_string)
+                    pk.parse()
+                    item = {"fingerprint": pk.hash_md5(), "comment": pk.comment}
+                    if pk.comment:
+                        text = "%s (%s)" % (pk.hash_md5(), pk.comment)
+                    else:
+                        text = pk.hash_md5()
+                except NotImplementedError as err:
+                    log.warning("User %s has an unsupported key: %s" % (username, err))
+                    text = "(Unsupported key)"
+                except InvalidKeyException as err:
+                    log.error("User %s has an invalid key: %s" % (username, err))
+                    text = "(Invalid key)"
+
+                output.write_item(item, text)
 
     def on_user_key_add(self):
         username = self._args.username
 
         # get the writable entry
         pubkey_attr = cfg.user.attr.pubkey
-        user = self._get_user(username, pubkey_attr).entry_writable()
+        user = self._get_user(username, pubkey_attr, writable = True)
 
         keys = user[pubkey_attr]
+        index = None
+        added = []
 
         # parse each key; warn on unsupported, fail on invalid
         for key_string in self._args_or_stdin("key_file"):
@@ -484,14 +564,31 @@ class UserCommand(Command):
                 pk.parse()
             except NotImplementedError as err:
                 log.warning("Unsupported key: %s" % err)
+                pk = None
+
+            # reject keys registered to anyone, whatever the comment; owners
+            # are read afresh, as another admin may have just added the key
+            if pk:
+                if index is None:
+                    index = key_index(max_age = 0)
+                owners = [ id for id, dn, key in index.find(pk.hash_sha256()) ]
+                if owners:
+                    raise RuntimeError("Key %s already registered to %s"
+                            % (pk.hash_sha256(), ", ".join(sorted(set(owners)))))
 
             keys += key_string
+            added.append(key_string)
 
         try:
             user.entry_commit_changes(refresh = False)
         except LDAPAttributeOrValueExistsResult as err:
             raise RuntimeError("Key already exists") from err
 
+        # later additions see these keys, however old the index is
+        if index is not None:
+            for key_string in added:
+                index.add(username, user.entry_dn, key_string.encode("utf-8"))
+
     def on_user_key_delete(self):
         username = self._args.username
         re_md5 = re.compile(r"([0-9A-Fa-f]{2}.?){15}[0-9A-Fa-f]{2}$")
@@ -516,7 +613,7 @@ class UserCommand(Command):
         # get the writable entry
         pubkey_attr = cfg.user.attr.pubkey
 
-        user = self._get_user(username, pubkey_attr).entry_writable()
+        user = self._get_user(username, pubkey_attr, writable = True)
 
         try:
             keys = user[pubkey_attr]
@@ -541,6 +638,7 @@ class UserCommand(Command):
                         del keys_to_delete[item]
 
             user.entry_commit_changes(refresh = False)
+            KeyIndex.invalidate()
 
             if keys_to_delete:
                 missing_keys = ", ".join( keys_to_delete.values() )
@@ -550,17 +648,19 @@ class UserCommand(Command):
             log.info("User %s has no public keys" % username)
 
     def on_user_unit_list(self):
-        units = UnitMapping(cfg.user.base.active)
-        for unit in units:
-            print(unit)
+        units = UnitMapping(cfg.user.base.active).from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for unit in units:
+                output.write_item({"id": unit})
 
     def on_user_unit_show(self):
-        units = UnitMapping(cfg.user.base.active)
+        units = UnitMapping(cfg.user.base.active).from_replica(self._args.max_staleness)
         base = units[self._args.unit].entry_dn
 
-        users = UserMapping(base = base, sub_tree = self._args.full)
-        for uid in users:
-            print(uid)
+        users = UserMapping(base = base, sub_tree = self._args.full).from_replica(self._args.max_staleness)
+        with Output(self._args.output_format) as output:
+            for uid in users:
+                output.write_item({"id": uid})
 
     def on_user_unit_add(self):
         units = UnitMapping(cfg.user.base.active)
@@ -582,4 +682,5 @@ class UserCommand(Command):
 
         users = UserMapping(base = base)
         users.select(self._args_or_stdin("username"))
-        users.move(unit.entry_dn)
+        with self._journal() as journal, References() as references:
+            users.move(unit.entry_dn, journal = journal, references = references)
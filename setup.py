@@ -16,6 +16,9 @@ setup(
             "ldap3 >= 2.2.3",
             "sshpubkeys >= 2.2.0"
             ],
+        extras_require = {
+            "zstd": ["zstandard"]
+            },
         entry_points = {
             "console_scripts": [
                 "ldadm = ldadm.main:main"
@@ -0,0 +1,55 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import os, tempfile
+
+import pytest
+
+_config = """---
+ldap:
+  uri: ldap://ldap.example.org
+  paged_search_size: 500
+user:
+  base:
+    active: ou=people,dc=example,dc=org
+    suspended: ou=suspended,dc=example,dc=org
+  nuid:
+    min: 1000
+    max: 1999
+  attr:
+    uid: uid
+    nuid: uidNumber
+    passwd: userPassword
+    pubkey: sshPublicKey
+  objectclass:
+    - inetOrgPerson
+    - posixAccount
+server:
+  base: ou=servers,dc=example,dc=org
+  objectclass: device
+  attr:
+    id: cn
+project:
+  base: ou=projects,dc=example,dc=org
+  objectclass: groupOfNames
+  attr:
+    id: cn
+    member: member
+    manager: owner
+"""
+
+# the config is loaded when ldadm modules are imported, so write it first
+_root = tempfile.mkdtemp(prefix = "ldadm-test-")
+with open(os.path.join(_root, "ldadm.yml"), "w") as file_object:
+    file_object.write(_config)
+
+os.environ["XDG_CONFIG_HOME"] = _root
+os.environ["XDG_CACHE_HOME"] = os.path.join(_root, "cache")
+os.environ.pop("LDADM_SOCKET", None)
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Empty cache directory for the test"""
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    return tmp_path
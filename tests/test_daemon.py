@@ -0,0 +1,51 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import sys, threading
+
+from ldadm import client, daemon
+
+class _EchoDaemon(daemon.Daemon):
+    """Write arguments and standard input back, instead of running commands"""
+
+    def execute(self, request, stdin, stdout, stderr):
+        stdout.write(" ".join(request["argv"]) + "\n")
+        stdout.write(stdin.read())
+        stderr.write("done\n")
+        return 3
+
+def _serve_one(path):
+    server = _EchoDaemon(path, daemon._RequestHandler)
+    thread = threading.Thread(target = server.handle_request)
+    thread.start()
+    return server, thread
+
+def test_forward_round_trip(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "ldadm.sock")
+    monkeypatch.setenv("LDADM_SOCKET", path)
+
+    # more than one frame and one read of the socket
+    data = "".join("u%i\n" % number for number in range(50000))
+    input_file = tmp_path / "input"
+    input_file.write_text(data)
+
+    server, thread = _serve_one(path)
+    try:
+        with open(str(input_file)) as stdin:
+            monkeypatch.setattr(sys, "stdin", stdin)
+            status = client.forward(["user", "show"])
+    finally:
+        thread.join()
+        server.server_close()
+
+    captured = capsys.readouterr()
+    assert status == 3
+    assert captured.out == "user show\n" + data
+    assert captured.err == "done\n"
+
+def test_forward_skips_long_commands(tmp_path, monkeypatch):
+    monkeypatch.setenv("LDADM_SOCKET", str(tmp_path / "ldadm.sock"))
+    (tmp_path / "ldadm.sock").touch()
+
+    assert client.forward(["user", "export"]) is None
+    assert client.forward(["replica", "sync"]) is None
@@ -0,0 +1,53 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import os
+
+import pytest
+
+from ldadm.journal import Journal
+
+def _fail_after(ids, key = "key"):
+    """Record IDs, then fail like an interrupted bulk command"""
+
+    with pytest.raises(RuntimeError):
+        with Journal("user_delete", key) as journal:
+            for id in ids:
+                journal.record([id], "uid=%s,ou=people,dc=example,dc=org" % id, None)
+            raise RuntimeError("Connection lost")
+
+def test_resume_skips_recorded_ids(cache):
+    _fail_after(["u1", "U2"])
+
+    with Journal("user_delete", "key", resume = True) as journal:
+        assert "u1" in journal
+        assert "u2" in journal # IDs match case-insensitively
+        assert "u3" not in journal
+        assert journal.changes == [
+            ("uid=u1,ou=people,dc=example,dc=org", None),
+            ("uid=U2,ou=people,dc=example,dc=org", None)
+        ]
+
+def test_run_without_resume_starts_over(cache):
+    _fail_after(["u1"])
+
+    with Journal("user_delete", "key") as journal:
+        assert "u1" not in journal
+        assert journal.changes == []
+
+def test_journal_per_arguments(cache):
+    _fail_after(["u1"], key = "one")
+
+    with Journal("user_delete", "other", resume = True) as journal:
+        assert "u1" not in journal
+
+def test_success_removes_journal(cache):
+    with Journal("user_delete", "key") as journal:
+        journal.record(["u1"])
+
+    assert os.listdir(str(cache / "ldadm" / "journal")) == []
+
+def test_concurrent_run_refused(cache):
+    with Journal("user_delete", "key"):
+        with pytest.raises(RuntimeError, match = "same arguments is running"):
+            Journal("user_delete", "key")
@@ -0,0 +1,30 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import pytest
+
+from ldadm.keyindex import normalize_fingerprint
+
+_sha256 = "djZtuUwhAcd3++3dmFxBJp+dOXz9cOzVBE4exQh0VXw"
+
+def test_sha256():
+    assert normalize_fingerprint("SHA256:" + _sha256) == "SHA256:" + _sha256
+    assert normalize_fingerprint(_sha256 + "=") == "SHA256:" + _sha256
+    assert normalize_fingerprint("  SHA256:%s\n" % _sha256) == "SHA256:" + _sha256
+
+def test_md5():
+    expected = "MD5:0a:1b:2c:3d:4e:5f:60:71:82:93:a4:b5:c6:d7:e8:f9"
+
+    assert normalize_fingerprint(expected) == expected
+    assert normalize_fingerprint("0A1B2C3D4E5F60718293A4B5C6D7E8F9") == expected
+    assert normalize_fingerprint("md5:0a:1b:2c:3d:4e:5f:60:71:82:93:a4:b5:c6:d7:e8:f9") == expected
+
+@pytest.mark.parametrize("fingerprint", [
+    "",
+    "SHA256:" + _sha256[:-1],
+    "MD5:0a:1b:2c",
+    "SHA1:" + _sha256
+])
+def test_invalid(fingerprint):
+    with pytest.raises(ValueError, match = "Invalid fingerprint"):
+        normalize_fingerprint(fingerprint)
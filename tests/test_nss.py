@@ -0,0 +1,58 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import os, stat
+
+from ldadm.nss import _Map
+
+def _index(file_name):
+    """Parse index lines into (key, offset, line length)"""
+
+    with open(file_name, "rb") as file_object:
+        lines = file_object.read().split(b"\n")[:-1]
+
+    result = []
+    for line in lines:
+        key, offset, padding = line.split(b"\0", 2)
+        assert padding.strip(b"\0") == b""
+        result.append( (key.decode("utf-8"), int(offset), len(line)) )
+
+    return result
+
+def test_write_index_layout(tmp_path):
+    passwd = _Map("passwd", 0o644, {"byname": 0, "byuid": 2})
+    passwd.add(["carol", "x", 1010, 100, "Carol: C", "/home/carol", "/bin/sh"])
+    passwd.add(["alice", "x", 1002, 100, "Alice", "/home/alice", "/bin/sh"])
+    passwd.add(["bob", "x", 998, 100, None, "/home/bob", "/bin/sh"])
+    passwd.write(str(tmp_path))
+
+    file_name = str(tmp_path / "passwd.cache")
+    with open(file_name, "rb") as file_object:
+        data = file_object.read()
+
+    # sorted by name, with fields made safe to split on colons
+    assert data.decode("utf-8").splitlines() == [
+        "alice:x:1002:100:Alice:/home/alice:/bin/sh",
+        "bob:x:998:100::/home/bob:/bin/sh",
+        "carol:x:1010:100:Carol  C:/home/carol:/bin/sh"
+    ]
+    assert stat.S_IMODE(os.stat(file_name).st_mode) == 0o644
+
+    for index_name, column in (("byname", 0), ("byuid", 2)):
+        index = _index(file_name + ".ix" + index_name)
+
+        # sorted by key, lines padded to the same length
+        assert [ key for key, offset, length in index ] \
+                == sorted( key for key, offset, length in index )
+        assert len( set( length for key, offset, length in index ) ) == 1
+
+        # offsets point at the map line with the key
+        for key, offset, length in index:
+            line = data[offset:].split(b"\n", 1)[0].decode("utf-8")
+            assert line.split(":")[column] == key
+
+def test_write_empty(tmp_path):
+    _Map("group", 0o644, {"byname": 0}).write(str(tmp_path))
+
+    assert (tmp_path / "group.cache").read_bytes() == b""
+    assert (tmp_path / "group.cache.ixbyname").read_bytes() == b""
@@ -0,0 +1,50 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import pytest
+
+from ldadm.nuid import NumberBitmap
+
+def _bitmap(used, low = 1000, high = 1031):
+    bitmap = NumberBitmap(low, high)
+    for number in used:
+        bitmap.add(number)
+    return bitmap
+
+def test_find_block_lowest_free():
+    bitmap = _bitmap([1000, 1001, 1003])
+
+    assert bitmap.find_block(1) == 1002
+    assert bitmap.find_block(2) == 1004
+
+def test_find_block_skips_full_bytes():
+    bitmap = _bitmap(range(1000, 1016))
+
+    assert bitmap.find_block(1) == 1016
+    assert list(bitmap.free())[:2] == [1016, 1017]
+
+def test_find_block_run_across_gaps():
+    bitmap = _bitmap([1002, 1005, 1009])
+
+    assert bitmap.find_block(3) == 1006
+    assert bitmap.find_block(4) == 1010
+
+def test_find_block_from_start():
+    bitmap = _bitmap([1020])
+
+    assert bitmap.find_block(2, start = 1019) == 1021
+    assert bitmap.find_block(1, start = 900) == 1000
+
+def test_find_block_exhausted():
+    bitmap = _bitmap(range(1000, 1030))
+
+    assert bitmap.find_block(2) == 1030
+    with pytest.raises(RuntimeError, match = "No 3 free"):
+        bitmap.find_block(3)
+
+def test_numbers_out_of_range_ignored():
+    bitmap = _bitmap([999, 1032])
+
+    assert 999 not in bitmap
+    assert 1032 not in bitmap
+    assert bitmap.find_block(32) == 1000
@@ -0,0 +1,69 @@
+# Copyright 2017, Development Gateway, Inc.
+# This file is part of ldadm, see COPYING.
+
+import pytest
+
+from ldadm.template import TemplatePlan
+
+class _AttrDef:
+    def __init__(self, key, mandatory = False):
+        self.key = key
+        self.mandatory = mandatory
+
+def _object_class(templates):
+    """Stand-in for an LdapObject class, with a fixed set of attributes"""
+
+    names = ["uid", "cn", "sn", "givenName", "mail", "displayName"]
+
+    class Object:
+        _config_node = None
+        _required_attrs = []
+        _object_def = [ _AttrDef(name, mandatory = name == "sn") for name in names ]
+        attribute = "uid"
+
+        @classmethod
+        def _read_templates(cls):
+            return templates
+
+        @classmethod
+        def _read_modifiers(cls):
+            return {}
+
+        @classmethod
+        def _canonicalize_name(cls, raw_name):
+            for name in names:
+                if name.lower() == raw_name.lower():
+                    return [name]
+            raise KeyError(raw_name)
+
+    return Object
+
+def test_dependencies_ordered_first():
+    plan = TemplatePlan( _object_class({
+        "uid": "{cn}",
+        "cn": "{givenName} {SN}",
+        "mail": ["{uid}@example.org"]
+    }) )
+    order = plan.order
+
+    assert order.index("givenName") < order.index("cn")
+    assert order.index("sn") < order.index("cn")
+    assert order.index("cn") < order.index("uid") < order.index("mail")
+
+def test_cycle_detected():
+    cls = _object_class({
+        "uid": "{cn}",
+        "cn": "{displayName}",
+        "displayName": "{uid:.3}"
+    })
+
+    with pytest.raises(ValueError, match = "Templates refer to each other: .* -> "):
+        TemplatePlan(cls)
+
+def test_unknown_attribute():
+    with pytest.raises(ValueError, match = "Unknown attribute in template: nickname"):
+        TemplatePlan( _object_class({"cn": "{nickname}"}) )
+
+def test_positional_field():
+    with pytest.raises(ValueError, match = "Positional field"):
+        TemplatePlan( _object_class({"cn": "{0}"}) )